@@ -0,0 +1,61 @@
+"""
+Per-message decode cost and allocations of Alor order book frames.
+
+Compares json.loads + dict levels (the previous parse_assets_out path) with
+utils.codec.decode_order_book. Run from the repository root:
+    python -m benchmarks.bench_alor_decode --frames 20000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from benchmarks.generators import AlorFeed
+from utils import codec
+
+
+def decode_dicts(frame: str, known_guids) -> tuple | None:
+    data = json.loads(frame)
+    if data.get('guid') not in known_guids:
+        return None
+    trading_data = data['data']
+    return data['guid'], trading_data.get('bids', []), trading_data.get('asks', []), trading_data.get('timestamp', 0)
+
+
+def measure(name: str, decode, frames: list, known_guids) -> None:
+    started = time.perf_counter()
+    for frame in frames:
+        decode(frame, known_guids)
+    elapsed = time.perf_counter() - started
+
+    # Allocations of the objects a decoded frame keeps alive
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [decode(frame, known_guids) for frame in frames[:1000]]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    print(f'{name:<14} {elapsed / len(frames) * 1e6:8.2f} us/msg  '
+          f'{blocks / len(kept):8.1f} blocks/msg  {size / len(kept):8.0f} bytes/msg')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--depth', type=int, default=10)
+    parser.add_argument('--instruments', type=int, default=9)
+    args = parser.parse_args()
+
+    feed = AlorFeed([f'STOCK{i}' for i in range(args.instruments)], args.depth)
+    known_guids = set(feed.guids.values())
+    frames = feed.frames(args.frames)
+    print(f'{args.frames} frames, depth {args.depth}, JSON backend: {codec.JSON_BACKEND}')
+    measure('json dicts', decode_dicts, frames, known_guids)
+    measure('codec.loads', lambda frame, guids: codec.loads(frame), frames, known_guids)
+    measure('decode_order_book', codec.decode_order_book, frames, known_guids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Calculate.start against BatchCalculate on synthetic order tables.
+
+Run from the repository root:
+    python -m benchmarks.bench_calculate_batch --sizes 10 1000 100000
+"""
+import argparse
+import random
+import time
+
+import utils.data as td
+from tasks.calculate import Calculate, convert_tv_to_moex_features
+from tasks.calculate_batch import BatchCalculate
+
+
+FEATURES_SUBST = {'SV': 'SILV', 'GD': 'GOLD', 'NA': 'NASD', 'SF': 'SPYF', 'PT': 'PLT', 'PD': 'PLD'}
+FEATURES = {
+    'ED1!/EURUSD': {'ED1!': 1000, 'EURUSD': 100000},
+    'SV1!/XAGUSD': {'SV1!': 10, 'XAGUSD': 5000},
+    'GD1!/XAUUSD': {'GD1!': 1, 'XAUUSD': 100},
+}
+STOCKS = {'TATN-TATNP': (735, 715), 'MTLR-MTLRP': (101, 100), 'SBER-SBERP': (310, 305)}
+FOREX = {'ED1!/EURUSD': (1.14, 1.15), 'SV1!/XAGUSD': (31.5, 31.2), 'GD1!/XAUUSD': (2300, 2310)}
+
+
+def build_books() -> tuple[dict, dict]:
+    moex = {}
+    forex = {}
+    for pair, prices in STOCKS.items():
+        for name, price in zip(pair.split('-'), prices):
+            book = moex[name] = td.OrderBook(name)
+            book.update_levels([(price - 0.5 * i, 100) for i in range(10)], [(price + 0.5 * (i + 1), 100) for i in range(10)], 0)
+    for pair, prices in FOREX.items():
+        future, currency = pair.split('/')
+        for book_source, name, price in ((moex, convert_tv_to_moex_features(FEATURES_SUBST, future), prices[0]),
+                                         (forex, currency, prices[1])):
+            book = book_source[name] = td.OrderBook(name)
+            book.update_levels([(price * (1 - 0.0001 * i), 10) for i in range(10)],
+                               [(price * (1 + 0.0001 * (i + 1)), 10) for i in range(10)], 0)
+    return moex, forex
+
+
+def build_orders(count: int) -> list:
+    orders = []
+    for i in range(count):
+        if i % 2:
+            asset = random.choice(list(STOCKS))
+            price1, price2 = STOCKS[asset]
+            lot = random.choice((-100, 100))
+            lots = (lot, -lot)
+        else:
+            asset = random.choice(list(FOREX))
+            price1, price2 = FOREX[asset]
+            lots = random.choice(((-10, 0.15), (10, -0.15)))
+        orders.append({
+            'asset': asset,
+            'lot1': str(lots[0]), 'price1': str(price1), 'lot2': str(lots[1]), 'price2': str(price2),
+            'ent_av': '', 'cur_av': '', 'exit': random.choice(('', '', '', str(price1 - price2))), 'profit': '', 'mc': '',
+        })
+    return orders
+
+
+def table(orders: list) -> dict:
+    return {'usdrub': '83.45', 'payout': '7', 'mc_stocks': '118000', 'mc_features': '236000',
+            'orders': [dict(order) for order in orders]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000])
+    args = parser.parse_args()
+
+    moex, forex = build_books()
+    for size in args.sizes:
+        orders = build_orders(size)
+        calculate = Calculate(moex, forex, FEATURES_SUBST, FEATURES)
+        calculate.BATCH_ORDERS = size + 1     # the scalar path at every size
+        calculate.data = table(orders)
+        started = time.perf_counter()
+        calculate.start([])
+        scalar = time.perf_counter() - started
+
+        batch = Calculate(moex, forex, FEATURES_SUBST, FEATURES)
+        batch.data = table(orders)
+        started = time.perf_counter()
+        BatchCalculate(batch).start()
+        vectorized = time.perf_counter() - started
+
+        mismatches = sum(
+            1 for a, b in zip(calculate.data['orders'], batch.data['orders'])
+            for field in ('ent_av', 'cur_av', 'mc', 'profit', 'position1', 'position2')
+            if a.get(field) != b.get(field)
+        )
+        print(f'{size:>7} orders  Calculate.start {scalar * 1e3:10.2f} ms  BatchCalculate {vectorized * 1e3:10.2f} ms  '
+              f'x{scalar / vectorized:6.1f}  mismatched fields: {mismatches}')
+
+
+if __name__ == '__main__':
+    main()
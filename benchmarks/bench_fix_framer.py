@@ -0,0 +1,77 @@
+"""
+Compare the FIX framing loop of AsyncFixClient.listen with FixFramer.
+
+Run from the repository root:
+    python -m benchmarks.bench_fix_framer --messages 20000
+"""
+import argparse
+import time
+
+import simplefix
+
+from benchmarks.generators import FixFeed
+from utils.fix import FixFramer, decode_frame
+
+
+def chunks(stream: bytes, size: int) -> list:
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def legacy_loop(reads: list) -> int:
+    '''Framing loop of AsyncFixClient.listen before FixFramer, without message processing'''
+    count = 0
+    buffer = bytearray()
+    for data in reads:
+        buffer.extend(data)
+        messages_found = True
+        while messages_found and buffer:
+            temp_parser = simplefix.FixParser()
+            temp_parser.append_buffer(bytes(buffer))
+            msg = temp_parser.get_message()
+            if msg is None:
+                messages_found = False
+            else:
+                count += 1
+                msg_len = len(msg.encode())
+                if msg_len <= len(buffer):
+                    buffer = buffer[msg_len:]
+                else:
+                    buffer.clear()
+    return count
+
+
+def framer_loop(reads: list) -> int:
+    count = 0
+    framer = FixFramer()
+    for data in reads:
+        framer.feed(data)
+        for frame in framer.frames():
+            decode_frame(frame)
+            count += 1
+    return count
+
+
+def run(name: str, loop, reads: list, expected: int) -> None:
+    started = time.perf_counter()
+    count = loop(reads)
+    elapsed = time.perf_counter() - started
+    status = '' if count == expected else f' (decoded {count} of {expected})'
+    print(f'{name:<8} {count / elapsed:>12,.0f} msg/s  {elapsed:8.3f} s{status}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--entries', type=int, default=10)
+    parser.add_argument('--read-size', type=int, default=65536, help='bytes delivered per socket read')
+    args = parser.parse_args()
+
+    stream = b''.join(FixFeed(entries=args.entries).messages(args.messages))
+    reads = chunks(stream, args.read_size)
+    print(f'{args.messages} messages, {len(stream)} bytes, {len(reads)} reads of {args.read_size} bytes')
+    run('legacy', legacy_loop, reads, args.messages)
+    run('framer', framer_loop, reads, args.messages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Throughput and p50/p99/p99.9 latency of every stage of the feed pipeline:
+FIX framing, FIX decoding, cTrader book update, Alor decoding, Alor book update,
+tick recording and Calculate.start after a book update.
+
+Run from the repository root, AsyncFixClient reads config.json there. Results can be saved and compared between commits:
+    python -m benchmarks.bench_pipeline --output before.json
+    python -m benchmarks.bench_pipeline --baseline before.json
+"""
+import argparse
+import json
+import random
+import shutil
+import tempfile
+
+import utils.data as td
+from benchmarks.bench_calculate_batch import FEATURES, FEATURES_SUBST, build_books, build_orders, table
+from benchmarks.generators import AlorFeed, FixFeed
+from benchmarks.harness import measure, print_results, write_results
+from tasks.calculate import Calculate
+from tasks.forex import AsyncFixClient
+from utils.codec import decode_order_book
+from utils.fix import FixFramer, decode_md_entries
+from utils.recorder import TickRecorder
+
+
+def bench_fix(args) -> list:
+    messages = FixFeed(entries=args.entries).messages(args.messages)
+    stream = b''.join(messages)
+    reads = [stream[i:i + args.read_size] for i in range(0, len(stream), args.read_size)]
+
+    framer = FixFramer()
+    frames = []
+
+    def frame(data: bytes) -> None:
+        framer.feed(data)
+        frames.extend(bytes(frame) for frame in framer.frames())
+
+    results = [measure('fix_framing', frame, reads, len(messages))]
+
+    decoded = []
+    results.append(measure('fix_decode', lambda data: decoded.append(decode_md_entries(data)[1]), frames))
+
+    # Not connected, update_md is what the client runs for every received market data message
+    client = AsyncFixClient()
+    results.append(measure('fix_book_update', client.update_md, decoded))
+    return results
+
+
+def bench_alor(args) -> tuple[list, list]:
+    feed = AlorFeed(depth=args.depth)
+    frames = feed.frames(args.frames)
+    known_guids = set(feed.guids.values())
+    decoded = []
+    results = [measure('alor_decode', lambda frame: decoded.append(decode_order_book(frame, known_guids)), frames)]
+    books = {guid: td.OrderBook(guid) for guid in known_guids}
+    results.append(measure('alor_book_update', lambda item: books[item[0]].update(item[1], item[2], item[3]), decoded))
+    return results, list(books.values())
+
+
+def bench_recorder(books: list, updates: int) -> dict:
+    directory = tempfile.mkdtemp(prefix='bench-ticks-')
+    recorder = TickRecorder(directory, segment_records=max(2 * updates, 1000))
+    try:
+        inputs = [random.choice(books) for _ in range(updates)]
+        return measure('tick_record', lambda book: recorder.record_book('alor', book.instrument_uid, book), inputs)
+    finally:
+        recorder.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_calculate(args) -> dict:
+    moex, forex = build_books()
+    calculate = Calculate(moex, forex, FEATURES_SUBST, FEATURES)
+    calculate.data = table(build_orders(args.orders))
+    calculate.start([])
+    rng = random.Random(0)
+    inputs = []
+    for _ in range(args.calculations):
+        book = rng.choice(list(moex.values()))
+        shift = rng.choice((-0.01, 0.01))
+        inputs.append((book, [(price + shift, volume) for price, volume in zip(*book.bids())],
+                       [(price + shift, volume) for price, volume in zip(*book.asks())]))
+
+    def update(item: tuple) -> None:
+        book, bids, asks = item
+        book.update_levels(bids, asks, 0)
+        calculate.start([])
+
+    return measure('calculate_start', update, inputs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000, help='FIX messages')
+    parser.add_argument('--entries', type=int, default=10, help='NoMDEntries per FIX message')
+    parser.add_argument('--read-size', type=int, default=4096, help='bytes delivered per socket read')
+    parser.add_argument('--frames', type=int, default=20000, help='Alor frames')
+    parser.add_argument('--depth', type=int, default=20, help='Alor levels per side')
+    parser.add_argument('--orders', type=int, default=100, help='orders in the Calculate table')
+    parser.add_argument('--calculations', type=int, default=5000, help='book updates followed by Calculate.start')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='results JSON of another run to compare with')
+    args = parser.parse_args()
+
+    random.seed(0)
+    results = bench_fix(args)
+    alor_results, books = bench_alor(args)
+    results += alor_results
+    results.append(bench_recorder(books, args.frames))
+    results.append(bench_calculate(args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        write_results(args.output, results, vars(args))
+
+
+if __name__ == '__main__':
+    main()
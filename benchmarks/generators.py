@@ -0,0 +1,158 @@
+"""
+Synthetic feed traffic for the benchmarks.
+
+FixFeed produces cTrader 35=W snapshots and 35=X incremental refreshes shaped like
+the sample in trash.txt, with live entry ids so deletes refer to quotes that exist.
+AlorFeed produces OrderBookGetAndSubscribe frames in "Simple" format. Both are
+seeded random walks, so the same arguments give the same traffic.
+"""
+import json
+import random
+
+import simplefix
+
+from tasks.forex import CTRADER_SYMBOLS
+
+
+# Rough mid prices of the cTrader assets, anything else starts at 100
+MIDS = {
+    'EURUSD': 1.14417,
+    'XAUUSD': 3350.5,
+    'XAGUSD': 34.52,
+    'XPDUSD': 1010.3,
+    'XPTUSD': 1080.7,
+    'SP500USD': 5930.4,
+    'NAS100USD': 21410.2,
+}
+FIRST_ENTRY_ID = 25654806379
+
+
+class FixFeed:
+    '''cTrader quote session traffic'''
+
+    def __init__(self, symbols: dict | None = None, entries: int = 10, seed: int = 0):
+        '''
+        :param symbols: {symbol id: asset}, CTRADER_SYMBOLS by default
+        :param entries: NoMDEntries per message
+        :param seed: random seed
+        '''
+        self.symbols = CTRADER_SYMBOLS if symbols is None else symbols
+        self.entries = entries
+        self.rng = random.Random(seed)
+        self.seq_num = 0
+        self.entry_id = FIRST_ENTRY_ID
+        self.mids = {symbol: MIDS.get(asset, 100.0) for symbol, asset in self.symbols.items()}
+        self.live = {symbol: [] for symbol in self.symbols}     # symbol -> [entry id, ...]
+
+    def header(self, msg_type: str) -> simplefix.FixMessage:
+        '''Next message of the session with the standard header'''
+        self.seq_num += 1
+        msg = simplefix.FixMessage()
+        msg.append_pair(8, 'FIX.4.4')
+        msg.append_pair(35, msg_type)
+        msg.append_pair(34, self.seq_num)
+        msg.append_pair(49, 'cServer')
+        msg.append_pair(50, 'QUOTE')
+        msg.append_pair(52, '20250602-14:15:22.148')
+        msg.append_pair(56, 'live.b2broker.1088508')
+        msg.append_pair(57, 'QUOTE')
+        return msg
+
+    def add_symbol(self, symbol: str, asset: str = '') -> None:
+        '''Start quoting one more symbol'''
+        if symbol not in self.symbols:
+            self.symbols = {**self.symbols, symbol: asset}
+            self.mids[symbol] = MIDS.get(asset, 100.0)
+            self.live[symbol] = []
+
+    def _quote(self, symbol: str) -> tuple[int, str, str, int]:
+        '''New entry id, side, price and size around the symbol mid'''
+        mid = self.mids[symbol] = self.mids[symbol] * (1 + self.rng.gauss(0, 0.00002))
+        side = self.rng.randint(0, 1)
+        offset = mid * 0.00001 * self.rng.randint(1, 20)
+        decimals = 5 if mid < 10 else 2
+        price = f'{mid - offset if side == 0 else mid + offset:.{decimals}f}'
+        self.entry_id += 1
+        self.live[symbol].append(self.entry_id)
+        return self.entry_id, str(side), price, self.rng.choice((100000, 500000, 1000000, 3000000, 5000000))
+
+    def snapshot(self, symbol: str) -> bytes:
+        '''35=W full refresh of one symbol'''
+        self.live[symbol] = []
+        msg = self.header('W')
+        msg.append_pair(55, symbol)
+        msg.append_pair(268, self.entries)
+        for _ in range(self.entries):
+            entry_id, side, price, size = self._quote(symbol)
+            msg.append_pair(269, side)
+            msg.append_pair(270, price)
+            msg.append_pair(271, size)
+            msg.append_pair(278, entry_id)
+        return msg.encode()
+
+    def incremental(self) -> bytes:
+        '''35=X with a mix of new and deleted quotes of random symbols'''
+        msg = self.header('X')
+        msg.append_pair(268, self.entries)
+        for _ in range(self.entries):
+            symbol = self.rng.choice(list(self.symbols))
+            live = self.live[symbol]
+            if len(live) > self.entries and self.rng.random() < 0.5:
+                msg.append_pair(279, 2)
+                msg.append_pair(278, live.pop(self.rng.randrange(len(live))))
+                msg.append_pair(55, symbol)
+                continue
+            entry_id, side, price, size = self._quote(symbol)
+            msg.append_pair(279, 0)
+            msg.append_pair(269, side)
+            msg.append_pair(278, entry_id)
+            msg.append_pair(55, symbol)
+            msg.append_pair(270, price)
+            msg.append_pair(271, size)
+        return msg.encode()
+
+    def messages(self, count: int) -> list[bytes]:
+        '''A snapshot of every symbol followed by incremental refreshes, count messages in total'''
+        messages = [self.snapshot(symbol) for symbol in list(self.symbols)[:count]]
+        messages += [self.incremental() for _ in range(count - len(messages))]
+        return messages
+
+
+def alor_frame(guid: str, depth: int, price: float, rng: random.Random = random) -> str:
+    '''Alor OrderBookGetAndSubscribe frame in "Simple" format'''
+    step = 0.01
+    return json.dumps({
+        "data": {
+            "snapshot": True,
+            "bids": [{"price": round(price - step * (i + 1), 2), "volume": rng.randint(1, 5000)} for i in range(depth)],
+            "asks": [{"price": round(price + step * i, 2), "volume": rng.randint(1, 5000)} for i in range(depth)],
+            "timestamp": 1748873722,
+            "ms_timestamp": 1748873722148,
+            "existing": True,
+        },
+        "guid": guid,
+    }, separators=(',', ':'))
+
+
+class AlorFeed:
+    '''Alor websocket order book traffic of several instruments'''
+
+    def __init__(self, instruments: list | None = None, depth: int = 10, seed: int = 0):
+        '''
+        :param instruments: ['SBER', 'SBERP'], 9 synthetic names by default
+        :param depth: levels per side
+        :param seed: random seed
+        '''
+        self.instruments = instruments or [f'STOCK{i}' for i in range(9)]
+        self.depth = depth
+        self.rng = random.Random(seed)
+        self.guids = {instrument: f'{i:08x}-0000-0000-0000-000000000000' for i, instrument in enumerate(self.instruments)}
+        self.mids = {instrument: 100 + 300 * self.rng.random() for instrument in self.instruments}
+
+    def frame(self) -> str:
+        instrument = self.rng.choice(self.instruments)
+        mid = self.mids[instrument] = self.mids[instrument] * (1 + self.rng.gauss(0, 0.0002))
+        return alor_frame(self.guids[instrument], self.depth, mid, self.rng)
+
+    def frames(self, count: int) -> list[str]:
+        return [self.frame() for _ in range(count)]
@@ -0,0 +1,101 @@
+"""
+Timing, percentiles and result files shared by the benchmarks.
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from utils import codec
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    '''Nearest rank percentile of an already sorted list'''
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values), max(1, math.ceil(q / 100 * len(sorted_values)))) - 1]
+
+
+def summarize(name: str, latencies_ns: list, items: int, elapsed: float) -> dict:
+    '''
+    :param name: stage name
+    :param latencies_ns: duration of every call
+    :param items: units processed (messages, frames, updates), throughput is items per second
+    :param elapsed: wall seconds of all calls
+    '''
+    latencies_ns = sorted(latencies_ns)
+    return {
+        'stage': name,
+        'calls': len(latencies_ns),
+        'items': items,
+        'seconds': round(elapsed, 6),
+        'throughput': round(items / elapsed, 1) if elapsed else 0.0,
+        'p50_us': round(percentile(latencies_ns, 50) / 1000, 3),
+        'p99_us': round(percentile(latencies_ns, 99) / 1000, 3),
+        'p99_9_us': round(percentile(latencies_ns, 99.9) / 1000, 3),
+        'max_us': round(latencies_ns[-1] / 1000, 3) if latencies_ns else 0.0,
+    }
+
+
+def measure(name: str, call, inputs: list, items: int | None = None) -> dict:
+    '''
+    Time call(item) for every input separately
+    :param name: stage name
+    :param call: callable of one input, its result is ignored
+    :param inputs: prepared inputs, generated before timing
+    :param items: units processed by all calls, one per input by default
+    '''
+    latencies = []
+    append = latencies.append
+    clock = time.perf_counter_ns
+    started = clock()
+    for item in inputs:
+        begin = clock()
+        call(item)
+        append(clock() - begin)
+    elapsed = (clock() - started) / 1e9
+    return summarize(name, latencies, len(inputs) if items is None else items, elapsed)
+
+
+def environment() -> dict:
+    '''Where the results come from, to compare them between commits'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'json_backend': codec.JSON_BACKEND,
+    }
+
+
+def write_results(path: str, results: list, parameters: dict) -> None:
+    with open(path, 'w') as f:
+        json.dump({'environment': environment(), 'parameters': parameters, 'results': results}, f, indent=2)
+
+
+def print_results(results: list, baseline: dict | None = None) -> None:
+    '''
+    :param results: stage summaries
+    :param baseline: results file of another run, adds the p50 and throughput change
+    '''
+    previous = {result['stage']: result for result in (baseline or {}).get('results', [])}
+    print(f"{'stage':<20} {'items/s':>12} {'p50 us':>10} {'p99 us':>10} {'p99.9 us':>10}"
+          + (f"  {'p50 vs base':>12} {'tput vs base':>12}" if previous else ''))
+    for result in results:
+        line = (f"{result['stage']:<20} {result['throughput']:>12,.0f} {result['p50_us']:>10.2f} "
+                f"{result['p99_us']:>10.2f} {result['p99_9_us']:>10.2f}")
+        base = previous.get(result['stage'])
+        if base and base['p50_us'] and base['throughput']:
+            line += (f"  {result['p50_us'] / base['p50_us'] - 1:>+12.1%}"
+                     f" {result['throughput'] / base['throughput'] - 1:>+12.1%}")
+        print(line)
@@ -0,0 +1,198 @@
+"""
+Stand-in Alor OAuth and websocket servers for load testing the Alor client.
+
+HTTP: POST /refresh?token=... returns an AccessToken, GET /md/v2/Securities
+returns the subscribed codes as a paginated securities list. Websocket: OrderBookGetAndSubscribe and
+unsubscribe with token checks, then order books of every subscription are
+pushed every `frequency` ms or at a fixed total rate. Point the client at it:
+    "AlorOAuthUrl": "http://127.0.0.1:8081",
+    "AlorWsUrl": "ws://127.0.0.1:8082/ws",
+    "AlorSecuritiesUrl": "http://127.0.0.1:8081/md/v2/Securities"
+Run:
+    python -m benchmarks.mock_alor_server --rate 2000 --depth 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+import websockets
+
+from benchmarks.generators import alor_frame
+
+
+logger = logging.getLogger('MockAlorServer')
+
+HTTP_STATUS = {200: 'OK', 401: 'Unauthorized', 404: 'Not Found'}
+
+
+class MockAlorServer:
+    def __init__(self, host: str = '127.0.0.1', http_port: int = 8081, ws_port: int = 8082, rate: int = 0,
+                 depth: int | None = None, token_ttl: int = 1800, seed: int = 0):
+        '''
+        :param host: listen address
+        :param http_port: OAuth and securities port
+        :param ws_port: websocket port
+        :param rate: order book frames per second per client over all subscriptions, 0 to follow `frequency`
+        :param depth: levels per side, the requested depth by default
+        :param token_ttl: seconds an access token stays valid
+        :param seed: random seed of the quotes
+        '''
+        self.host = host
+        self.http_port = http_port
+        self.ws_port = ws_port
+        self.rate = rate
+        self.depth = depth
+        self.token_ttl = token_ttl
+        self.rng = random.Random(seed)
+        self.tokens = {}        # access token -> expiry time.time()
+        self.mids = {}          # code -> mid price
+
+    # HTTP
+
+    async def handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            method, target, _ = request.split(b'\r\n', 1)[0].decode('ascii').split(' ', 2)
+            headers = dict(line.split(': ', 1) for line in request.decode('latin-1').split('\r\n')[1:] if ': ' in line)
+            length = int(headers.get('Content-Length', headers.get('content-length', 0)))
+            if length:
+                await reader.readexactly(length)
+            status, body = self.route(method, urlsplit(target))
+            payload = json.dumps(body).encode('utf-8')
+            writer.write(f'HTTP/1.1 {status} {HTTP_STATUS[status]}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode('ascii') + payload)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def route(self, method: str, url) -> tuple[int, object]:
+        if method == 'POST' and url.path == '/refresh':
+            if not parse_qs(url.query).get('token'):
+                return 401, {'message': 'Refresh token is required'}
+            token = uuid.uuid4().hex
+            self.tokens[token] = time.time() + self.token_ttl
+            return 200, {'AccessToken': token}
+        if method == 'GET' and url.path.endswith('/Securities'):
+            query = parse_qs(url.query)
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', ['1000'])[0])
+            return 200, [self.security(code) for code in sorted(self.mids)[offset:offset + limit]]
+        return 404, {'message': 'Not found'}
+
+    @staticmethod
+    def security(code: str) -> dict:
+        future = '-' in code
+        return {
+            'symbol': code,
+            'exchange': 'MOEX',
+            'board': 'RFUD' if future else 'TQBR',
+            'type': 'FUT' if future else 'CS',
+            'lotsize': 1 if future else 10,
+            'minstep': 0.01,
+            'facevalue': 10 if future else 1,
+            'cancellation': '2025-03-20T18:45:00Z' if future else '2100-01-01T00:00:00Z',
+        }
+
+    # Websocket
+
+    def valid(self, token: str | None) -> bool:
+        return token is not None and self.tokens.get(token, 0) > time.time()
+
+    async def handle_ws(self, ws) -> None:
+        subscriptions = {}      # guid -> request
+        publisher = asyncio.create_task(self.publish(ws, subscriptions))
+        logger.info(f"Client connected {ws.remote_address}")
+        try:
+            async for message in ws:
+                request = json.loads(message)
+                guid = request.get('guid')
+                if not self.valid(request.get('token')):
+                    await ws.send(json.dumps({'requestGuid': guid, 'httpCode': 401, 'message': 'Invalid JWT token!'}))
+                    continue
+                opcode = request.get('opcode')
+                if opcode == 'OrderBookGetAndSubscribe':
+                    subscriptions[guid] = request
+                    self.mids.setdefault(request['code'], 100 + 300 * self.rng.random())
+                elif opcode == 'unsubscribe':
+                    subscriptions.pop(guid, None)
+                else:
+                    await ws.send(json.dumps({'requestGuid': guid, 'httpCode': 400, 'message': 'Unknown opcode'}))
+                    continue
+                await ws.send(json.dumps({'requestGuid': guid, 'httpCode': 200, 'message': 'Handled successfully'}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            publisher.cancel()
+            logger.info(f"Client disconnected {ws.remote_address}")
+
+    def frame(self, request: dict) -> str:
+        code = request['code']
+        mid = self.mids[code] = self.mids[code] * (1 + self.rng.gauss(0, 0.0002))
+        return alor_frame(request['guid'], self.depth or request.get('depth', 10), mid, self.rng)
+
+    async def publish(self, ws, subscriptions: dict) -> None:
+        '''Push books of the subscriptions, log the achieved rate every 5 seconds'''
+        tick = 0.01
+        started = time.monotonic()
+        sent = 0
+        report = started + 5
+        while True:
+            await asyncio.sleep(tick)
+            now = time.monotonic()
+            if not subscriptions:
+                started, sent = now, 0
+                continue
+            if self.rate:
+                requests = list(subscriptions.values())
+                due = int((now - started) * self.rate) - sent
+                frames = [self.frame(self.rng.choice(requests)) for _ in range(max(due, 0))]
+            else:
+                frames = []
+                for request in list(subscriptions.values()):
+                    # A new request of the same guid starts at its own frequency
+                    if request.get('due_at', 0) <= now:
+                        request['due_at'] = now + request.get('frequency', 1000) / 1000
+                        frames.append(self.frame(request))
+            for frame in frames:
+                await ws.send(frame)
+            sent += len(frames)
+            if now >= report:
+                achieved = sent / (now - started)
+                behind = ' - client is behind' if self.rate and achieved < self.rate * 0.95 else ''
+                logger.info(f"Publishing {achieved:,.0f} frames/s to {len(subscriptions)} subscriptions{behind}")
+                report = now + 5
+
+    async def serve_forever(self) -> None:
+        http = await asyncio.start_server(self.handle_http, self.host, self.http_port)
+        async with http, websockets.serve(self.handle_ws, self.host, self.ws_port, max_queue=None):
+            logger.info(f"Mock Alor OAuth on http://{self.host}:{self.http_port}, websocket on ws://{self.host}:{self.ws_port}/ws")
+            await http.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--http-port', type=int, default=8081)
+    parser.add_argument('--ws-port', type=int, default=8082)
+    parser.add_argument('--rate', type=int, default=0, help='frames per second per client, 0 to follow the requested frequency')
+    parser.add_argument('--depth', type=int, default=None, help='levels per side, the requested depth by default')
+    parser.add_argument('--token-ttl', type=int, default=1800, help='access token lifetime, seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = MockAlorServer(args.host, args.http_port, args.ws_port, args.rate, args.depth, args.token_ttl, args.seed)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Stand-in cTrader FIX quote server for load testing AsyncFixClient.
+
+Speaks logon, heartbeat, TestRequest, MarketDataRequest and logout, then streams
+a 35=W snapshot per requested symbol and 35=X refreshes at the configured rate.
+Point the client at it with "FixHost" and "FixPort" in config.json. Run:
+    python -m benchmarks.mock_fix_server --port 5201 --rate 5000 --entries 10
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from benchmarks.generators import FixFeed
+from tasks.forex import CTRADER_SYMBOLS
+from utils.fix import FixFramer, decode_frame
+
+
+logger = logging.getLogger('MockFixServer')
+
+
+class MockFixSession:
+    '''One client connection'''
+
+    def __init__(self, server: 'MockFixServer', reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.feed = FixFeed(symbols={}, entries=server.entries, seed=server.seed)
+        self.framer = FixFramer()
+        self.logged_on = False
+        self.heartbeat_interval = 30
+        self.last_received = time.monotonic()
+        self.sent = 0
+
+    def send(self, message: bytes) -> None:
+        if self.writer.is_closing():
+            raise ConnectionResetError('Client is gone')
+        self.writer.write(message)
+        self.sent += 1
+
+    def session_message(self, msg_type: str, *pairs) -> bytes:
+        msg = self.feed.header(msg_type)
+        for tag, value in pairs:
+            msg.append_pair(tag, value)
+        return msg.encode()
+
+    async def run(self) -> None:
+        peer = self.writer.get_extra_info('peername')
+        logger.info(f"Client connected {peer}")
+        reading = asyncio.current_task()
+        tasks = [asyncio.create_task(self.stream()), asyncio.create_task(self.heartbeat())]
+        for task in tasks:
+            # A failed writer ends the session instead of writing into a dead socket
+            task.add_done_callback(lambda task: task.cancelled() or task.exception() is None or reading.cancel())
+        try:
+            while True:
+                data = await self.reader.read(self.framer.read_size)
+                if not data:
+                    break
+                self.last_received = time.monotonic()
+                self.framer.feed(data)
+                for frame in self.framer.frames():
+                    if not await self.on_message(decode_frame(bytes(frame))):
+                        return
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.writer.close()
+            logger.info(f"Client disconnected {peer}, {self.sent} messages sent")
+
+    async def on_message(self, msg) -> bool:
+        '''
+        :return: False to close the session
+        '''
+        msg_type = msg.get(35)
+        if msg_type == b'A':
+            self.heartbeat_interval = int(msg.get(108) or 30)
+            self.logged_on = True
+            self.send(self.session_message('A', (98, 0), (108, self.heartbeat_interval)))
+        elif msg_type == b'1':
+            self.send(self.session_message('0', (112, msg.get(112))))
+        elif msg_type == b'V':
+            if not self.logged_on:
+                self.send(self.session_message('3', (58, 'Not logged on')))
+                return True
+            symbol = msg.get(55).decode('ascii')
+            self.feed.add_symbol(symbol, CTRADER_SYMBOLS.get(symbol, ''))
+            self.send(self.feed.snapshot(symbol))
+        elif msg_type == b'5':
+            self.send(self.session_message('5'))
+            await self.writer.drain()
+            return False
+        await self.writer.drain()
+        return True
+
+    async def heartbeat(self) -> None:
+        '''Heartbeat every interval, TestRequest if the client is silent'''
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if not self.logged_on:
+                continue
+            if time.monotonic() - self.last_received > self.heartbeat_interval * 1.5:
+                self.send(self.session_message('1', (112, f'TEST{int(time.time())}')))
+            else:
+                self.send(self.session_message('0'))
+            await self.writer.drain()
+
+    async def stream(self) -> None:
+        '''35=X at server.rate messages per second in 10 ms batches, drain() shows a slow client'''
+        tick = 0.01
+        started = time.monotonic()
+        sent = 0
+        report = started + 5
+        while True:
+            await asyncio.sleep(tick)
+            if not self.feed.symbols:
+                started = time.monotonic()
+                sent = 0
+                continue
+            now = time.monotonic()
+            due = int((now - started) * self.server.rate) - sent
+            for _ in range(due):
+                self.send(self.feed.incremental())
+            sent += max(due, 0)
+            await self.writer.drain()
+            if now >= report:
+                achieved = sent / (now - started)
+                behind = ' - client is behind' if achieved < self.server.rate * 0.95 else ''
+                logger.info(f"Streaming {achieved:,.0f} msg/s of {self.server.rate:,}{behind}")
+                report = now + 5
+
+
+class MockFixServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 5201, rate: int = 1000, entries: int = 10, seed: int = 0):
+        '''
+        :param host: listen address
+        :param port: listen port
+        :param rate: 35=X messages per second per client
+        :param entries: NoMDEntries per message
+        :param seed: random seed of the quotes
+        '''
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.entries = entries
+        self.seed = seed
+        self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await MockFixSession(self, reader, writer).run()
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        logger.info(f"Mock FIX server on {self.host}:{self.port}, {self.rate} msg/s, {self.entries} entries")
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5201)
+    parser.add_argument('--rate', type=int, default=1000, help='35=X messages per second per client')
+    parser.add_argument('--entries', type=int, default=10, help='NoMDEntries per message')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    server = MockFixServer(args.host, args.port, args.rate, args.entries, args.seed)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,8 @@ import time
 import json
 
 import utils.data as td
+from utils import latency
+from utils.bus import BOOK, bus
 from tasks.alor import Alor
 from tasks.forex import AsyncFixClient as ForexClient
 
@@ -17,6 +19,7 @@ assets_moex = ['TATN', 'TATNP', 'MTLR', 'MTLRP', 'SBER', 'SBERP', 'ED-3.25', 'SI
 
 forex = ForexClient()
 alor = Alor(assets_moex)
+latency.tracker.enabled = bool(alor.config.get('LatencyLog'))
 
 
 def load_assets() -> tuple:
@@ -68,9 +71,20 @@ def main():
 
 
 async def print_data():
-    while True:
-        print(f"Debug market data: {td.trading_data.order_book}")
-        await asyncio.sleep(100)
+    # Books are printed when some changed, at most every 100 seconds
+    subscription = bus.subscribe(BOOK, max_rate=0.01)
+    try:
+        while True:
+            changed = await subscription.get(timeout=100)
+            td.trading_data.subscriptions.mark_stale(60)
+            if changed:
+                print(f"Debug market data: {td.trading_data.order_book}")
+            print(f"Debug subscriptions: {td.trading_data.subscriptions.states()}")
+            if latency.tracker.enabled:
+                print(latency.tracker.log_line())
+                latency.tracker.reset()
+    finally:
+        subscription.close()
 
 
 async def task_manager():
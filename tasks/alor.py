@@ -1,17 +1,72 @@
 import asyncio
+import logging
 import time
 import random
 import string
 import json
 import os
+import zlib
 
 import websockets
+from array import array
 
-from utils.web_requests import async_post, async_get
+from utils.codec import decode_order_book, levels_to_array, loads
+from utils.securities import SecuritiesCache
+from utils.web_requests import http_client
+from utils import latency
+from utils.bus import BOOK, bus
 import utils.data as td
 
 
+logger = logging.getLogger('Alor')
+
+
+class AlorShard:
+    '''One websocket connection of the Alor pool and the subscriptions assigned to it'''
+
+    def __init__(self, index: int):
+        self.index = index
+        self.ws = None
+        self.open = False
+        self.guids = set()
+        self.frames = {}        # guid -> frames since the last rebalance check
+        self.recvs = 0          # recv calls since the last rebalance check
+        self.waits = 0          # recv calls that had to wait for a frame
+
+    @property
+    def load(self) -> int:
+        return sum(self.frames.values())
+
+    @property
+    def saturation(self) -> float:
+        '''Share of frames that were already queued when recv was called, near 1 when the shard lags'''
+        return 1 - self.waits / self.recvs if self.recvs else 0.0
+
+    def reset_stats(self) -> None:
+        self.frames = dict.fromkeys(self.guids, 0)
+        self.recvs = 0
+        self.waits = 0
+
+    def __repr__(self):
+        return f"AlorShard({self.index}, {len(self.guids)} subscriptions, {self.load} frames)"
+
+
 class Alor:
+    # A shard is lagging when this share of its frames was queued before recv
+    LAG_SATURATION = 0.9
+    REBALANCE_INTERVAL = 10
+    # Access tokens live 30 minutes, the manager refreshes them 10 minutes ahead
+    TOKEN_REFRESH = 60 * 20
+    TOKEN_RETRY = 5
+    # Subscription profiles, "AlorProfiles" in config.json overrides them. Alor serves "Simple"
+    # books at most every 25 ms, the watchlist default is the one-second book of 10 levels
+    PROFILES = {
+        'hot': {'depth': 20, 'frequency': 25},
+        'watch': {'depth': 10, 'frequency': 1000},
+        'idle': {'depth': 5, 'frequency': 5000},
+    }
+    ADAPT_DELAY = 0.5           # seconds to collect leg changes of one order table edit
+
     def __init__(self, assets):
         self.config_file = 'config.json'
         if not os.path.exists(self.config_file):
@@ -20,93 +75,343 @@ class Alor:
             self.config = json.load(f)
 
         self.refresh_token = self.config.get('AlorRefresh')
-        self.url_trade = 'https://oauth.alor.ru'
-        self.uri_wss_api = 'wss://api.alor.ru/ws'
-        self.uri_securities = 'https://apidev.alor.ru/md/v2/Securities'
+        self.url_trade = self.config.get('AlorOAuthUrl', 'https://oauth.alor.ru')
+        self.uri_wss_api = self.config.get('AlorWsUrl', 'wss://api.alor.ru/ws')
+        self.uri_securities = self.config.get('AlorSecuritiesUrl', 'https://apidev.alor.ru/md/v2/Securities')
+        self.securities = SecuritiesCache(self.config.get('SecuritiesCache', 'securities.npy'),
+                                          self.config.get('SecuritiesTTL', 24 * 60 * 60))
         self.alor_guids = {}
         self.token_timestamp = time.time()
         self.alor_access = None
+        self.token_refresh = None   # in-flight get_access_token shared by every waiting caller
         self.assets = assets
         self.alor_assets_data_out = {}
         self.alor_assets_data = {}
         self.connected = False
+        self.feed = 'alor'
+        self.loop = None
+        # Subscriptions are spread over "AlorConnections" websockets by "AlorSharding": 'load' or 'hash'
+        self.shard_count = max(1, int(self.config.get('AlorConnections', 1)))
+        self.sharding = self.config.get('AlorSharding', 'load')
+        self.shards = []
+        self.shard_of = {}      # guid -> AlorShard
+        # "AlorInstrumentProfiles" pins instruments to profiles, the rest get "AlorProfile". With
+        # "AlorAdaptive" legs of orders in Calculate.data are 'hot' and the other instruments 'idle'
+        self.profiles = {**self.PROFILES, **self.config.get('AlorProfiles', {})}
+        self.default_profile = self.config.get('AlorProfile', 'watch')
+        self.instrument_profiles = self.config.get('AlorInstrumentProfiles', {})
+        self.adaptive = bool(self.config.get('AlorAdaptive', False))
+        self.active_legs = set()    # instruments used by orders, adaptive mode
+        self.subscribed_profiles = {}   # guid -> profile name sent to the server
+        self.adapt_pending = False
+        self.adapt_task = None
 
     # get securities from Alor
     async def get_securities(self):
         '''
-        Get list of all securities on Alor exchange
+        Load the list of all securities on Alor exchange from the local cache, downloaded when it expires
         :return:
         '''
-        self.securities = await async_get(self.uri_securities, limit=50)
+        await self.securities.ensure(self.uri_securities)
 
     async def get_access_token(self):
-        access_json = await async_post(f'{self.url_trade}/refresh?token={self.refresh_token}')
+        access_json = await http_client.post(f'{self.url_trade}/refresh', params={'token': self.refresh_token})
         self.token_timestamp = time.time()
         self.alor_access = access_json['AccessToken']
 
+    async def token(self) -> str:
+        '''
+        Cached access token, one refresh serves all callers when it is missing or due
+        :return: JWT for the websocket requests
+        '''
+        if self.alor_access is None or time.time() >= self.token_timestamp + self.TOKEN_REFRESH:
+            if self.token_refresh is None or self.token_refresh.done():
+                self.token_refresh = asyncio.ensure_future(self.get_access_token())
+            await asyncio.shield(self.token_refresh)
+        return self.alor_access
+
+    async def token_manager(self) -> None:
+        '''Refresh the access token ahead of expiry so subscriptions never wait for it'''
+        while True:
+            delay = self.token_timestamp + self.TOKEN_REFRESH - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self.token()
+            except Exception as e:
+                # The old token stays valid until expiry
+                logger.warning(f"Alor access token refresh failed: {e}")
+                await asyncio.sleep(self.TOKEN_RETRY)
+
     async def add_query_asset(self, assets: list):
+        '''Subscribe to the order books of all assets at once, every shard sends its requests back to back'''
+        token = await self.token()
+        batches = {}
         for asset in assets:
-            if self.token_timestamp + 60 * 20 >= time.time():
-                await self.get_access_token()
-            guid = td.trading_data.generate_guid(asset)
+            guid = td.trading_data.subscriptions.register(self.feed, asset).guid
+            shard = self.assign(asset)
+            shard.guids.add(guid)
+            shard.frames.setdefault(guid, 0)
+            self.shard_of[guid] = shard
+            batches.setdefault(shard, []).append(json.dumps(self.subscribe_query(asset, guid, token)))
+        await asyncio.gather(*(self.send_batch(shard, batch) for shard, batch in batches.items()))
+
+    @staticmethod
+    async def send_batch(shard: AlorShard, messages: list) -> None:
+        # No waiting for the replies, the books arrive as the server handles the requests
+        for message in messages:
+            await shard.ws.send(message)
+
+    def subscribe_query(self, asset: str, guid: str, token: str) -> dict:
+        profile = self.profile_of(asset)
+        self.subscribed_profiles[guid] = profile
+        return {
+            "opcode": "OrderBookGetAndSubscribe",
+            "code": asset,
+            "depth": self.profiles[profile]['depth'],
+            "exchange": "MOEX",
+            "format": "Simple",
+            "frequency": self.profiles[profile]['frequency'],
+            "guid": guid,
+            "token": token,
+        }
+
+    def profile_of(self, asset: str) -> str:
+        '''
+        :param asset: 'SBER'
+        :return: 'hot', 'watch', 'idle' or a profile from "AlorProfiles"
+        '''
+        profile = self.instrument_profiles.get(asset)
+        if profile is not None:
+            return profile
+        if self.adaptive:
+            return 'hot' if asset in self.active_legs else 'idle'
+        return self.default_profile
+
+    def on_leg_activity(self, source: str, instrument: str, active: bool) -> None:
+        '''
+        Calculate leg listener, promotes instruments of orders and demotes the rest in adaptive mode
+        :param source: 'moex' or 'forex'
+        :param instrument: 'SBER', 'SILV-3.25'
+        :param active: True if the first order started using the instrument
+        '''
+        if not self.adaptive or source != 'moex':
+            return
+        if active:
+            self.active_legs.add(instrument)
+        else:
+            self.active_legs.discard(instrument)
+        # An edit of the order table clears and rebuilds the legs, only the final state is sent.
+        # Calculate may run in the GUI thread, the loop is only touched thread-safely
+        if not self.adapt_pending and self.connected and self.loop is not None:
+            self.adapt_pending = True
+            self.loop.call_soon_threadsafe(self.loop.call_later, self.ADAPT_DELAY, self.schedule_adapt)
+
+    def schedule_adapt(self) -> None:
+        self.adapt_pending = False
+        if self.connected:
+            self.adapt_task = self.loop.create_task(self.adapt())
+
+    async def adapt(self) -> None:
+        '''Resubscribe every instrument whose profile differs from the one it was subscribed with'''
+        token = await self.token()
+        for guid, shard in list(self.shard_of.items()):
+            subscription = td.trading_data.subscriptions.get(guid)
+            if subscription is None or not shard.open:
+                continue
+            if self.subscribed_profiles.get(guid) != self.profile_of(subscription.instrument):
+                # The same guid keeps the book, the new subscription replaces its depth and frequency
+                await shard.ws.send(json.dumps({"opcode": "unsubscribe", "guid": guid, "token": token}))
+                await shard.ws.send(json.dumps(self.subscribe_query(subscription.instrument, guid, token)))
+
+    def assign(self, asset: str) -> AlorShard:
+        '''
+        Pick the shard for a new subscription
+        :param asset: 'SBER'
+        :return: by hash of the code or the least loaded open shard
+        '''
+        shards = [shard for shard in self.shards if shard.open]
+        if not shards:
+            raise ConnectionError('No open Alor websocket')
+        if self.sharding == 'hash':
+            return shards[zlib.crc32(asset.encode('utf-8')) % len(shards)]
+        return min(shards, key=lambda shard: (shard.load, len(shard.guids)))
+
+    async def move(self, guid: str, target: AlorShard) -> None:
+        '''Move a subscription to another shard keeping its guid and book'''
+        subscription = td.trading_data.subscriptions.get(guid)
+        source = self.shard_of.get(guid)
+        if subscription is None or source is None or source is target:
+            return
+        token = await self.token()
+        source.guids.discard(guid)
+        source.frames.pop(guid, None)
+        if source.open:
+            await source.ws.send(json.dumps({"opcode": "unsubscribe", "guid": guid, "token": token}))
+        target.guids.add(guid)
+        target.frames[guid] = 0
+        self.shard_of[guid] = target
+        await target.ws.send(json.dumps(self.subscribe_query(subscription.instrument, guid, token)))
+
+    async def rebalance(self) -> None:
+        '''Move the busiest subscription of a lagging shard to the least loaded one'''
+        shards = [shard for shard in self.shards if shard.open]
+        if len(shards) > 1:
+            lagging = max(shards, key=lambda shard: (shard.saturation, shard.load))
+            lightest = min(shards, key=lambda shard: shard.load)
+            if lagging.saturation >= self.LAG_SATURATION and lagging is not lightest and lagging.frames:
+                guid, frames = max(lagging.frames.items(), key=lambda item: item[1])
+                if lightest.load + frames < lagging.load:
+                    logger.info(f"Rebalancing {guid} from {lagging} to {lightest}")
+                    await self.move(guid, lightest)
+        for shard in self.shards:
+            shard.reset_stats()
+
+    async def rebalance_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.REBALANCE_INTERVAL)
+            await self.rebalance()
+
+    def on_roll(self, changes: dict) -> None:
+        '''
+        RollCalendar listener, resubscribe expired futures to the new contracts. Safe to call from any thread.
+        :param changes: {'SILV-3.25': 'SILV-6.25'}
+        '''
+        if self.connected and self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.resubscribe(changes), self.loop)
+
+    async def resubscribe(self, changes: dict) -> None:
+        # SV2! of the old quarter is SV1! of the new one: only expired codes go, only new codes come
+        expired = set(changes) - set(changes.values())
+        new_assets = [new for new in changes.values() if new not in changes]
+        token = await self.token()
+        for old in expired:
+            subscription = td.trading_data.subscriptions.find(self.feed, old)
+            if subscription is None:
+                continue
             query = {
-                "opcode": "OrderBookGetAndSubscribe",
-                "code": asset,
-                "depth": 10,
-                "exchange": "MOEX",
-                "format": "Simple",
-                "frequency": 1000,
-                "guid": guid,
-                "token": self.alor_access,
+                "opcode": "unsubscribe",
+                "guid": subscription.guid,
+                "token": token,
             }
-
-            # print(f"Debug alor query: {query}")
-            await self.ws.send(json.dumps(query))
+            shard = self.shard_of.pop(subscription.guid, None)
+            self.subscribed_profiles.pop(subscription.guid, None)
+            if shard is not None:
+                shard.guids.discard(subscription.guid)
+                shard.frames.pop(subscription.guid, None)
+                if shard.open:
+                    await shard.ws.send(json.dumps(query))
+            td.trading_data.subscriptions.unregister(subscription.guid)
+            td.trading_data.order_book.pop(subscription.guid, None)
+            self.alor_assets_data.pop(old, None)
+        await self.add_query_asset(new_assets)
 
     async def connect(self, assets_moex):
-        async with websockets.connect(self.uri_wss_api) as self.ws:
-            self.connected = True
-            self.assets = asyncio.create_task(self.add_query_asset(assets_moex))
-            try:
-                while True:
-                    response = await self.ws.recv()
-                    if await self.parse_assets_out(json.loads(response)):
-                        pass
-                        # print(f'Debug alor: {response}')
-                    else:
-                        pass
-                        # print(f'Debug alor Error: {response}')
-            except websockets.exceptions.ConnectionClosedError:
-                self.connected = False
-
-    async def parse_assets(self, data: dict, volume: float | None = None) -> bool:
-        '''
-        Method parse trading data from alor exchange and save it in self.alor_assets_data
+        self.loop = asyncio.get_running_loop()
+        self.shards = [AlorShard(i) for i in range(self.shard_count)]
+        # The token request overlaps with the websocket handshakes
+        token, *connections = await asyncio.gather(
+            self.token(), *(websockets.connect(self.uri_wss_api) for _ in self.shards), return_exceptions=True)
+        failed = [result for result in (token, *connections) if isinstance(result, BaseException)]
+        if failed:
+            # Handshakes that did succeed are not left open behind the failed one
+            for ws in connections:
+                if not isinstance(ws, BaseException):
+                    await ws.close()
+            raise failed[0]
+        for shard, ws in zip(self.shards, connections):
+            shard.ws = ws
+            shard.open = True
+        self.connected = True
+        self.assets = asyncio.create_task(self.add_query_asset(assets_moex))
+        background = [asyncio.create_task(self.token_manager())]
+        if len(self.shards) > 1:
+            background.append(asyncio.create_task(self.rebalance_loop()))
+        try:
+            await asyncio.gather(*(self.listen(shard) for shard in self.shards))
+        finally:
+            self.connected = False
+            for task in background:
+                task.cancel()
+            for shard in self.shards:
+                shard.open = False
+                await shard.ws.close()
+
+    async def listen(self, shard: AlorShard) -> None:
+        '''Receive loop of one shard, every shard feeds the shared td.trading_data books'''
+        clock = time.perf_counter
+        try:
+            while True:
+                started = clock()
+                response = await shard.ws.recv()
+                # A local, the other shards receive while this one yields below
+                received_ns = time.monotonic_ns() if latency.tracker.enabled else 0
+                shard.recvs += 1
+                if clock() - started > 0.0001:
+                    shard.waits += 1
+                elif not shard.recvs & 63:
+                    # recv of a queued frame does not yield, a lagging shard would starve the others
+                    await asyncio.sleep(0)
+                # Order books of our subscriptions skip the dict decoding
+                book = decode_order_book(response, td.trading_data.subscriptions.by_guid)
+                if book is not None:
+                    self.update_book(*book, received_ns)
+                    if book[0] in shard.guids:
+                        shard.frames[book[0]] = shard.frames.get(book[0], 0) + 1
+                elif await self.parse_assets_out(loads(response), received_ns):
+                    pass
+                    # print(f'Debug alor: {response}')
+                else:
+                    pass
+                    # print(f'Debug alor Error: {response}')
+        except websockets.exceptions.ConnectionClosed:
+            shard.open = False
+            logger.warning(f"Alor websocket {shard.index} closed")
+            # Subscriptions of the closed shard go to the open ones
+            for guid in list(shard.guids):
+                subscription = td.trading_data.subscriptions.get(guid)
+                if subscription is not None and any(other.open for other in self.shards):
+                    await self.move(guid, self.assign(subscription.instrument))
+
+    async def parse_assets_out(self, data: dict, received_ns: int = 0) -> bool:
+        '''
+        Method parse trading data from alor exchange and save it in td.trading_data.order_book
+        and self.alor_assets_data
         :param data:
-        :param volume:
-        :return:
+        :param received_ns: monotonic ns of the ws.recv, 0 without latency tracking
+        :return: True if data belongs to one of our subscriptions
         '''
-        # for asset, guid in self.alor_guids.items():
-        for asset, guid in td.trading_data.instrument_uid.items():
-            if data.get('guid', None) == guid:
-                self.alor_assets_data[asset] = data
-                # print(f"Debug Alor: {data}")
-                return True
-        return False
+        if 'data' not in data:
+            return False
+        trading_data = data['data']
+        return self.update_book(
+            data.get('guid'),
+            levels_to_array(trading_data.get('bids', [])),
+            levels_to_array(trading_data.get('asks', [])),
+            trading_data.get('timestamp', 0),
+            received_ns,
+        )
 
-    async def parse_assets_out(self, data: dict) -> bool:
+    def update_book(self, guid: str, bids: array, asks: array, timestamp: int, received_ns: int = 0) -> bool:
         '''
-        Method parse trading data from alor exchange and save it in self.alor_assets_data_out
-        :param data:
-        :param volume:
-        :return:
+        Save decoded order book in td.trading_data.order_book and self.alor_assets_data
+        :param guid: subscription guid
+        :param bids: array('d', [price, volume, ...])
+        :param asks: array('d', [price, volume, ...])
+        :param timestamp:
+        :param received_ns: monotonic ns of the ws.recv, 0 without latency tracking
+        :return: True if guid belongs to one of our subscriptions
         '''
-        for asset, guid in td.trading_data.guid.items():
-            if data.get('guid', None) == guid:
-                trading_data = data['data']
-                td.trading_data.order_book[guid] = td.OrderBook(
-                    instrument_uid=data.get('guid'),
-                    bids=trading_data.get('bids', []),
-                    asks=trading_data.get('asks', []),
-                    timestamp=trading_data.get('timestamp', 0)
-                )
+        decoded_ns = time.monotonic_ns() if latency.tracker.enabled else 0
+        subscription = td.trading_data.subscriptions.touch(guid)
+        if subscription is None:
+            return False
+        book = td.trading_data.get_book(guid)
+        book.update(bids, asks, timestamp)
+        self.alor_assets_data[subscription.instrument] = book
+        if decoded_ns:
+            latency.tracker.record_commit(self.feed, subscription.instrument, book, received_ns, decoded_ns,
+                                          time.monotonic_ns())
+        td.trading_data.record(self.feed, subscription.instrument, book)
+        bus.publish(BOOK, (self.feed, subscription.instrument), book)
+        return True
@@ -1,14 +1,26 @@
-from datetime import datetime, timedelta
+import time
+
+from tasks.roll_calendar import RollCalendar
+from utils import latency
+
+
+# Feeds of the book sources, names of the latency histograms
+SOURCE_FEEDS = {'moex': 'alor', 'forex': 'ctrader'}
 
 
 class Calculate:
-    def __init__(self, moex_trading_data: dict, forex_trading_data: dict, features_subst: dict, features: dict):
+    # Batches of at least this many orders to recalculate go through the vectorized BatchCalculate
+    BATCH_ORDERS = 200
+
+    def __init__(self, moex_trading_data: dict, forex_trading_data: dict, features_subst: dict, features: dict,
+                 roll_calendar: RollCalendar | None = None):
         '''
 
         :param moex_trading_data: Trading data from alor broker
         :param forex_trading_data: Trading data from Xpbee
         :param features_subst: dict of features to substitute {'SV': 'SILV', 'GD': 'GOLD'}
         :param features: a dictionary containing futures and their lot size {"ED1!/EURUSD": {"ED1!": 1000, "EURUSD": 100000}, "SV1!/XAGUSD": {"SV1!": 10, "XAGUSD": 5000}, "GD1!/XAUUSD": {"GD1!": 1, "XAUUSD": 100}},
+        :param roll_calendar: futures roll calendar shared with the feeds, own one by default
         '''
         # self.data = {'usdrub': '83.4508', 'payout': '7', 'mc_stocks': '118000', 'mc_features': '236000', 'order1': {'asset': 'ED1!/EURUSD', 'lot1': '10', 'price1': '1.03', 'lot2': '1', 'price2': '1.04', 'ent_av': '990.38', 'cur_av': '', 'exit': '', 'profit': '', 'mc': '0.7472'}, 'order2': {'asset': 'SV1!/XAGUSD', 'lot1': '-75', 'price1': '31.54', 'lot2': '0.15', 'price2': '31.164', 'ent_av': '1012.07', 'cur_av': '', 'exit': '', 'profit': '', 'mc': '27.76932'}, 'order3': {'asset': 'MTLR-MTLRP', 'lot1': '-100', 'price1': '101', 'lot2': '100', 'price2': '100', 'ent_av': '1.0', 'cur_av': '-4.27', 'exit': '', 'profit': '', 'mc': '591.0'}, 'order4': {'asset': 'TATN-TATNP', 'lot1': '100', 'price1': '735', 'lot2': '-100', 'price2': '715', 'ent_av': '20.0', 'cur_av': '45.1', 'exit': '', 'profit': '', 'mc': '-570.0'}, 'order5': {'asset': 'TATN-TATNP', 'lot1': '', 'price1': '', 'lot2': '', 'price2': '', 'ent_av': '', 'cur_av': '', 'exit': '', 'profit': '', 'mc': ''}, 'order6': {'asset': 'TATN-TATNP', 'lot1': '', 'price1': '', 'lot2': '', 'price2': '', 'ent_av': '', 'cur_av': '', 'exit': '', 'profit': '', 'mc': ''}}
         self.data_number = 6
@@ -19,11 +31,38 @@ class Calculate:
         self.mc_features = 0
         self.features_subst = features_subst
         self.features = features
+        self.roll_calendar = roll_calendar or RollCalendar(features_subst)
         self.moex_trading_data = moex_trading_data
         self.forex_trading_data = forex_trading_data
+        # Incremental recalculation state
+        self.settings = None
+        self.orders = None
+        self.order_keys = {}    # order index -> inputs of the last calculation
+        self.sources = {'moex': moex_trading_data, 'forex': forex_trading_data}
+        self.order_legs = {}    # order index -> [(source, instrument), ...]
+        self.dependents = {}    # (source, instrument) -> {order index, ...}
+        self.leg_seq = {}       # (source, instrument) -> book seq of the last calculation
+        self.leg_listeners = []
+        self.roll_calendar.subscribe(self.on_roll)
+
+    def subscribe_legs(self, listener) -> None:
+        '''
+        :param listener: callable(source, instrument, active) called when the first order starts or the last
+        order stops using the instrument as a leg
+        '''
+        self.leg_listeners.append(listener)
+
+    def notify_legs(self, changes: dict) -> None:
+        '''
+        :param changes: {(source, instrument): active}
+        '''
+        for (source, instrument), active in changes.items():
+            for listener in self.leg_listeners:
+                listener(source, instrument, active)
 
     def start(self, stocks):
         '''
+        Recalculate orders whose inputs or leg quotes changed since the previous call.
         :param stocks: ['TATN-TATNP', 'MTLR-MTLRP', 'SBER-SBERP']
         :return:
         '''
@@ -31,35 +70,165 @@ class Calculate:
         self.payout = safe_float_convert(self.data['payout'])
         self.mc_stocks = safe_float_convert(self.data['mc_stocks'])
         self.mc_features = safe_float_convert(self.data['mc_features'])
-        for order in self.data['orders']:
-            if self.check_fields(order):    # skip empty orders
-                # assets_type -1 error, 0 - Moex stocks-stocks, 1 - Moex stocks/features, 2 - Moex features/Forex features
-                assets_type = self.check_arb_type(order['asset'])
-                if assets_type:
-                    # Convert all necessary strings in order to Float
-                    convert_order(order)
-                    # Calculate full positions
-                    positions = self.calc_position(order, assets_type)
-                    order['position1'] = positions[0]
-                    order['position2'] = positions[1]
-                    # Calculate enter average
-                    order['ent_av'] = self.calc_av([order['price1'], order['price2'], assets_type[2]])
-                    if not order['price1'] and not order['price2'] or order['price1'] == 0 and order['price2'] == 0:
-                        order['lot1'] = -order['lot2']
-                        order['lot2'] = -order['lot2']
-                    prices = self.get_prices(order, assets_type)
-                    order['cur_price1'] = prices[0]
-                    order['cur_price2'] = prices[1]
-                    # Calculate current average
-                    order['cur_av'] = self.calc_av([prices[0], prices[1], assets_type[2]])
-                    # Calculate margin call level
-                    self.calc_mc(order, assets_type)
-                    # Calculate profit
-                    order['profit'] = self.calc_profit(order, assets_type)
-                    # print(f"Debug start: {order}")
+        orders = self.data['orders']
+        settings = (self.usd, self.payout, self.mc_stocks, self.mc_features, len(orders))
+        # New order table or common fields changed - everything has to be recalculated
+        if settings != self.settings or orders is not self.orders:
+            self.settings = settings
+            self.orders = orders
+            self.order_keys.clear()
+            self.order_legs.clear()
+            if self.leg_listeners:
+                self.notify_legs({leg: False for leg, order_ids in self.dependents.items() if order_ids})
+            self.dependents.clear()
 
+        dirty = set()
+        updated = []    # (leg, book) stamped for latency tracking
+        for i, order in enumerate(orders):
+            if order_key(order) != self.order_keys.get(i):
+                dirty.add(i)
+        for leg, order_ids in self.dependents.items():
+            book = self.sources[leg[0]].get(leg[1])
+            seq = book.seq if book is not None else -1
+            if seq != self.leg_seq.get(leg):
+                self.leg_seq[leg] = seq
+                dirty |= order_ids
+                if order_ids and book is not None and book.committed_ns:
+                    updated.append((leg, book))
+        if len(dirty) >= self.BATCH_ORDERS:
+            self.calc_batch(orders)
+        else:
+            for i in dirty:
+                if i < len(orders):
+                    self.calc_order(i, orders[i])
+        if updated:
+            self.record_latency(updated)
         return self.data
 
+    def calc_batch(self, orders: list) -> None:
+        '''
+        Calculate the whole table with BatchCalculate and reindex the legs of every order
+        :param orders: self.data['orders']
+        '''
+        # numpy is only loaded for tables large enough to need it
+        from tasks.calculate_batch import BatchCalculate
+
+        BatchCalculate(self).start(orders)
+        asset_legs = {}     # asset -> legs, resolved once per distinct asset
+        for i, order in enumerate(orders):
+            legs = []
+            if order['lot1'] and order['lot2']:
+                asset = order['asset']
+                legs = asset_legs.get(asset)
+                if legs is None:
+                    assets_type = self.check_arb_type(asset)
+                    legs = asset_legs[asset] = self.get_legs(assets_type) if assets_type else []
+            self.order_keys[i] = order_key(order)
+            self.index_legs(i, legs)
+        # Every book was priced as it is now
+        for leg in self.dependents:
+            book = self.sources[leg[0]].get(leg[1])
+            self.leg_seq[leg] = book.seq if book is not None else -1
+
+    def on_book_update(self, source: str, instrument: str) -> set:
+        '''
+        Recalculate only the orders that use the instrument as one of their legs.
+        :param source: 'moex' or 'forex'
+        :param instrument: 'SBER', 'SILV-3.25', 'XAGUSD'
+        :return: indexes of recalculated orders
+        '''
+        leg = (source, instrument)
+        order_ids = self.dependents.get(leg, set())
+        book = self.sources[source].get(instrument)
+        self.leg_seq[leg] = book.seq if book is not None else -1
+        for i in order_ids:
+            self.calc_order(i, self.orders[i])
+        if order_ids and book is not None and book.committed_ns:
+            self.record_latency([(leg, book)])
+        return order_ids
+
+    @staticmethod
+    def record_latency(updated: list) -> None:
+        '''
+        Record the latency of book updates consumed by the calculation
+        :param updated: [((source, instrument), OrderBook), ...]
+        '''
+        if not latency.tracker.enabled:
+            return
+        calculated_ns = time.monotonic_ns()
+        for (source, instrument), book in updated:
+            latency.tracker.record_calculated(SOURCE_FEEDS[source], instrument, book, calculated_ns)
+
+    def on_roll(self, changes: dict) -> None:
+        '''
+        RollCalendar listener, futures legs moved to new contracts so everything is recalculated on next start
+        :param changes: {'SILV-3.25': 'SILV-6.25'}
+        '''
+        self.settings = None
+
+    def calc_order(self, i: int, order: dict) -> None:
+        '''
+        Calculate one order and reindex its legs
+        :param i: index of the order in self.data['orders']
+        :param order: order dict
+        '''
+        legs = []
+        if self.check_fields(order):    # skip empty orders
+            # assets_type -1 error, 0 - Moex stocks-stocks, 1 - Moex stocks/features, 2 - Moex features/Forex features
+            assets_type = self.check_arb_type(order['asset'])
+            if assets_type:
+                # Convert all necessary strings in order to Float
+                convert_order(order)
+                # Calculate full positions
+                positions = self.calc_position(order, assets_type)
+                order['position1'] = positions[0]
+                order['position2'] = positions[1]
+                # Calculate enter average
+                order['ent_av'] = self.calc_av([order['price1'], order['price2'], assets_type[2]])
+                if not order['price1'] and not order['price2'] or order['price1'] == 0 and order['price2'] == 0:
+                    order['lot1'] = -order['lot2']
+                    order['lot2'] = -order['lot2']
+                legs = self.get_legs(assets_type)
+                prices = self.get_prices(order, assets_type)
+                order['cur_price1'] = prices[0]
+                order['cur_price2'] = prices[1]
+                # Calculate current average
+                order['cur_av'] = self.calc_av([prices[0], prices[1], assets_type[2]])
+                # Calculate margin call level
+                self.calc_mc(order, assets_type)
+                # Calculate profit
+                order['profit'] = self.calc_profit(order, assets_type)
+                # print(f"Debug start: {order}")
+        self.order_keys[i] = order_key(order)
+        self.index_legs(i, legs)
+
+    def index_legs(self, i: int, legs: list) -> None:
+        '''
+        Move the order to the dependents of its current legs
+        :param i: index of the order in self.data['orders']
+        :param legs: [(source, instrument), ...]
+        '''
+        old_legs = self.order_legs.get(i, ())
+        if legs == old_legs:
+            return
+        changes = {}    # legs whose first order came or last order went
+        for leg in old_legs:
+            order_ids = self.dependents[leg]
+            order_ids.discard(i)
+            if not order_ids:
+                changes[leg] = False
+        self.order_legs[i] = legs
+        for leg in legs:
+            order_ids = self.dependents.setdefault(leg, set())
+            if not order_ids and changes.pop(leg, None) is None:
+                changes[leg] = True
+            order_ids.add(i)
+            if leg not in self.leg_seq:
+                book = self.sources[leg[0]].get(leg[1])
+                self.leg_seq[leg] = book.seq if book is not None else -1
+        if changes and self.leg_listeners:
+            self.notify_legs(changes)
+
     # Calculate profit
     def calc_profit(self, order, assets_type: list):
         position1 = order.get('position1')
@@ -157,44 +326,34 @@ class Calculate:
         positions.append(position2)
         return positions
 
+    # Return sources and instruments of both legs [('moex', 'SILV-3.25'), ('forex', 'XAGUSD')]
+    def get_legs(self, assets) -> list:
+        asset1 = assets[0]
+        if assets[-1] == 2:
+            asset1 = self.roll_calendar.convert(asset1)
+        if not assets[-1]:
+            return [('moex', asset1), ('moex', assets[1])]
+        return [('moex', asset1), ('forex', assets[1])]
+
     # Return price from the stock book
     def get_prices(self, order, assets) -> list:
-        prices = []
         lots1 = order['lot1']
         lots2 = order['lot2']
-        if assets[-1] == 2:
-            assets[0] = convert_tv_to_moex_features(self.features_subst, assets[0])
-        cur_price1 = self.moex_trading_data.get(assets[0])
-        if not assets[-1]:
-            cur_price2 = self.moex_trading_data.get(assets[1])
-        else:
-            cur_price2 = self.forex_trading_data.get(assets[1])
+        (source1, asset1), (source2, asset2) = self.get_legs(assets)
+        cur_price1 = self.sources[source1].get(asset1)
+        cur_price2 = self.sources[source2].get(asset2)
         if cur_price1:
-            cur_price1 = cur_price1.get('data')
-            if cur_price1:
-                if lots1 < 0:
-                    cur_price1 = cur_price1.get('asks')
-                else:
-                    cur_price1 = cur_price1.get('bids')
-                cur_price1 = self.get_best_price(cur_price1, lots1)
+            cur_price1 = cur_price1.fill_price('asks' if lots1 < 0 else 'bids', self.leg_size(order, 1, source1))[1]
         if cur_price2:
-            cur_price2 = cur_price2.get('data')
-            if cur_price2:
-                if lots2 < 0:
-                    cur_price2 = cur_price2.get('asks')
-                else:
-                    cur_price2 = cur_price2.get('bids')
-                cur_price2 = self.get_best_price(cur_price2, lots2)
+            cur_price2 = cur_price2.fill_price('asks' if lots2 < 0 else 'bids', self.leg_size(order, 2, source2))[1]
         return [cur_price1, cur_price2]
 
-    # Get the best price from the list of prices dicts
-    def get_best_price(self, prices, lots):
-        cur_lots = 0
-        for price in prices:
-            cur_lots += price.get('volume')
-            if cur_lots >= lots:
-                return price.get('price')
-            return price.get('price')
+    # Volume of the order leg in units of its book: lots on MOEX, lots * contract size on forex
+    @staticmethod
+    def leg_size(order: dict, leg: int, source: str) -> float:
+        if source == 'forex':
+            return abs(safe_float_convert(order.get(f'position{leg}')))
+        return abs(order[f'lot{leg}'])
 
     # Calculate average
     def calc_av(self, prices: list) -> float | None:
@@ -262,53 +421,29 @@ def safe_float_convert(value, default=0.0):
 def convert_tv_to_moex_features(features_subst, tradingview_code: str) -> str:
     '''
     Convert features names from TradingView format (SV1!) to Moex format (SILV-3.25)
+    through a RollCalendar shared by all callers with the same features_subst
     :param tradingview_code:
     :return:
     '''
-    if not tradingview_code[-2:-1].isdigit() and not tradingview_code[-1:] == '!':
-        raise ValueError("Invalid TradingView code format")
-
-    # quarter_offset = int(tradingview_code[-2:-1]) - 1  # Convert 1! -> 0, 2! -> 1
-    if tradingview_code[:-2] in features_subst.keys():
-        new_code = features_subst[tradingview_code[:-2]]
-    else:
-        new_code = tradingview_code[:-2]
-
-    current_date = datetime.now()
-    # current_date = datetime(2025, 3, 20, hour=19)
-    # Define quarter end months (March, June, September, December)
-    quarter_ends = [3, 6, 9, 12]
-
-    # Find the current quarter's end month
-    current_month = current_date.month
-    current_year = current_date.year
-    next_quarter_end = min([m for m in quarter_ends if m >= current_month], default=3)
-    # If we're in December, move to next year's March
-    if next_quarter_end == 3 and current_month > 3:
-        current_year += 1
-
-    # Set target date to 3rd of the quarter's last month
-    target_date = datetime(current_year, next_quarter_end,1)
-    # Skip 2 first weeks
-    target_date = target_date + timedelta(weeks=2)
-    # Find the next Thursday
-    while target_date.weekday() != 3:  # 3 represents Thursday (0 = Monday)
-        target_date += timedelta(days=1)
-    # If this date is before current date, move to next quarter
-    if target_date < current_date or (target_date == current_date and current_date.hour >= 19):
-        # Calculate months to add (3 months forward)
-        new_month = next_quarter_end + 3
-        new_year = current_year
-        if new_month > 12:
-            new_month -= 12
-            new_year += 1
-        target_date = datetime(new_year, new_month, 1)
-        # Skip 2 weeks
-        target_date = target_date + timedelta(weeks=2)
-        # Find next Thursday
-        while target_date.weekday() != 3:
-            target_date += timedelta(days=1)
-    return f"{new_code}-{target_date.month}.{str(target_date.year)[2:]}"
+    calendar = _roll_calendars.get(id(features_subst))
+    if calendar is None or calendar.features_subst is not features_subst:
+        calendar = _roll_calendars[id(features_subst)] = RollCalendar(features_subst)
+    return calendar.convert(tradingview_code)
+
+
+_roll_calendars = {}
+
+
+# Inputs of the order that affect its calculation
+def order_key(order: dict) -> tuple:
+    return (
+        order.get('asset'),
+        safe_float_convert(order.get('lot1')),
+        safe_float_convert(order.get('price1')),
+        safe_float_convert(order.get('lot2')),
+        safe_float_convert(order.get('price2')),
+        order.get('exit'),
+    )
 
 
 # Safe convert necessary  strings from order to floats
@@ -0,0 +1,244 @@
+import numpy as np
+
+from tasks.calculate import Calculate, safe_float_convert
+
+
+class BatchCalculate:
+    '''
+    Vectorized version of Calculate.start for large order tables.
+
+    All orders are loaded into NumPy columns, positions, averages, margin calls and profits of
+    stocks-stocks (0), stocks/futures (1) and futures/forex (2) orders are computed in one pass
+    and the results are written back into the order dicts in the shape Calculate produces.
+    '''
+
+    def __init__(self, calculate: Calculate):
+        self.calculate = calculate
+
+    def start(self, orders: list | None = None) -> dict:
+        '''
+        :param orders: list of order dicts, self.calculate.data['orders'] by default
+        :return: self.calculate.data
+        '''
+        calc = self.calculate
+        data = calc.data
+        calc.usd = safe_float_convert(data['usdrub'])
+        calc.payout = safe_float_convert(data['payout'])
+        calc.mc_stocks = safe_float_convert(data['mc_stocks'])
+        calc.mc_features = safe_float_convert(data['mc_features'])
+        if orders is None:
+            orders = data['orders']
+        columns = self.load(orders)
+        results = self.evaluate(columns)
+        self.write_back(orders, columns, results)
+        return data
+
+    def load(self, orders: list) -> dict:
+        '''
+        Load orders into columns. Assets are resolved once per distinct asset string.
+        :param orders: list of order dicts
+        :return: dict of NumPy arrays
+        '''
+        count = len(orders)
+        assets = []
+        filled = np.zeros(count, dtype=bool)
+        values = np.zeros((5, count))
+        has_exit = np.zeros(count, dtype=bool)
+        for i, order in enumerate(orders):
+            assets.append(order.get('asset', ''))
+            filled[i] = bool(order['lot1'] and order['lot2'])
+            values[0, i] = safe_float_convert(order.get('lot1'))
+            values[1, i] = safe_float_convert(order.get('price1'))
+            values[2, i] = safe_float_convert(order.get('lot2'))
+            values[3, i] = safe_float_convert(order.get('price2'))
+            if order.get('exit'):
+                has_exit[i] = True
+                values[4, i] = safe_float_convert(order.get('exit'))
+
+        unique_assets, asset_index = np.unique(np.array(assets, dtype=object), return_inverse=True)
+        size = len(unique_assets)
+        arb_type = np.full(size, -1, dtype=np.int8)
+        multiplier1 = np.ones(size)
+        multiplier2 = np.ones(size)
+        legs = [(None, None)] * size           # (book, source) of both legs per asset
+        for u, asset in enumerate(unique_assets):
+            assets_type = self.calculate.check_arb_type(asset)
+            if not assets_type:
+                continue
+            arb_type[u] = assets_type[2]
+            if assets_type[2] in (1, 2):
+                lots = self.calculate.features.get(asset)
+                multiplier1[u] = lots[assets_type[0]]
+                multiplier2[u] = lots[assets_type[1]]
+            legs[u] = tuple((self.calculate.sources[source].get(instrument), source)
+                            for source, instrument in self.calculate.get_legs(assets_type))
+        order_ids = np.argsort(asset_index, kind='stable')
+        bounds = np.searchsorted(asset_index[order_ids], np.arange(size + 1))
+
+        return {
+            'filled': filled,
+            'type': arb_type[asset_index],
+            'lot1': values[0],
+            'price1': values[1],
+            'lot2': values[2],
+            'price2': values[3],
+            'exit': values[4],
+            'has_exit': has_exit,
+            'multiplier1': multiplier1[asset_index],
+            'multiplier2': multiplier2[asset_index],
+            'legs': legs,
+            'groups': [order_ids[bounds[u]:bounds[u + 1]] for u in range(size)],
+        }
+
+    def evaluate(self, c: dict) -> dict:
+        '''
+        Compute positions, averages, current prices, margin calls and profits of all orders
+        :param c: columns from load()
+        :return: dict of result columns, NaN where Calculate leaves a field empty
+        '''
+        calc = self.calculate
+        arb_type = c['type']
+        stocks = arb_type == 0
+        features = (arb_type == 1) | (arb_type == 2)
+        forex = arb_type == 2
+        lot1 = c['lot1'].copy()
+        lot2 = c['lot2'].copy()
+        price1 = c['price1']
+        price2 = c['price2']
+
+        position1 = np.where(features, np.round(c['multiplier1'] * lot1, 3), lot1)
+        position2 = np.where(features, np.round(c['multiplier2'] * lot2, 3), lot2)
+        ent_av = _average(price1, price2, stocks)
+
+        # Orders without entry prices are quoted as the opposite of the second leg
+        no_prices = (price1 == 0) & (price2 == 0)
+        lot1 = np.where(no_prices, -lot2, lot1)
+        lot2 = np.where(no_prices, -lot2, lot2)
+
+        cur_price1 = self.fill_prices(c, 0, lot1, np.abs(lot1), np.abs(position1))
+        cur_price2 = self.fill_prices(c, 1, lot2, np.abs(lot2), np.abs(position2))
+        cur1 = np.nan_to_num(cur_price1)
+        cur2 = np.nan_to_num(cur_price2)
+        cur_av = _average(cur1, cur2, stocks)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Margin call of stocks: only for opposite positions
+            positions = np.abs(position1) + np.abs(position2)
+            mc_stocks = np.where(position1 > 0, ent_av - calc.mc_stocks / positions, ent_av + calc.mc_stocks / positions)
+            mc_stocks_set = stocks & (position1 != 0) & (position2 != 0) & (ent_av != 0) & (position1 * position2 < 0)
+            # Margin call of futures/forex
+            mc_forex = np.where(position1 > 0,
+                                price1 + calc.mc_features / position1 / calc.usd,
+                                price1 - calc.mc_features / position1 / calc.usd)
+            mc_forex_set = forex & (price1 != 0) & (position1 != 0) & bool(calc.usd) & bool(calc.mc_features)
+            mc = np.round(np.where(stocks, mc_stocks, mc_forex), 2)
+            mc_set = mc_stocks_set | mc_forex_set
+
+            # Profit
+            exit_av = np.where(c['has_exit'], c['exit'], cur_av)
+            payout = (100 - calc.payout) / 100
+            quoted = ((position1 != 0) & (ent_av != 0) & (exit_av != 0)) | \
+                     ((position2 != 0) & (price1 != 0) & (price2 != 0) & (cur1 != 0) & (cur2 != 0))
+            profit_stocks = np.round((exit_av - ent_av) * position1 * payout, 2)
+            first_leg = (cur1 - price1) * position1
+            first_leg = np.where(first_leg > 0, first_leg * round(payout, 2), first_leg)
+            profit_forex = np.round((first_leg + (cur2 - price2) * position2) * calc.usd, 2)
+            profit_exit = np.round(-(ent_av / exit_av * 100 - 100) * position1 * price1 / 100 * calc.usd, 2)
+            profit_forex = np.where(c['has_exit'], np.where(exit_av != 0, profit_exit, np.nan), profit_forex)
+            profit = np.where(stocks, profit_stocks, np.where(forex, profit_forex, np.nan))
+            profit = np.where(quoted, profit, np.nan)
+
+        return {
+            'lot1': lot1,
+            'lot2': lot2,
+            'position1': position1,
+            'position2': position2,
+            'ent_av': ent_av,
+            'cur_price1': cur_price1,
+            'cur_price2': cur_price2,
+            'cur_av': cur_av,
+            'mc': np.where(mc_set, mc, np.nan),
+            'profit': profit,
+        }
+
+    @staticmethod
+    def fill_prices(c: dict, leg: int, lots: np.ndarray, lot_sizes: np.ndarray, position_sizes: np.ndarray) -> np.ndarray:
+        '''
+        Vectorized OrderBook.fill_price: VWAP of every order leg against its book
+        :param c: columns from load()
+        :param leg: 0 or 1
+        :param lots: signed lots, short legs take asks and long legs take bids
+        :param lot_sizes: leg size for MOEX books
+        :param position_sizes: leg size for forex books
+        :return: VWAP per order, NaN without quotes
+        '''
+        result = np.full(len(lots), np.nan)
+        for group, legs in zip(c['groups'], c['legs']):
+            if legs[0] is None or legs[leg][0] is None:
+                continue
+            book, source = legs[leg]
+            book.cumulate()
+            sizes = position_sizes if source == 'forex' else lot_sizes
+            for side, orders in (('asks', group[lots[group] < 0]), ('bids', group[lots[group] >= 0])):
+                count = book.ask_count if side == 'asks' else book.bid_count
+                if not count or not len(orders):
+                    continue
+                prices = np.frombuffer(getattr(book, f'{side[:3]}_prices'))[:count]
+                cum_volumes = np.frombuffer(getattr(book, f'{side[:3]}_cum_volumes'))[:count]
+                cum_notional = np.frombuffer(getattr(book, f'{side[:3]}_cum_notional'))[:count]
+                size = np.minimum(sizes[orders], cum_volumes[-1])
+                i = np.minimum(np.searchsorted(cum_volumes, size, 'left'), count - 1)
+                volume_before = np.where(i > 0, cum_volumes[i - 1], 0.0)
+                notional_before = np.where(i > 0, cum_notional[i - 1], 0.0)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    vwap = (notional_before + (size - volume_before) * prices[i]) / size
+                result[orders] = np.where(size > 0, vwap, prices[0])
+        return result
+
+    @staticmethod
+    def write_back(orders: list, c: dict, r: dict) -> None:
+        '''
+        Write results into the order dicts the way Calculate.start does
+        :param orders: list of order dicts
+        :param c: columns from load()
+        :param r: results from evaluate()
+        '''
+        valid = (c['type'] >= 0).tolist()
+        filled = c['filled'].tolist()
+        price1 = c['price1'].tolist()
+        price2 = c['price2'].tolist()
+        columns = {name: column.tolist() for name, column in r.items()}
+        lot1, lot2 = columns['lot1'], columns['lot2']
+        position1, position2 = columns['position1'], columns['position2']
+        ent_av, cur_av = columns['ent_av'], columns['cur_av']
+        cur_price1, cur_price2 = columns['cur_price1'], columns['cur_price2']
+        mc, profit = columns['mc'], columns['profit']
+        for i, order in enumerate(orders):
+            if not filled[i]:
+                order['cur_av'] = ''
+                order['ent_av'] = ''
+                order['profit'] = ''
+                order['mc'] = ''
+                continue
+            if not valid[i]:
+                continue
+            order['lot1'] = lot1[i]
+            order['price1'] = price1[i]
+            order['lot2'] = lot2[i]
+            order['price2'] = price2[i]
+            order['position1'] = position1[i]
+            order['position2'] = position2[i]
+            order['ent_av'] = ent_av[i]
+            order['cur_price1'] = None if cur_price1[i] != cur_price1[i] else cur_price1[i]
+            order['cur_price2'] = None if cur_price2[i] != cur_price2[i] else cur_price2[i]
+            order['cur_av'] = cur_av[i]
+            if mc[i] == mc[i]:
+                order['mc'] = mc[i]
+            order['profit'] = '' if profit[i] != profit[i] else profit[i]
+
+
+# Vectorized Calculate.calc_av: difference for stocks, ratio otherwise
+def _average(price1: np.ndarray, price2: np.ndarray, stocks: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(price2 == 0, 0.0, np.round(price1 / price2, 5))
+    return np.where(stocks, np.round(price1 - price2, 2), ratio)
@@ -7,6 +7,9 @@ import logging
 import simplefix
 
 import utils.data as td
+from utils import latency
+from utils.bus import BOOK, bus
+from utils.fix import FixFramer, decode_frame, decode_md_entries, frame_msg_type
 
 
 # Configure logging
@@ -16,32 +19,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger('FixClient')
 
+# cTrader symbol ids of the quoted assets
+CTRADER_SYMBOLS = {
+    "1678": "EURUSD",
+    "1718": "XAUUSD",
+    "1719": "XAGUSD",
+    "1766": "XPDUSD",
+    "1767": "XPTUSD",
+    "1786": "SP500USD",
+    "1787": "NAS100USD",
+}
+
 
 class AsyncFixClient:
     """Asynchronous client for the FIX protocol using simplefix for message parsing."""
 
     def __init__(self, heartbeat_interval: int = 30):
         """Initialize the FIX client with heartbeat interval."""
-        self.md = {}
-        self.ctrader_requests = {
-            "1678": "EURUSD",
-            "1718": "XAUUSD",
-            "1719": "XAGUSD",
-            "1766": "XPDUSD",
-            "1767": "XPTUSD",
-            "1786": "SP500USD",
-            "1787": "NAS100USD",
-        }
-        for asset in self.ctrader_requests:
-            guid = td.trading_data.generate_guid(asset)
-            self.ctrader_requests[asset] = guid
-            for symbol, asset in self.ctrader_requests.items():
-                self.md[asset] = {
-                    "guid": guid,
-                    "bids": [],
-                    "asks": [],
-                    "timestamp": '',
-                }
+        self.md = {}        # asset -> EntryBook with every quote
+        self.books = {}     # asset -> td.OrderBook with the top levels
+        self.ctrader_requests = dict(CTRADER_SYMBOLS)
+        self.feed = 'ctrader'
+        self.clock = time.time      # seconds of book timestamps, a simulated clock in replays
+        for asset in self.ctrader_requests.values():
+            subscription = td.trading_data.subscriptions.register(self.feed, asset)
+            self.md[asset] = td.EntryBook(subscription.guid)
+            self.books[asset] = td.trading_data.get_book(subscription.guid)
 
         self.config_file = 'config.json'
         if not os.path.exists(self.config_file):
@@ -55,14 +58,15 @@ class AsyncFixClient:
         self.target_comp_id = 'cServer'
         self.sender_sub_id = 'QUOTE'
         self.target_sub_id = 'QUOTE'
-        self.host = 'live-uk-eqx-02.p.ctrader.com'
-        self.port = 5201
+        self.host = self.config.get('FixHost', 'live-uk-eqx-02.p.ctrader.com')
+        self.port = int(self.config.get('FixPort', 5201))
         self.heartbeat_interval = heartbeat_interval
 
         self.reader = None
         self.writer = None
         self.seq_num = 1
-        self.parser = simplefix.FixParser()
+        self.framer = FixFramer()
+        self.received_ns = 0    # monotonic ns of the last socket read with latency tracking on
         self.stay_connected = False
         self.heartbeat_task = None
 
@@ -151,45 +155,22 @@ class AsyncFixClient:
         if not self.reader:
             raise ConnectionError("Not connected to server")
         self.listening = False
-        buffer = bytearray()
+        self.framer.clear()
 
         while self.stay_connected:
             try:
-                # Read data
-                data = await self.reader.read(4096)
+                # Read data, the framer grows the read size while the server bursts
+                data = await self.reader.read(self.framer.read_size)
+                self.received_ns = time.monotonic_ns() if latency.tracker.enabled else 0
                 if not data:
                     logger.warning("Connection closed by server")
                     self.stay_connected = False
                     break
 
-                # Add to buffer
-                buffer.extend(data)
-
-                # Try to parse complete messages from the buffer
-                messages_found = True
-                while messages_found and buffer:
-                    # Create a new parser for each iteration to ensure clean state
-                    temp_parser = simplefix.FixParser()
-                    temp_parser.append_buffer(bytes(buffer))
-                    msg = temp_parser.get_message()
-
-                    if msg is None:
-                        # No complete message found in buffer
-                        messages_found = False
-                    else:
-                        # Process the message
-                        await self.process_message(msg)
-
-                        # Find the end of this message to remove it from buffer
-                        # FIX messages end with the SOH character (ASCII 1)
-                        msg_bytes = msg.encode()
-                        msg_len = len(msg_bytes)
-                        if msg_len <= len(buffer):
-                            buffer = buffer[msg_len:]
-                        else:
-                            # This shouldn't happen, but just in case
-                            logger.warning("Message length issue, clearing buffer")
-                            buffer.clear()
+                # Process every complete message, the buffer is compacted once per read
+                self.framer.feed(data)
+                for frame in self.framer.frames():
+                    await self.process_frame(frame)
                 if not self.listening:
                     self.listening = True  # Set after first successful read
                 # print(self.md)
@@ -201,6 +182,16 @@ class AsyncFixClient:
                 logger.error(f"Error in listen loop: {e}")
                 await asyncio.sleep(1)  # Prevent busy looping on error
 
+    async def process_frame(self, frame: memoryview) -> None:
+        """Route market data to the group decoder and session messages to simplefix, only those are copied."""
+        msg_type = frame_msg_type(frame)
+        if msg_type == b'X':  # Market Data Incremental Refresh
+            await self.handle_market_data_incremental(frame)
+        elif msg_type == b'W':  # Market Data Snapshot
+            await self.handle_market_data_snapshot(frame)
+        else:
+            await self.process_message(decode_frame(frame))
+
     async def process_message(self, msg: simplefix.FixMessage) -> None:
         """Process received FIX messages."""
         msg_type = msg.get(35).decode('ascii')
@@ -212,10 +203,6 @@ class AsyncFixClient:
                 await self.send_heartbeat_response(test_req_id)
         elif msg_type == '5':  # Logout
             self.stay_connected = False
-        elif msg_type == 'W':  # Market Data Snapshot
-            await self.handle_market_data_snapshot(msg)
-        elif msg_type == 'X':  # Market Data Incremental Refresh
-            await self.handle_market_data_incremental(msg)
         # print(self.md)
 
     async def send_heartbeat_response(self, test_req_id: bytes) -> None:
@@ -224,111 +211,48 @@ class AsyncFixClient:
         msg.append_pair(112, test_req_id)
         await self.send_message(msg)
 
-    async def handle_market_data_snapshot(self, msg: simplefix.FixMessage) -> None:
+    async def handle_market_data_snapshot(self, frame: memoryview) -> None:
         """Process Market Data Snapshot message."""
         try:
-            symbol = msg.get(55)
-            if symbol:
-                symbol = symbol.decode('ascii')
-
-            # Extract entry count
-            no_entries = msg.get(268)
-            if not no_entries:
-                return
-            no_entries = int(no_entries.decode('ascii'))
-
-            for i in range(no_entries):
-                entry_type = msg.get(269, i)
-                if entry_type:
-                    entry_type = entry_type.decode('ascii')
-                price = msg.get(270, i)
-                if price:
-                    price = float(price.decode('ascii'))
-                size = msg.get(271, i)
-                if size:
-                    size = float(size.decode('ascii'))
-
-                for key, value in self.ctrader_requests.items():
-                    if symbol == key:
-                        if entry_type == "0":  # Bid
-                            for entry in self.md[value]['bids']:
-                                if entry['volume'] == size:
-                                    entry['price'] = price
-                                    break
-                            else:
-                                self.md[value]['bids'].append({"price": price, "volume": size})
-                        elif entry_type == "1":  # Offer
-                            for entry in self.md[value]['asks']:
-                                if entry['volume'] == size:
-                                    entry['price'] = price
-                                    break
-                            self.md[value]['asks'].append({"price": price, "volume": size})
-                        td.trading_data.order_book[value] = td.OrderBook(
-                            instrument_uid=value,
-                            bids=self.md[value].get('bids', []),
-                            asks=self.md[value].get('asks', []),
-                            timestamp=int(time.time()),
-                        )
-                        break
+            symbol, entries = decode_md_entries(frame)
+            asset = self.ctrader_requests.get(symbol)
+            if asset:
+                self.md[asset].clear()   # Snapshot replaces the whole book
+            self.update_md(entries)
         except Exception as e:
             logger.error(f"Error processing snapshot: {e}")
 
-    async def handle_market_data_incremental(self, msg: simplefix.FixMessage) -> None:
+    async def handle_market_data_incremental(self, frame: memoryview) -> None:
         """Process Market Data Incremental Refresh message."""
         try:
-            no_entries = msg.get(268)
-            if not no_entries:
-                return
-            no_entries = int(no_entries.decode('ascii'))
-
-            for i in range(no_entries):
-                # Update action (0=New, 1=Change, 2=Delete)
-                update_action = msg.get(279, i)
-                if update_action:
-                    update_action = update_action.decode('ascii')
-
-                # Entry type (0=Bid, 1=Offer, etc.)
-                entry_type = msg.get(269, i)
-                type_str = "Unknown"
-                if entry_type:
-                    entry_type = entry_type.decode('ascii')
-                symbol = msg.get(55, i)
-                if symbol:
-                    symbol = symbol.decode('ascii')
-                price = msg.get(270, i)
-                if price:
-                    price = float(price.decode('ascii'))
-                size = msg.get(271, i)
-                if size:
-                    size = float(size.decode('ascii'))
-                # if update_action == "0":  # New
-                for key, value in self.ctrader_requests.items():
-                    if symbol == key:
-                        if entry_type == "0":  # Bid
-                            for entry in self.md[value]['bids']:
-                                if entry['volume'] == size:
-                                    entry['price'] = price
-                                    break
-                            else:
-                                self.md[value]['bids'].append({"price": price, "volume": size})
-                        elif entry_type == "1":  # Offer
-                            for entry in self.md[value]['asks']:
-                                if entry['volume'] == size:
-                                    entry['price'] = price
-                                    break
-                            else:
-                                self.md[value]['asks'].append({"price": price, "volume": size})
-                        td.trading_data.order_book[value] = td.OrderBook(
-                            instrument_uid=value,
-                            bids=self.md[value].get('bids', []),
-                            asks=self.md[value].get('asks', []),
-                            timestamp=int(time.time()),
-                        )
-                        break
-
+            _, entries = decode_md_entries(frame)
+            self.update_md(entries)
         except Exception as e:
             logger.error(f"Error processing incremental data: {e}")
 
+    def update_md(self, entries: list[tuple]) -> None:
+        """Apply decoded market data entries to the books and publish the changed ones."""
+        decoded_ns = time.monotonic_ns() if latency.tracker.enabled else 0
+        changed = set()
+        for update_action, entry_type, entry_id, symbol, price, size in entries:
+            asset = self.ctrader_requests.get(symbol)
+            if asset is None:
+                continue
+            self.md[asset].apply(update_action, entry_type, entry_id, price, size)
+            changed.add(asset)
+        for asset in changed:
+            book = self.md[asset]
+            book.timestamp = int(self.clock())
+            td.trading_data.subscriptions.touch(book.instrument_uid)
+            order_book = self.books[asset]
+            # Only the levels from the first changed one are copied
+            book.commit(order_book)
+            if decoded_ns:
+                latency.tracker.record_commit(self.feed, asset, order_book, self.received_ns, decoded_ns,
+                                              time.monotonic_ns())
+            td.trading_data.record(self.feed, asset, order_book)
+            bus.publish(BOOK, (self.feed, asset), order_book)
+
     async def disconnect(self) -> None:
         """Disconnect from the FIX server."""
         self.stay_connected = False
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import multiprocessing
+
+import utils.data as td
+from utils import latency
+from utils.bus import BOOK, bus
+from utils.shared_books import SharedBooks
+
+
+logger = logging.getLogger('FeedProcesses')
+
+FEEDS = ('alor', 'ctrader')
+
+
+async def run_feed(feed: str, segment: str, assets: list, features_subst: dict) -> None:
+    '''Feed handler of a child process, every committed book goes to the shared segment'''
+    # Imported here, the parent process of the multi-process mode doesn't connect them
+    from tasks.alor import Alor
+    from tasks.forex import AsyncFixClient
+    from tasks.roll_calendar import RollCalendar
+
+    td.trading_data.shared = SharedBooks.attach(segment)
+    tasks = []
+    if feed == 'alor':
+        client = Alor(assets)
+        roll_calendar = RollCalendar(features_subst)
+        roll_calendar.subscribe(client.on_roll)
+        tasks += [client.connect(assets), roll_calendar.watch()]
+        latency_log = client.config.get('LatencyLog')
+    else:
+        client = AsyncFixClient()
+        tasks.append(client.start())
+        latency_log = client.config.get('LatencyLog')
+    # Decode and commit stages are measured here, the parent measures Calculate from the copied stamps
+    latency.tracker.enabled = bool(latency_log)
+    if latency_log:
+        tasks.append(latency.tracker.report(latency_log))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        td.trading_data.shared.close()
+        td.trading_data.shared = None
+
+
+def feed_main(feed: str, segment: str, assets: list, features_subst: dict) -> None:
+    '''Entry point of a feed process'''
+    try:
+        asyncio.run(run_feed(feed, segment, assets, features_subst))
+    except KeyboardInterrupt:
+        pass
+
+
+class FeedProcesses:
+    '''
+    Alor and AsyncFixClient in their own processes, books come back through shared memory.
+
+    Each feed process is the single writer of its SharedBooks segment. `pump` polls the seq
+    columns of both segments, copies the changed slots into the books Calculate reads and
+    publishes them on the bus, so the rest of this process works as with in-process feeds.
+    '''
+
+    def __init__(self, moex_books: dict, forex_books: dict, assets_moex: list, features_subst: dict,
+                 depth: int = 20, slots: int = 256, poll: float = 0.001):
+        '''
+        :param moex_books: Alor.alor_assets_data, instrument -> td.OrderBook
+        :param forex_books: AsyncFixClient.books, asset -> td.OrderBook
+        :param assets_moex: ['TATN', 'TATNP', 'SILV-3.25']
+        :param features_subst: {'SV': 'SILV', 'GD': 'GOLD'} for the roll calendar of the Alor process
+        :param depth: levels per side in shared memory
+        :param slots: most instruments per feed
+        :param poll: seconds between polls of the segments
+        '''
+        self.books = {'alor': moex_books, 'ctrader': forex_books}
+        self.assets_moex = assets_moex
+        self.features_subst = features_subst
+        self.depth = depth
+        self.slots = slots
+        self.poll = poll
+        self.segments = {}      # feed -> SharedBooks
+        self.processes = {}     # feed -> multiprocessing.Process
+
+    @property
+    def connected(self) -> bool:
+        return any(process.is_alive() for process in self.processes.values())
+
+    def start(self) -> None:
+        context = multiprocessing.get_context('spawn')
+        for feed in FEEDS:
+            segment = self.segments[feed] = SharedBooks.create(depth=self.depth, slots=self.slots)
+            process = self.processes[feed] = context.Process(
+                target=feed_main, name=f'feed-{feed}', daemon=True,
+                args=(feed, segment.name, self.assets_moex if feed == 'alor' else [], self.features_subst),
+            )
+            process.start()
+            logger.info(f"Started {feed} feed process {process.pid}, books in {segment.name}")
+
+    async def pump(self) -> None:
+        '''Copy changed books from the feed processes, never returns'''
+        while True:
+            for feed, segment in self.segments.items():
+                books = self.books[feed]
+                for slot in segment.changed().tolist():
+                    instrument = segment.names[slot]
+                    book = books.get(instrument)
+                    if book is None:
+                        book = books[instrument] = td.OrderBook(instrument, self.depth)
+                    segment.read(slot, book)
+                    bus.publish(BOOK, (feed, instrument), book)
+            await asyncio.sleep(self.poll)
+
+    def stop(self) -> None:
+        for feed, process in self.processes.items():
+            process.terminate()
+            process.join(5)
+            logger.info(f"Stopped {feed} feed process")
+        for segment in self.segments.values():
+            segment.close()
+        self.processes.clear()
+        self.segments.clear()
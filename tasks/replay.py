@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from array import array
+from datetime import datetime
+from itertools import chain
+
+import utils.data as td
+from tasks.calculate import Calculate
+from utils.recorder import BID, TickSegment, segment_paths
+from utils.tick_index import TickStore
+
+
+logger = logging.getLogger('Replay')
+
+
+class SimClock:
+    '''Simulated clock moved by replayed records, wall time of the recording'''
+
+    def __init__(self):
+        self.wall_ns = 0
+
+    def set(self, wall_ns: int) -> None:
+        self.wall_ns = wall_ns
+
+    def time(self) -> float:
+        return self.wall_ns / 1e9
+
+    def now(self) -> datetime:
+        '''Drop-in replacement of datetime.now for RollCalendar'''
+        return datetime.fromtimestamp(self.wall_ns / 1e9)
+
+
+class Replay:
+    '''
+    Replay of TickRecorder segments through the live book update path.
+
+    Alor books go through Alor.update_book, cTrader books are turned into MDEntry deletes and
+    inserts for AsyncFixClient.update_md, so td.trading_data.order_book, AsyncFixClient.md and
+    Alor.alor_assets_data end up exactly as they were live. Calculate.start runs after every
+    update or every calc_interval of simulated time. Nothing touches the network.
+    '''
+
+    def __init__(self, path: str, alor, forex, calculate: Calculate | None = None, stocks: list | None = None,
+                 speed: float | None = None, calc_interval: float = 0.0, clock: SimClock | None = None,
+                 instruments: list | None = None, start=None, end=None):
+        '''
+        :param path: recording directory or one segment file
+        :param alor: tasks.alor.Alor, never connected
+        :param forex: tasks.forex.AsyncFixClient, never connected
+        :param calculate: Calculate over alor.alor_assets_data and forex.books, None to replay books only
+        :param stocks: argument of Calculate.start
+        :param speed: 1 real time, N for N times faster, None as fast as possible
+        :param calc_interval: simulated seconds between Calculate.start calls, 0 after every update
+        :param clock: SimClock shared with RollCalendar and observers
+        :param instruments: replay only these instruments, all by default
+        :param start: replay from datetime, time.time() float or wall clock ns
+        :param end: replay until datetime, time.time() float or wall clock ns
+        '''
+        self.path = path
+        self.paths = segment_paths(path)
+        self.instruments = instruments
+        self.start = start
+        self.end = end
+        self.alor = alor
+        self.forex = forex
+        self.calculate = calculate
+        self.stocks = stocks or []
+        self.speed = speed
+        self.calc_interval_ns = int(calc_interval * 1e9)
+        self.clock = clock or SimClock()
+        # Book timestamps and subscription activity follow the recording, not the machine running the replay
+        forex.clock = self.clock.time
+        td.trading_data.subscriptions.clock = self.clock.time
+        self.observers = []         # callables(feed, instrument, book) after every book update
+        self.symbols = {asset: symbol for symbol, asset in forex.ctrader_requests.items()}
+        self.sides = {}             # (feed, instrument) -> [bids, asks] as lists of (price, volume)
+        self.records = 0
+        self.updates = 0
+        self.calculations = 0
+        self.elapsed = 0.0
+
+    def observe(self, observer) -> None:
+        '''
+        :param observer: callable(feed, instrument, book) called after every replayed book update
+        '''
+        self.observers.append(observer)
+
+    async def run(self) -> dict:
+        '''
+        Replay all segments
+        :return: throughput stats
+        '''
+        start = time.perf_counter()
+        first_ns = None
+        last_calc_ns = None
+        store = TickStore(self.path)
+        try:
+            for segment in store.segments:
+                records = self.segment_records(store, segment)
+                try:
+                    for timestamp, feed, instrument, side, prices, volumes in records:
+                        self.records += 1
+                        self.clock.set(segment.wall_time_ns(timestamp))
+                        if first_ns is None:
+                            first_ns = self.clock.wall_ns
+                        if self.speed:
+                            delay = (self.clock.wall_ns - first_ns) / 1e9 / self.speed - (time.perf_counter() - start)
+                            if delay > 0.001:
+                                await asyncio.sleep(delay)
+                        levels = list(zip(prices.tolist(), volumes.tolist()))
+                        del prices, volumes
+                        book = self.apply(feed, instrument, side, levels)
+                        if book is None:
+                            continue
+                        self.updates += 1
+                        for observer in self.observers:
+                            observer(feed, instrument, book)
+                        if self.calculate is not None and self.calculate.data and (
+                                last_calc_ns is None or self.clock.wall_ns - last_calc_ns >= self.calc_interval_ns):
+                            last_calc_ns = self.clock.wall_ns
+                            self.calculate.start(self.stocks)
+                            self.calculations += 1
+                finally:
+                    records.close()
+        finally:
+            store.close()
+        self.elapsed = time.perf_counter() - start
+        return self.stats()
+
+    def segment_records(self, store: TickStore, segment: TickSegment):
+        '''Records of a segment, only the indexed spans of the query if instruments or times are set'''
+        if self.instruments is None and self.start is None and self.end is None:
+            yield from segment.records()
+            return
+        instruments = self.instruments or {name for _, name in segment.instruments}
+        ids, start_ns, end_ns, spans = store.spans(segment, instruments, self.start, self.end)
+        for first, stop in spans:
+            for record in segment.records(first, stop):
+                if record[2] in instruments and (start_ns is None or record[0] >= start_ns) and \
+                        (end_ns is None or record[0] < end_ns):
+                    yield record
+
+    def apply(self, feed: str, instrument: str, side: int, levels: list) -> td.OrderBook | None:
+        '''
+        Update one side of a book. TickRecorder writes the bid side right before the ask side
+        of the same update, so a book is published on the ask record only.
+        :return: updated book or None while the update is incomplete
+        '''
+        sides = self.sides.setdefault((feed, instrument), [[], []])
+        sides[side] = levels
+        if side == BID:
+            return None
+        bids, asks = sides
+        if feed == 'alor':
+            return self.update_alor(instrument, bids, asks)
+        return self.update_forex(instrument, bids, asks)
+
+    def update_alor(self, instrument: str, bids: list, asks: list) -> td.OrderBook | None:
+        subscription = td.trading_data.subscriptions.find(self.alor.feed, instrument)
+        if subscription is None:
+            subscription = td.trading_data.subscriptions.register(self.alor.feed, instrument)
+        self.alor.update_book(
+            subscription.guid,
+            array('d', chain.from_iterable(bids)),
+            array('d', chain.from_iterable(asks)),
+            self.clock.wall_ns // 1_000_000,
+        )
+        return self.alor.alor_assets_data.get(instrument)
+
+    def update_forex(self, instrument: str, bids: list, asks: list) -> td.OrderBook | None:
+        symbol = self.symbols.get(instrument)
+        book = self.forex.md.get(instrument)
+        if symbol is None or book is None:
+            return None
+        # Replace every quote of the book: delete the old entries, insert levels keyed by side and price,
+        # a bid and an ask at the same price are different entries
+        entries = [(b'2', side, entry_id, symbol, None, None) for entry_id, (side, _, _) in book.entries.items()]
+        entries += [(b'0', b'0', b'0:%r' % price, symbol, price, volume) for price, volume in bids]
+        entries += [(b'0', b'1', b'1:%r' % price, symbol, price, volume) for price, volume in asks]
+        self.forex.update_md(entries)
+        return self.forex.books[instrument]
+
+    def stats(self) -> dict:
+        return {
+            'segments': len(self.paths),
+            'records': self.records,
+            'updates': self.updates,
+            'calculations': self.calculations,
+            'seconds': round(self.elapsed, 3),
+            'updates_per_second': round(self.updates / self.elapsed) if self.elapsed else 0,
+        }
+
+
+class RangeBacktest:
+    '''
+    Spread statistics of alor_stocks.json bundles over a replay.
+
+    The spread of a bundle is the VWAP of buying `lots` of the first leg minus the VWAP of selling
+    them on the second leg (direction 1), the opposite trade (direction 2) or both (direction 3).
+    A spread inside [from, to] counts as a signal; entries are transitions into the range.
+    '''
+
+    def __init__(self, bundles: list, clock: SimClock):
+        '''
+        :param bundles: "stocks" of alor_stocks.json
+        :param clock: SimClock of the replay
+        '''
+        self.clock = clock
+        self.books = {}     # instrument -> OrderBook
+        self.results = []
+        self.by_instrument = {}
+        for bundle in bundles:
+            first, second = bundle['bundle']
+            low, high = sorted((bundle['range']['from'], bundle['range']['to']))
+            directions = (1, 2) if bundle.get('direction', 3) == 3 else (bundle['direction'],)
+            for direction in directions:
+                result = {
+                    'bundle': f'{first}-{second}',
+                    'direction': direction,
+                    'lots': bundle.get('lots', 1),
+                    'range': (low, high),
+                    'samples': 0,
+                    'in_range': 0,
+                    'entries': 0,
+                    'seconds_in_range': 0.0,
+                    'min': None,
+                    'max': None,
+                    '_inside': False,
+                    '_since': 0,
+                }
+                self.results.append(result)
+                self.by_instrument.setdefault(first, []).append(result)
+                self.by_instrument.setdefault(second, []).append(result)
+
+    def __call__(self, feed: str, instrument: str, book: td.OrderBook) -> None:
+        '''Replay observer'''
+        if feed != 'alor':
+            return
+        self.books[instrument] = book
+        for result in self.by_instrument.get(instrument, ()):
+            self.update(result)
+
+    def update(self, result: dict) -> None:
+        first, second = result['bundle'].split('-')
+        book1 = self.books.get(first)
+        book2 = self.books.get(second)
+        if book1 is None or book2 is None:
+            return
+        if result['direction'] == 1:
+            price1 = book1.fill_price('asks', result['lots'])[1]
+            price2 = book2.fill_price('bids', result['lots'])[1]
+        else:
+            price1 = book1.fill_price('bids', result['lots'])[1]
+            price2 = book2.fill_price('asks', result['lots'])[1]
+        if price1 is None or price2 is None:
+            return
+        spread = round(price1 - price2, 2)
+        result['samples'] += 1
+        result['min'] = spread if result['min'] is None else min(result['min'], spread)
+        result['max'] = spread if result['max'] is None else max(result['max'], spread)
+        low, high = result['range']
+        inside = low <= spread <= high
+        now = self.clock.wall_ns
+        if inside:
+            result['in_range'] += 1
+            if not result['_inside']:
+                result['entries'] += 1
+                result['_since'] = now
+        elif result['_inside']:
+            result['seconds_in_range'] += (now - result['_since']) / 1e9
+        result['_inside'] = inside
+
+    def report(self) -> list[dict]:
+        '''Results without internal state, open ranges are closed at the current simulated time'''
+        report = []
+        for result in self.results:
+            seconds = result['seconds_in_range']
+            if result['_inside']:
+                seconds += (self.clock.wall_ns - result['_since']) / 1e9
+            item = {key: value for key, value in result.items() if not key.startswith('_')}
+            item['seconds_in_range'] = round(seconds, 3)
+            report.append(item)
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded ticks through the books and Calculate')
+    parser.add_argument('path', help='recording directory or segment file')
+    parser.add_argument('--speed', type=float, default=None, help='1 real time, N times faster, as fast as possible if omitted')
+    parser.add_argument('--orders', help='JSON file with Calculate.data: usdrub, payout, mc_stocks, mc_features, orders')
+    parser.add_argument('--calc-interval', type=float, default=0.0, help='simulated seconds between Calculate.start calls')
+    parser.add_argument('--ranges', help='alor_stocks.json to backtest bundle ranges')
+    parser.add_argument('--instruments', nargs='+', help='replay only these instruments')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='replay from, 2025-03-03T10:00')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='replay until, 2025-03-03T10:05')
+    parser.add_argument('--assets', default='assets.json')
+    args = parser.parse_args()
+
+    # Imported here so the module does not need config.json to be imported
+    from tasks.alor import Alor
+    from tasks.forex import AsyncFixClient
+    from tasks.roll_calendar import RollCalendar
+
+    with open(args.assets, 'r') as f:
+        assets = json.load(f)
+    clock = SimClock()
+    features_subst = {'SV': 'SILV', 'GD': 'GOLD', 'NA': 'NASD', 'SF': 'SPYF', 'PT': 'PLT', 'PD': 'PLD'}
+    alor = Alor([])
+    forex = AsyncFixClient()
+    calculate = None
+    if args.orders:
+        # Expiries follow the recording, not today
+        first = TickSegment(segment_paths(args.path)[0])
+        clock.set(first.wall_ns)
+        first.close()
+        calculate = Calculate(alor.alor_assets_data, forex.books, features_subst, assets['FEATURES_FOREX'],
+                              RollCalendar(features_subst, clock=clock.now))
+        with open(args.orders, 'r') as f:
+            calculate.data = json.load(f)
+    replay = Replay(args.path, alor, forex, calculate, assets['STOCKS'], args.speed, args.calc_interval, clock,
+                    args.instruments, args.start, args.end)
+    backtest = None
+    if args.ranges:
+        with open(args.ranges, 'r') as f:
+            backtest = RangeBacktest(json.load(f)['stocks'], clock)
+        replay.observe(backtest)
+
+    stats = asyncio.run(replay.run())
+    print(json.dumps(stats, indent=2))
+    if backtest is not None:
+        print(json.dumps(backtest.report(), indent=2))
+    if calculate is not None:
+        print(json.dumps(calculate.data, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    if not os.path.exists('config.json'):
+        logger.warning('config.json not found, Alor and AsyncFixClient need it even without connecting')
+    main()
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+
+logger = logging.getLogger('RollCalendar')
+
+
+class RollCalendar:
+    '''
+    Calendar of quarterly MOEX futures expiries with cached TradingView -> MOEX code mapping.
+
+    Expiry is the first Thursday after the first two weeks of March, June, September and December,
+    the front contract rolls to the next quarter at ROLL_HOUR of the expiry day. Converted codes
+    are cached until the next roll boundary, then listeners get {old code: new code} to resubscribe.
+    '''
+    QUARTER_MONTHS = (3, 6, 9, 12)
+    ROLL_HOUR = 19
+    WATCH_INTERVAL = 60 * 60     # longest sleep of watch, seconds
+
+    def __init__(self, features_subst: dict, clock=datetime.now):
+        '''
+        :param features_subst: dict of features to substitute {'SV': 'SILV', 'GD': 'GOLD'}
+        :param clock: returns current local datetime, replaced in replays
+        '''
+        self.features_subst = features_subst
+        self.clock = clock
+        self.codes = {}             # 'SV1!' -> 'SILV-3.25'
+        self.expiries = []          # upcoming expiry dates, front contract first
+        self.boundary = None        # clock() of the next roll
+        self.listeners = []
+        self.refresh()
+
+    @staticmethod
+    def expiry(year: int, month: int) -> datetime:
+        # Skip 2 first weeks and find the next Thursday (3 represents Thursday, 0 = Monday)
+        target_date = datetime(year, month, 1) + timedelta(weeks=2)
+        return target_date + timedelta(days=(3 - target_date.weekday()) % 7)
+
+    def refresh(self) -> dict:
+        '''
+        Rebuild expiries and converted codes for the current date
+        :return: {old MOEX code: new MOEX code} of codes changed by the roll
+        '''
+        now = self.clock()
+        self.expiries = [
+            expiry
+            for year in range(now.year, now.year + 3)
+            for expiry in (self.expiry(year, month) for month in self.QUARTER_MONTHS)
+            if expiry.replace(hour=self.ROLL_HOUR) > now
+        ]
+        self.boundary = self.expiries[0].replace(hour=self.ROLL_HOUR)
+
+        old_codes = self.codes
+        self.codes = {tradingview_code: self.moex_code(tradingview_code) for tradingview_code in old_codes}
+        return {old_codes[code]: new for code, new in self.codes.items() if old_codes[code] != new}
+
+    def moex_code(self, tradingview_code: str) -> str:
+        '''
+        Convert features names from TradingView format (SV1!, SV2! for the next contract) to Moex format (SILV-3.25)
+        :param tradingview_code:
+        :return:
+        '''
+        if not tradingview_code[-2:-1].isdigit() or not tradingview_code[-1:] == '!':
+            raise ValueError("Invalid TradingView code format")
+        base = tradingview_code[:-2]
+        new_code = self.features_subst.get(base, base)
+        offset = int(tradingview_code[-2:-1]) - 1    # Convert 1! -> 0, 2! -> 1
+        target_date = self.expiries[offset]
+        return f"{new_code}-{target_date.month}.{str(target_date.year)[2:]}"
+
+    def convert(self, tradingview_code: str) -> str:
+        '''
+        Cached TradingView -> MOEX conversion, a dict hit until the next roll boundary
+        :param tradingview_code: 'SV1!'
+        :return: 'SILV-3.25'
+        '''
+        if self.clock() >= self.boundary:
+            self.roll()
+        moex_code = self.codes.get(tradingview_code)
+        if moex_code is None:
+            moex_code = self.codes[tradingview_code] = self.moex_code(tradingview_code)
+        return moex_code
+
+    def subscribe(self, listener) -> None:
+        '''
+        :param listener: callable({old MOEX code: new MOEX code}) called after every roll
+        '''
+        self.listeners.append(listener)
+
+    def roll(self) -> dict:
+        changes = self.refresh()
+        if changes:
+            logger.info(f"Futures rolled: {changes}")
+            for listener in self.listeners:
+                try:
+                    listener(changes)
+                except Exception as e:
+                    logger.error(f"Error in roll listener {listener}: {e}")
+        return changes
+
+    async def watch(self) -> None:
+        '''Roll at every boundary even if nobody converts codes at that time'''
+        while True:
+            # The wait is only a hint, the boundary is checked against the clock, which may be simulated
+            await asyncio.sleep(min(max((self.boundary - self.clock()).total_seconds(), 1), self.WATCH_INTERVAL))
+            if self.clock() >= self.boundary:
+                self.roll()
@@ -1,20 +1,37 @@
 import asyncio
 import os
 import json
+import time
 
 from PySide6.QtCore import QObject, Signal
 
-from tasks.calculate import Calculate, convert_tv_to_moex_features, safe_float_convert
+from tasks.calculate import SOURCE_FEEDS, Calculate, safe_float_convert
+from tasks.roll_calendar import RollCalendar
 from tasks.investing import Investing
 from tasks.alor import Alor
 from tasks.forex import AsyncFixClient as ForexClient
+from tasks.multiprocess import FeedProcesses
+from utils import data as td
+from utils import latency
+from utils.bus import BOOK, USDRUB, bus
+from utils.recorder import TickRecorder
+from utils.snapshot import Snapshot, SnapshotPublisher
+from utils.table_diff import TableDiff
+from utils.web_requests import http_client
+
+
+# Calculate source of every feed
+FEED_SOURCES = {feed: source for source, feed in SOURCE_FEEDS.items()}
 
 
 class Worker(QObject):
     finished = Signal()
     data_received_USDRUB = Signal(str, bool)
-    data_received_market_fields = Signal(dict)
+    # {row: {field: value}} of the order table cells changed since the previous emission,
+    # every cell of every row for a new order table
+    market_fields_changed = Signal(dict)
     update_fields = Signal(dict)
+    TABLE_CHECK = 1             # seconds between checks of the whole order table for edits
 
     def __init__(self):
         super().__init__()
@@ -27,11 +44,33 @@ class Worker(QObject):
         self.stocks = self.assets[0]     # ['TATN-TATNP', 'MTLR-MTLRP', 'SBER-SBERP']
         self.features = self.assets[1]   # {'ED1!': 1000, 'EURUSD': 100000, 'SV1!': 10, 'XAGUSD': 5000 'GD1!': 1, 'XAUUSD': 100}
         self.features_subst = {'SV': 'SILV', 'GD': 'GOLD', 'NA': 'NASD', 'SF': 'SPYF', 'PT': 'PLT', 'PD': 'PLD'}
+        self.roll_calendar = RollCalendar(self.features_subst)
         self.assets_moex = self.parse_assets_by_one()   # ['TATN', 'TATNP', 'MTLR', 'MTLRP', 'SBER', 'SBERP', 'ED-3.25', 'SILV-3.25', 'GOLD-3.25']
         self.investing = Investing()
         self.forex = ForexClient()
         self.alor = Alor(self.assets_moex)
-        self.calculate = Calculate(self.alor.alor_assets_data, self.forex.md, self.features_subst, self.features)
+        self.calculate = Calculate(self.alor.alor_assets_data, self.forex.books, self.features_subst, self.features,
+                                   self.roll_calendar)
+        self.roll_calendar.subscribe(self.on_roll)
+        self.calculate.subscribe_legs(self.alor.on_leg_activity)
+        # Stage latencies are tracked and logged every "LatencyLog" seconds
+        self.latency_log = self.alor.config.get('LatencyLog')
+        latency.tracker.enabled = bool(self.latency_log)
+        # Screen updates per second at most, driven by book changes
+        self.screen_rate = self.alor.config.get('ScreenRate', 10)
+        # Consistent state for the Qt thread, see snapshot()
+        self.snapshots = SnapshotPublisher()
+        # With "MultiProcess" Alor and the FIX client run in child processes, Calculate and the GUI stay here
+        self.feeds = None
+        if self.alor.config.get('MultiProcess'):
+            self.feeds = FeedProcesses(self.alor.alor_assets_data, self.forex.books, self.assets_moex,
+                                       self.features_subst)
+        # Ticks of both feeds are recorded when config.json has "RecordDir", books of feed processes are not
+        record_dir = self.alor.config.get('RecordDir')
+        if record_dir and self.feeds is not None:
+            print('RecordDir is ignored with MultiProcess, ticks are recorded by in-process feeds only')
+        elif record_dir:
+            td.trading_data.recorder = TickRecorder(record_dir)
 
     def run(self):
         self.loop = asyncio.new_event_loop()
@@ -47,13 +86,24 @@ class Worker(QObject):
     async def task_manager(self):
         """Start async tasks and keep them running."""
         self.running = True
+        await self.load_securities()
         self.tasks = [
             asyncio.create_task(self.fetch_data_usdrub()),
             asyncio.create_task(self.fetch_data_market_fields()),
             asyncio.create_task(self.investing.wss_connect()),
-            asyncio.create_task(self.alor.connect(self.assets_moex)),
-            asyncio.create_task(self.forex.start())
+            asyncio.create_task(self.roll_calendar.watch()),
         ]
+        if self.feeds is not None:
+            # Feed handlers run in their own processes and write books into shared memory
+            self.feeds.start()
+            self.tasks.append(asyncio.create_task(self.feeds.pump()))
+        else:
+            self.tasks += [
+                asyncio.create_task(self.alor.connect(self.assets_moex)),
+                asyncio.create_task(self.forex.start()),
+            ]
+        if self.latency_log:
+            self.tasks.append(asyncio.create_task(latency.tracker.report(self.latency_log)))
         try:
             await asyncio.gather(*self.tasks)
         except asyncio.CancelledError:
@@ -62,26 +112,74 @@ class Worker(QObject):
             self.finished.emit()  # Signal that tasks are done
 
     async def fetch_data_usdrub(self) -> None:
-        """Simulated async task that runs continuously."""
+        """Emit the USDRUB rate and connection state when they change."""
+        subscription = bus.subscribe(USDRUB, max_rate=self.screen_rate)
+        last = None
         try:
             while self.running:
-                self.data_received_USDRUB.emit(f'{str(self.investing.USDRUB)}', self.investing.connected)
-                await asyncio.sleep(1)
+                # Investing publishes USDRUB, the timeout also catches rate and state changes it doesn't publish
+                await subscription.get(timeout=1)
+                state = (str(self.investing.USDRUB), self.investing.connected)
+                if state != last:
+                    last = state
+                    self.snapshots.publish(usdrub=state[0], connected=state[1])
+                    self.data_received_USDRUB.emit(*state)
         except asyncio.CancelledError:
             print("fetch_data_usdrub was cancelled.")
         finally:
+            subscription.close()
             print("fetch_data_usdrub exited.")
 
     async def fetch_data_market_fields(self) -> None:
-        """Simulated async task that runs continuously."""
+        """
+        Recalculate orders of changed books and emit the changed cells, at most screen_rate times a second.
+        A new order table is emitted once with every cell of every row. The whole table
+        is checked every TABLE_CHECK seconds, so edits of orders and settings get calculated without ticks.
+        """
+        subscription = bus.subscribe(BOOK, max_rate=self.screen_rate)
+        diff = TableDiff()
+        checked = time.monotonic()
         try:
             while self.running:
-                if self.alor.connected:
-                    self.data_received_market_fields.emit(f'{str(self.calculate.data)}')
-                await asyncio.sleep(1)
+                changed = await subscription.get(timeout=self.TABLE_CHECK)
+                books = {key: book for (_, key), book in changed.items()}
+                orders = self.calculate.data.get('orders')
+                if not orders:
+                    if books:
+                        self.snapshots.publish(books=books)
+                    continue
+                now = time.monotonic()
+                if orders is self.calculate.orders and (not changed or now - checked >= self.TABLE_CHECK):
+                    # start recalculates orders of changed books and fields, everything if the settings changed
+                    checked = now
+                    settings = self.calculate.settings
+                    self.calculate.start(self.stocks)
+                    connected = self.feeds_connected()
+                    cells = diff.diff(orders) if connected else {}
+                    if cells:
+                        self.market_fields_changed.emit(cells)
+                    if cells or books or settings != self.calculate.settings:
+                        self.snapshots.publish(self.calculate.data, list(cells) if connected else None, books)
+                    continue
+                if orders is not self.calculate.orders:
+                    # A new order table is calculated and sent in full, later only orders of the changed books
+                    self.calculate.start(self.stocks)
+                    self.snapshots.publish(self.calculate.data, books=books)
+                    self.market_fields_changed.emit(diff.diff(orders))
+                    continue
+                recalculated = set()
+                for feed, instrument in books:
+                    recalculated |= self.calculate.on_book_update(FEED_SOURCES[feed], instrument)
+                self.snapshots.publish(self.calculate.data if recalculated else None, recalculated, books)
+                if recalculated and self.feeds_connected():
+                    # Bursts of book updates are already coalesced into one batch per frame by the bus
+                    cells = diff.diff(orders, recalculated)
+                    if cells:
+                        self.market_fields_changed.emit(cells)
         except asyncio.CancelledError:
             print("fetch_data_market_fields was cancelled.")
         finally:
+            subscription.close()
             print("fetch_data_market_fields exited.")
 
     async def shutdown(self):
@@ -102,8 +200,26 @@ class Worker(QObject):
         except asyncio.CancelledError:
             print("Some tasks were forcefully cancelled.")
 
+        if self.feeds is not None:
+            self.feeds.stop()
+        if td.trading_data.recorder is not None:
+            td.trading_data.recorder.close()
+            td.trading_data.recorder = None
+        await http_client.close()
+
         print("CalculateWorker stopped.")
 
+    def feeds_connected(self) -> bool:
+        return self.feeds.connected if self.feeds is not None else self.alor.connected
+
+    def snapshot(self, seq: int = -1) -> Snapshot | None:
+        '''
+        Latest orders, books and USDRUB for the Qt thread, never blocks the asyncio thread
+        :param seq: seq of the snapshot the caller already shows
+        :return: a newer snapshot or None
+        '''
+        return self.snapshots.read(seq)
+
     def stop(self):
         """Triggers the shutdown process safely from the main thread."""
         if self.loop and self.loop.is_running():
@@ -129,6 +245,40 @@ class Worker(QObject):
             print("JSON file format error")
             return ()
 
+    async def load_securities(self) -> None:
+        '''
+        Load the securities cache, features with "null" lot size in assets.json get it from there
+        {'SV1!/XAGUSD': {'SV1!': null, 'XAGUSD': 5000}} -> {'SV1!/XAGUSD': {'SV1!': 10.0, 'XAGUSD': 5000}}
+        Raises ValueError if a "null" lot size can't be resolved, Calculate needs every lot size
+        '''
+        missing = [(lots, code) for lots in self.features.values() for code, lot in lots.items() if lot is None]
+        try:
+            await self.alor.get_securities()
+        except Exception as e:
+            print(f'Securities list is not available: {e}')
+            if missing:
+                raise ValueError(f'Lot sizes of {[code for _, code in missing]} are null in assets.json '
+                                 f'and the securities list is not available: {e}') from e
+            return
+        for lots, code in missing:
+            multiplier = None
+            if code[-2:-1].isdigit() and code[-1:] == '!':
+                multiplier = self.alor.securities.multiplier(self.roll_calendar.convert(code))
+            if multiplier is None:
+                raise ValueError(f'Lot size of {code} is null in assets.json and not in the securities list')
+            lots[code] = multiplier
+
+    def on_roll(self, changes: dict) -> None:
+        '''
+        Move expired futures to the new contracts
+        :param changes: {'SILV-3.25': 'SILV-6.25'}
+        '''
+        # SV2! of the old quarter is SV1! of the new one, it stays subscribed
+        expired = set(changes) - set(changes.values())
+        self.assets_moex = [asset for asset in self.assets_moex if asset not in expired] + \
+                           [new for new in changes.values() if new not in self.assets_moex]
+        self.alor.on_roll(changes)
+
     # Parse input dict and return list of stocks and features in MOEX format
     def parse_assets_by_one(self) -> list:
         assets = []
@@ -140,6 +290,5 @@ class Worker(QObject):
             fe = feature.split('/')
             for i in fe:
                 if i[-2:-1].isdigit() and i[-1:] == '!':
-                    assets.append(convert_tv_to_moex_features(self.features_subst, i))
-                    # assets.append(convert_tv_to_moex_features(self.features_subst, feature))
+                    assets.append(self.roll_calendar.convert(i))
         return assets                   # ['TATN', 'TATNP', 'MTLR', 'MTLRP', 'SBER', 'SBERP', 'ED-3.25', 'SILV-3.25', 'GOLD-3.25']
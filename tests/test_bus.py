@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from utils.bus import ALL, BOOK, USDRUB, Bus
+
+
+def test_latest_keeps_one_value_per_key():
+    async def main():
+        bus = Bus()
+        subscription = bus.subscribe(BOOK, USDRUB)
+        bus.publish(BOOK, ('alor', 'SBER'), 1)
+        bus.publish(BOOK, ('alor', 'SBER'), 2)
+        bus.publish(BOOK, ('ctrader', 'EURUSD'), 3)
+        bus.publish(USDRUB, 'USDRUB', 90.5)
+        bus.publish('other', 'key', 4)
+        return await subscription.get()
+    assert asyncio.run(main()) == {
+        (BOOK, ('alor', 'SBER')): 2,
+        (BOOK, ('ctrader', 'EURUSD')): 3,
+        (USDRUB, 'USDRUB'): 90.5,
+    }
+
+
+def test_all_keeps_order_and_drops_the_oldest():
+    async def main():
+        bus = Bus()
+        subscription = bus.subscribe(BOOK, policy=ALL, maxsize=3)
+        for i in range(5):
+            bus.publish(BOOK, 'SBER', i)
+        return list(await subscription.get()), subscription.dropped
+    batch, dropped = asyncio.run(main())
+    assert batch == [(BOOK, 'SBER', 2), (BOOK, 'SBER', 3), (BOOK, 'SBER', 4)]
+    assert dropped == 2
+
+
+def test_get_waits_for_a_publish():
+    async def main():
+        bus = Bus()
+        subscription = bus.subscribe(BOOK)
+        asyncio.get_running_loop().call_later(0.01, bus.publish, BOOK, 'SBER', 1)
+        first = await subscription.get(timeout=5)
+        second = await subscription.get(timeout=0.01)
+        return first, second
+    assert asyncio.run(main()) == ({(BOOK, 'SBER'): 1}, {})
+
+
+def test_max_rate_delays_and_conflates_the_next_batch():
+    async def main():
+        bus = Bus()
+        subscription = bus.subscribe(BOOK, max_rate=10)
+        bus.publish(BOOK, 'SBER', 1)
+        await subscription.get()
+        start = time.monotonic()
+        bus.publish(BOOK, 'SBER', 2)
+        asyncio.get_running_loop().call_later(0.02, bus.publish, BOOK, 'SBER', 3)
+        batch = await subscription.get()
+        return batch, time.monotonic() - start
+    batch, elapsed = asyncio.run(main())
+    assert batch == {(BOOK, 'SBER'): 3}
+    assert elapsed >= 0.08
+
+
+def test_closed_subscription_gets_nothing():
+    async def main():
+        bus = Bus()
+        subscription = bus.subscribe(BOOK, USDRUB)
+        subscription.close()
+        bus.publish(BOOK, 'SBER', 1)
+        return await subscription.get(timeout=0.01), bus.subscribers
+    assert asyncio.run(main()) == ({}, {BOOK: [], USDRUB: []})
@@ -0,0 +1,82 @@
+from utils.data import EntryBook, OrderBook
+
+
+def levels(book: OrderBook) -> tuple[list, list]:
+    bids, asks = book.bids(), book.asks()
+    return list(zip(*bids)), list(zip(*asks))
+
+
+def test_entry_book_keeps_both_sides_sorted():
+    book = EntryBook('EURUSD')
+    book.apply(b'0', b'0', b'1', 1.10, 5.0)
+    book.apply(b'0', b'0', b'2', 1.12, 6.0)
+    book.apply(b'0', b'1', b'3', 1.15, 7.0)
+    book.apply(b'0', b'1', b'4', 1.13, 8.0)
+    assert book.best_bid() == 1.12
+    assert book.best_ask() == 1.13
+    assert book.top(b'0', 5) == [(1.12, 6.0), (1.10, 5.0)]
+    assert book.top(b'1', 1) == [(1.13, 8.0)]
+
+
+def test_entry_book_changes_and_deletes_by_entry_id():
+    book = EntryBook('EURUSD')
+    book.apply(b'0', b'0', b'1', 1.10, 5.0)
+    book.apply(b'0', b'0', b'2', 1.12, 6.0)
+    book.apply(b'1', None, b'1', None, 9.0)         # new size, same price
+    book.apply(b'1', None, b'2', 1.09, None)        # new price, same size
+    assert book.top(b'0', 5) == [(1.10, 9.0), (1.09, 6.0)]
+    book.apply(b'2', None, b'1', None, None)
+    assert book.top(b'0', 5) == [(1.09, 6.0)]
+    book.apply(b'2', None, b'unknown', None, None)
+    assert book.top(b'0', 5) == [(1.09, 6.0)]
+
+
+def test_entry_book_drops_worst_entries_past_depth():
+    book = EntryBook('EURUSD', depth=2)
+    for i, price in enumerate((1.10, 1.12, 1.11)):
+        book.apply(b'0', b'1', str(i).encode(), price, 1.0)
+    assert book.top(b'1', 5) == [(1.10, 1.0), (1.11, 1.0)]
+    assert b'1' not in book.entries
+
+
+def test_entry_book_commits_changed_levels():
+    entries = EntryBook('EURUSD')
+    book = OrderBook('EURUSD', depth=2)
+    entries.apply(b'0', b'0', b'1', 1.10, 5.0)
+    entries.apply(b'0', b'0', b'2', 1.12, 6.0)
+    entries.apply(b'0', b'0', b'3', 1.08, 7.0)
+    entries.apply(b'0', b'1', b'4', 1.13, 8.0)
+    entries.commit(book)
+    assert levels(book) == ([(1.12, 6.0), (1.10, 5.0)], [(1.13, 8.0)])
+    entries.apply(b'2', None, b'2', None, None)
+    entries.apply(b'2', None, b'4', None, None)
+    entries.commit(book)
+    assert levels(book) == ([(1.10, 5.0), (1.08, 7.0)], [])
+    assert book.seq == 2
+    entries.clear()
+    entries.commit(book)
+    assert levels(book) == ([], [])
+
+
+def test_fill_price_walks_the_levels():
+    book = OrderBook('SBER', depth=3)
+    book.update_levels([(100.0, 10.0), (99.0, 20.0)], [(101.0, 5.0), (102.0, 5.0), (103.0, 5.0)], 0)
+    assert book.fill_price('bids', 10) == (100.0, 100.0)
+    assert book.fill_price('bids', 20) == (99.0, 99.5)
+    assert book.fill_price('asks', 7.5) == (102.0, (5 * 101.0 + 2.5 * 102.0) / 7.5)
+    assert book.fill_price('asks', 0) == (101.0, 101.0)
+
+
+def test_fill_price_takes_the_whole_side_of_a_thin_book():
+    book = OrderBook('SBER', depth=3)
+    book.update_levels([(100.0, 10.0), (99.0, 10.0)], [], 0)
+    assert book.fill_price('bids', 1000) == (99.0, 99.5)
+    assert book.fill_price('asks', 1) == (None, None)
+
+
+def test_fill_price_follows_book_updates():
+    book = OrderBook('SBER', depth=3)
+    book.update_levels([(100.0, 10.0)], [], 0)
+    assert book.fill_price('bids', 5) == (100.0, 100.0)
+    book.update_levels([(90.0, 1.0), (80.0, 1.0)], [], 0)
+    assert book.fill_price('bids', 2) == (80.0, 85.0)
@@ -0,0 +1,91 @@
+import simplefix
+
+from utils.fix import FixFramer, decode_frame, decode_md_entries, frame_msg_type
+
+
+def message(msg_type: str, *pairs) -> bytes:
+    msg = simplefix.FixMessage()
+    msg.append_pair(8, 'FIX.4.4')
+    msg.append_pair(35, msg_type)
+    for tag, value in pairs:
+        msg.append_pair(tag, value)
+    return msg.encode()
+
+
+def drain(framer: FixFramer) -> list[bytes]:
+    return [bytes(frame) for frame in framer.frames()]
+
+
+def test_framer_splits_messages_of_one_read():
+    messages = [message('0'), message('1', (112, 'TEST')), message('0', (49, 'cServer'))]
+    framer = FixFramer()
+    framer.feed(b''.join(messages))
+    assert drain(framer) == messages
+    assert not framer.buffer
+
+
+def test_framer_waits_for_partial_reads():
+    messages = [message('1', (112, 'A' * 50)), message('0')]
+    stream = b''.join(messages)
+    framer = FixFramer()
+    frames = []
+    for i in range(len(stream)):
+        framer.feed(stream[i:i + 1])
+        frames += drain(framer)
+    assert frames == messages
+
+
+def test_framer_skips_garbage_before_begin_string():
+    framer = FixFramer()
+    framer.feed(b'garbage' + message('0'))
+    assert drain(framer) == [message('0')]
+
+
+def test_framer_resyncs_after_wrong_body_length():
+    # BodyLength ends the message inside its fields, no CheckSum there
+    good = message('1', (112, 'TEST'))
+    length = good.split(b'\x01')[1]
+    broken = good.replace(length, b'9=3', 1)
+    framer = FixFramer()
+    framer.feed(broken + message('0'))
+    assert drain(framer) == [message('0')]
+
+
+def test_frame_views_are_decoded_without_copies():
+    framer = FixFramer()
+    framer.feed(message('1', (112, 'TEST')))
+    for frame in framer.frames():
+        assert isinstance(frame, memoryview)
+        assert frame_msg_type(frame) == b'1'
+        assert decode_frame(frame).get(112) == b'TEST'
+
+
+def test_decode_snapshot_entries():
+    frame = message('W', (55, '1678'), (268, 2),
+                    (269, 0), (270, '1.1'), (271, '500'),
+                    (269, 1), (270, '1.2'), (271, '600'))
+    symbol, entries = decode_md_entries(memoryview(frame))
+    assert symbol == '1678'
+    assert entries == [
+        (b'0', b'0', None, '1678', 1.1, 500.0),
+        (b'0', b'1', None, '1678', 1.2, 600.0),
+    ]
+
+
+def test_decode_incremental_entries():
+    frame = message('X', (268, 3),
+                    (279, 0), (269, 0), (278, '11'), (55, '1678'), (270, '1.1'), (271, '500'),
+                    (279, 1), (269, 1), (278, '12'), (55, '1719'), (270, '31.5'),
+                    (279, 2), (278, '11'), (55, '1678'))
+    symbol, entries = decode_md_entries(frame)
+    assert symbol is None
+    assert entries == [
+        (b'0', b'0', b'11', '1678', 1.1, 500.0),
+        (b'1', b'1', b'12', '1719', 31.5, None),
+        (b'2', None, b'11', '1678', None, None),
+    ]
+
+
+def test_decode_message_without_entries():
+    assert decode_md_entries(message('W', (55, '1678'), (268, 0))) == ('1678', [])
+    assert decode_md_entries(message('0')) == (None, [])
@@ -0,0 +1,58 @@
+import random
+
+from utils.data import OrderBook
+from utils.latency import CALCULATE, COMMIT, DECODE, TOTAL, LatencyHistogram, LatencyTracker
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram()
+    for value in (5, 1, 3, 100, 127):
+        histogram.record(value)
+    assert histogram.percentile(0) == 1
+    assert histogram.percentile(50) == 5
+    assert histogram.percentile(100) == 127
+    assert (histogram.count, histogram.min, histogram.max, histogram.total) == (5, 1, 127, 236)
+
+
+def test_large_values_are_within_bucket_precision():
+    rng = random.Random(1)
+    values = sorted(rng.randrange(1_000, 50_000_000) for _ in range(10_000))
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    for q in (1, 50, 90, 99, 99.9):
+        exact = values[max(1, int(q / 100 * len(values) + 0.5)) - 1]
+        assert exact <= histogram.percentile(q) <= exact * 1.016
+    assert histogram.percentile(100) == values[-1]
+
+
+def test_negative_values_count_as_zero():
+    histogram = LatencyHistogram()
+    histogram.record(-10)
+    assert (histogram.min, histogram.max, histogram.percentile(50)) == (0, 0, 0)
+
+
+def test_merge_adds_counts_and_extremes():
+    first, second = LatencyHistogram(), LatencyHistogram()
+    for value in (10, 20_000):
+        first.record(value)
+    for value in (5, 3_000_000):
+        second.record(value)
+    first.merge(second)
+    first.merge(LatencyHistogram())
+    assert (first.count, first.min, first.max) == (4, 5, 3_000_000)
+    assert first.total == 10 + 20_000 + 5 + 3_000_000
+    assert first.percentile(50) == 10
+    assert first.snapshot()['max_us'] == 3000.0
+
+
+def test_tracker_records_stages_of_a_book():
+    tracker = LatencyTracker(enabled=True)
+    book = OrderBook('SBER')
+    tracker.record_commit('alor', 'SBER', book, 1_000, 3_000, 4_000)
+    tracker.record_calculated('alor', 'SBER', book, 10_000)
+    tracker.record_calculated('alor', 'SBER', book, 20_000)
+    histograms = tracker.histograms
+    assert [histograms['alor', 'SBER', stage].max for stage in (DECODE, COMMIT, CALCULATE, TOTAL)] == \
+        [2_000, 1_000, 6_000, 9_000]
+    assert histograms['alor', 'SBER', TOTAL].count == 1
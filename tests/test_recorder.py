@@ -0,0 +1,56 @@
+from array import array
+
+from utils.data import OrderBook
+from utils.recorder import ASK, BID, TickRecorder, TickSegment, segment_paths
+
+
+def book(name: str, bids: list, asks: list) -> OrderBook:
+    result = OrderBook(name, depth=3)
+    result.update_levels(bids, asks, 0)
+    return result
+
+
+def read(path: str) -> list[tuple]:
+    segment = TickSegment(path)
+    records = [(feed, instrument, side, prices.tolist(), volumes.tolist())
+               for _, feed, instrument, side, prices, volumes in segment.records()]
+    segment.close()
+    return records
+
+
+def test_recorded_books_are_read_back(tmp_path):
+    recorder = TickRecorder(str(tmp_path), depth=2, segment_records=16)
+    recorder.record_book('alor', 'SBER', book('SBER', [(300.0, 10.0), (299.9, 5.0), (299.8, 1.0)], [(300.1, 7.0)]))
+    recorder.record_book('ctrader', 'EURUSD', book('EURUSD', [(1.1, 100.0)], []))
+    recorder.close()
+    paths = segment_paths(str(tmp_path))
+    assert len(paths) == 1
+    assert read(paths[0]) == [
+        ('alor', 'SBER', BID, [300.0, 299.9], [10.0, 5.0]),
+        ('alor', 'SBER', ASK, [300.1], [7.0]),
+        ('ctrader', 'EURUSD', BID, [1.1], [100.0]),
+        ('ctrader', 'EURUSD', ASK, [], []),
+    ]
+
+
+def test_recorder_rotates_full_segments(tmp_path):
+    recorder = TickRecorder(str(tmp_path), depth=1, segment_records=2)
+    for i in range(5):
+        recorder.next_segment.result()
+        recorder.record('alor', 'SBER', BID, array('d', [float(i)]), array('d', [1.0]), 1)
+    recorder.close()
+    assert recorder.dropped == 0
+    segments = [read(path) for path in segment_paths(str(tmp_path))]
+    assert [[record[3] for record in records] for records in segments] == [[[0.0], [1.0]], [[2.0], [3.0]], [[4.0]]]
+    assert all(records[0][:2] == ('alor', 'SBER') for records in segments)
+
+
+def test_segment_of_a_crashed_recorder_is_counted_by_timestamps(tmp_path):
+    recorder = TickRecorder(str(tmp_path), depth=1, segment_records=8)
+    for i in range(3):
+        recorder.record('alor', 'SBER', ASK, array('d', [float(i)]), array('d', [1.0]), 1)
+    recorder.mm.flush()
+    segment = TickSegment(recorder.path)
+    assert segment.count == 3
+    segment.close()
+    recorder.close()
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import pytest
+
+from tasks.roll_calendar import RollCalendar
+
+
+class Clock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+def test_expiry_is_the_thursday_after_two_weeks():
+    assert RollCalendar.expiry(2025, 3) == datetime(2025, 3, 20)
+    assert RollCalendar.expiry(2025, 6) == datetime(2025, 6, 19)
+
+
+def test_convert_front_and_next_contracts():
+    calendar = RollCalendar({'SV': 'SILV'}, clock=Clock(datetime(2025, 3, 1)))
+    assert calendar.convert('SV1!') == 'SILV-3.25'
+    assert calendar.convert('SV2!') == 'SILV-6.25'
+    assert calendar.convert('GD1!') == 'GD-3.25'
+    with pytest.raises(ValueError):
+        calendar.convert('SILV')
+
+
+def test_roll_at_the_boundary_notifies_listeners():
+    clock = Clock(datetime(2025, 3, 20, 18, 59))
+    calendar = RollCalendar({'SV': 'SILV'}, clock=clock)
+    changes = []
+    calendar.subscribe(changes.append)
+    assert calendar.convert('SV1!') == 'SILV-3.25'
+    assert calendar.convert('SV2!') == 'SILV-6.25'
+    assert not changes
+    clock.now = datetime(2025, 3, 20, 19, 0)
+    assert calendar.convert('SV1!') == 'SILV-6.25'
+    assert changes == [{'SILV-3.25': 'SILV-6.25', 'SILV-6.25': 'SILV-9.25'}]
+    assert calendar.roll() == {}
@@ -0,0 +1,73 @@
+import pytest
+
+from utils.data import OrderBook
+from utils.shared_books import SharedBooks
+
+
+def book(bids: list, asks: list, timestamp: int) -> OrderBook:
+    result = OrderBook('', depth=3)
+    result.update_levels(bids, asks, timestamp)
+    result.received_ns = 10
+    result.committed_ns = 20
+    return result
+
+
+def levels(book: OrderBook) -> tuple[list, list]:
+    return list(zip(*book.bids())), list(zip(*book.asks()))
+
+
+def test_written_books_are_read_back():
+    writer = SharedBooks.create(depth=2, slots=4)
+    reader = SharedBooks.attach(writer.name)
+    try:
+        assert reader.changed().tolist() == []
+        writer.write('SBER', book([(300.0, 1.0), (299.0, 2.0), (298.0, 3.0)], [(301.0, 4.0)], 1000))
+        writer.write('GAZP', book([], [(150.0, 5.0)], 2000))
+        assert reader.changed().tolist() == [0, 1]
+        assert reader.names == ['SBER', 'GAZP']
+        local = OrderBook('SBER', depth=2)
+        reader.read(reader.index['SBER'], local)
+        assert levels(local) == ([(300.0, 1.0), (299.0, 2.0)], [(301.0, 4.0)])
+        assert (local.timestamp, local.received_ns, local.committed_ns, local.seq) == (1000, 10, 20, 1)
+        assert reader.changed().tolist() == [1]
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_reader_sees_the_next_write():
+    writer = SharedBooks.create(depth=2, slots=4)
+    reader = SharedBooks.attach(writer.name, track=True)
+    try:
+        writer.write('SBER', book([(300.0, 1.0)], [], 1000))
+        local = OrderBook('SBER', depth=2)
+        reader.read(reader.changed()[0], local)
+        assert reader.changed().tolist() == []
+        assert local.fill_price('bids', 1) == (300.0, 300.0)
+        writer.write('SBER', book([(305.0, 7.0)], [(306.0, 8.0)], 3000))
+        assert reader.changed().tolist() == [0]
+        reader.read(0, local)
+        assert levels(local) == ([(305.0, 7.0)], [(306.0, 8.0)])
+        assert local.timestamp == 3000
+        assert local.fill_price('bids', 1) == (305.0, 305.0)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_slots_run_out():
+    writer = SharedBooks.create(depth=1, slots=1)
+    try:
+        writer.write('SBER', book([], [], 0))
+        with pytest.raises(OverflowError):
+            writer.write('GAZP', book([], [], 0))
+    finally:
+        writer.close()
+
+
+def test_owner_close_removes_the_segment():
+    writer = SharedBooks.create(depth=1, slots=1)
+    name = writer.name
+    writer.close()
+    with pytest.raises(FileNotFoundError):
+        SharedBooks.attach(name)
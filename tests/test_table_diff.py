@@ -0,0 +1,49 @@
+import numpy as np
+
+from utils.table_diff import TableDiff
+
+
+def test_first_diff_gives_all_cells_then_only_changes():
+    orders = [{'name': 'SBER', 'price': 300.0}, {'name': 'GAZP', 'price': 150.0}]
+    diff = TableDiff()
+    assert diff.diff(orders) == {0: {'name': 'SBER', 'price': 300.0}, 1: {'name': 'GAZP', 'price': 150.0}}
+    assert diff.diff(orders) == {}
+    orders[1]['price'] = 151.0
+    orders[0]['volume'] = 10
+    assert diff.diff(orders) == {0: {'volume': 10}, 1: {'price': 151.0}}
+
+
+def test_rows_restrict_the_compared_rows():
+    orders = [{'price': 1.0}, {'price': 2.0}]
+    diff = TableDiff()
+    diff.diff(orders)
+    orders[0]['price'] = orders[1]['price'] = 3.0
+    assert diff.diff(orders, rows=[1, 5]) == {1: {'price': 3.0}}
+    assert diff.diff(orders) == {0: {'price': 3.0}}
+
+
+def test_new_table_gives_all_cells_again():
+    diff = TableDiff()
+    diff.diff([{'price': 1.0}])
+    assert diff.diff([{'price': 1.0}], rows=[]) == {0: {'price': 1.0}}
+    orders = [{'price': 1.0}]
+    diff.diff(orders)
+    orders.append({'price': 2.0})
+    assert diff.diff(orders) == {0: {'price': 1.0}, 1: {'price': 2.0}}
+    diff.reset()
+    assert diff.diff(orders) == {0: {'price': 1.0}, 1: {'price': 2.0}}
+
+
+def test_cells_are_plain_values():
+    orders = [{'price': np.float64(1.5), 'volume': np.int64(3), 'spread': float('nan')}]
+    changes = TableDiff().diff(orders)
+    assert changes == {0: {'price': 1.5, 'volume': 3, 'spread': None}}
+    assert type(changes[0]['price']) is float and type(changes[0]['volume']) is int
+
+
+def test_nan_is_not_reported_twice():
+    orders = [{'spread': np.nan}]
+    diff = TableDiff()
+    diff.diff(orders)
+    orders[0]['spread'] = float('nan')
+    assert diff.diff(orders) == {}
@@ -0,0 +1,51 @@
+import os
+from array import array
+
+import numpy as np
+
+from utils.recorder import ASK, BID, TickRecorder, segment_paths
+from utils.tick_index import INDEX_SUFFIX, TickStore
+
+
+def record(tmp_path) -> None:
+    recorder = TickRecorder(str(tmp_path), depth=2, segment_records=4)
+    for i in range(10):
+        recorder.next_segment.result()
+        feed, instrument = [('alor', 'SBER'), ('alor', 'GAZP'), ('ctrader', 'SBER')][i % 3]
+        recorder.record(feed, instrument, i % 2, array('d', [float(i), i - 0.5]), array('d', [1.0, 2.0]), 2)
+    recorder.close()
+
+
+def test_segments_are_indexed_on_close(tmp_path):
+    record(tmp_path)
+    paths = segment_paths(str(tmp_path))
+    assert len(paths) == 3
+    assert all(os.path.exists(path + INDEX_SUFFIX) for path in paths)
+
+
+def test_query_by_instrument_and_feed(tmp_path):
+    record(tmp_path)
+    store = TickStore(str(tmp_path))
+    parts = store.query('SBER', feed='alor')
+    assert [part.prices[:, 0].tolist() for part in parts] == [[0.0, 3.0], [6.0], [9.0]]
+    assert sum(len(part) for part in store.query(['SBER', 'GAZP'])) == 10
+    assert store.query('LKOH') == []
+    part = store.query('GAZP')[0]
+    assert part.instruments == [('alor', 'GAZP')]
+    assert part.sides.tolist() == [ASK]
+    assert part.volumes.tolist() == [[1.0, 2.0]]
+    del parts, part
+    store.close()
+
+
+def test_query_by_time_range(tmp_path):
+    record(tmp_path)
+    store = TickStore(str(tmp_path))
+    timestamps = np.concatenate([part.timestamps for part in store.query('SBER')])
+    assert (np.diff(timestamps) >= 0).all()
+    start, end = int(timestamps[1]), int(timestamps[4])
+    parts = store.query('SBER', start, end)
+    assert np.concatenate([part.timestamps for part in parts]).tolist() == timestamps[1:4].tolist()
+    assert [side for part in parts for side in part.sides.tolist()] == [BID, ASK, ASK]
+    del parts
+    store.close()
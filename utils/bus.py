@@ -0,0 +1,114 @@
+import asyncio
+import time
+from collections import deque
+
+
+# Topics
+BOOK = 'book'               # key (feed, instrument), value the committed td.OrderBook
+USDRUB = 'usdrub'           # key 'USDRUB', value the rate
+
+# Conflation policies
+LATEST = 'latest'           # one pending value per key, the latest wins
+ALL = 'all'                 # every event in order, the oldest are dropped past maxsize
+
+
+class Subscription:
+    '''
+    Events of some topics waiting for one consumer.
+
+    `get` returns everything published since the previous call as one batch, at most
+    `max_rate` batches per second. With LATEST a burst of updates of one book is one entry.
+    '''
+
+    def __init__(self, bus: 'Bus', topics: tuple, policy: str = LATEST, max_rate: float | None = None,
+                 maxsize: int = 10000):
+        '''
+        :param bus: Bus
+        :param topics: (BOOK, USDRUB)
+        :param policy: LATEST or ALL
+        :param max_rate: batches per second, unlimited by default
+        :param maxsize: events kept with ALL
+        '''
+        self.bus = bus
+        self.topics = topics
+        self.policy = policy
+        self.interval = 1 / max_rate if max_rate else 0.0
+        self.pending = {} if policy == LATEST else deque(maxlen=maxsize)
+        self.event = asyncio.Event()
+        self.delivered = 0.0    # time.monotonic() of the last batch
+        self.dropped = 0
+
+    def push(self, topic: str, key, value) -> None:
+        if self.policy == LATEST:
+            self.pending[topic, key] = value
+        else:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append((topic, key, value))
+        if not self.event.is_set():
+            self.event.set()
+
+    async def get(self, timeout: float | None = None) -> dict | list:
+        '''
+        Wait for events and take them
+        :param timeout: seconds, an empty batch is returned when nothing came
+        :return: {(topic, key): value} with LATEST, [(topic, key, value), ...] with ALL
+        '''
+        if not self.pending:
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        # Events of the rest of the interval are conflated into this batch
+        wait = self.delivered + self.interval - time.monotonic()
+        if wait > 0 and self.pending:
+            await asyncio.sleep(wait)
+        batch = self.pending
+        self.pending = {} if self.policy == LATEST else deque(maxlen=batch.maxlen)
+        self.event.clear()
+        if batch:
+            self.delivered = time.monotonic()
+        return batch
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict | list:
+        return await self.get()
+
+    def close(self) -> None:
+        self.bus.unsubscribe(self)
+
+
+class Bus:
+    '''
+    In-process publish/subscribe on the asyncio loop.
+
+    Feed handlers publish a change per instrument, consumers wake up on data instead of timers.
+    Publishing to a topic without subscribers is a dict lookup. Publish from the loop thread.
+    '''
+
+    def __init__(self):
+        self.subscribers = {}       # topic -> [Subscription, ...]
+
+    def subscribe(self, *topics: str, policy: str = LATEST, max_rate: float | None = None,
+                  maxsize: int = 10000) -> Subscription:
+        subscription = Subscription(self, topics, policy, max_rate, maxsize)
+        for topic in topics:
+            self.subscribers.setdefault(topic, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        for topic in subscription.topics:
+            subscribers = self.subscribers.get(topic, [])
+            if subscription in subscribers:
+                subscribers.remove(subscription)
+
+    def publish(self, topic: str, key, value=None) -> None:
+        subscribers = self.subscribers.get(topic)
+        if subscribers:
+            for subscription in subscribers:
+                subscription.push(topic, key, value)
+
+
+bus = Bus()
@@ -0,0 +1,118 @@
+import json
+import re
+from array import array
+
+# Pick the fastest JSON backend installed, the standard library is the fallback
+try:
+    import orjson
+
+    JSON_BACKEND = 'orjson'
+    loads = orjson.loads
+
+    def dumps(data) -> str:
+        return orjson.dumps(data).decode('utf-8')
+except ImportError:
+    try:
+        import ujson
+
+        JSON_BACKEND = 'ujson'
+        loads = ujson.loads
+        dumps = ujson.dumps
+    except ImportError:
+        JSON_BACKEND = 'json'
+        loads = json.loads
+        dumps = json.dumps
+
+
+def frame_guid(frame: str) -> str | None:
+    """Return guid of an Alor websocket frame without parsing it."""
+    # guid is the last key of order book frames, search from the end
+    key = frame.rfind('"guid"')
+    if key < 0:
+        return None
+    start = frame.find('"', frame.find(':', key + 6)) + 1
+    end = frame.find('"', start)
+    if start <= 0 or end < 0:
+        return None
+    return frame[start:end]
+
+
+def levels_to_array(levels: list[dict]) -> array:
+    """Convert Alor levels [{'price': p, 'volume': v}, ...] to array('d', [p, v, ...])."""
+    result = array('d')
+    for level in levels:
+        result.append(level['price'])
+        result.append(level['volume'])
+    return result
+
+
+# Level lists rewritten to numbers, anything else means an unexpected layout
+REWRITTEN_LEVELS = re.compile(r'[0-9eE.+\-,\[\]]*')
+
+
+def decode_order_book(frame: str, known_guids) -> tuple | None:
+    """
+    Decode an Alor order book frame in "Simple" format straight into level arrays.
+
+    Frames are matched by guid first, so frames of unknown subscriptions are dropped
+    without being parsed. With orjson or ujson the frame is loaded and the levels are
+    converted, the C parsers are faster than any rewrite of the text. With the standard
+    json module both level lists are rewritten to flat JSON arrays of numbers and loaded at
+    once into array('d') of interleaved prices and volumes, no dict is built for the levels.
+    :param frame: websocket text frame
+    :param known_guids: container of guids to decode
+    :return: (guid, bids, asks, timestamp) or None if the frame is not an order book
+        of a known guid or does not have the expected layout (use loads() then)
+    """
+    guid = frame_guid(frame)
+    if guid is None or guid not in known_guids:
+        return None
+    if JSON_BACKEND == 'json':
+        return rewrite_order_book(frame, guid)
+    try:
+        data = loads(frame)['data']
+        return guid, levels_to_array(data['bids']), levels_to_array(data['asks']), data.get('timestamp', 0)
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def rewrite_order_book(frame: str, guid: str) -> tuple | None:
+    """Level lists of an order book frame rewritten to numbers and loaded by json.loads"""
+    bids = frame.find('"bids":[')
+    asks = frame.find('"asks":[')
+    if bids < 0 or asks < 0:
+        return None
+    first, second = (bids, asks) if bids < asks else (asks, bids)
+    first_end = frame.find(']', first)
+    second_end = frame.find(']', second)
+    if first_end < 0 or second_end < 0 or frame[first_end + 1:second] != ',':
+        return None
+    # {"price":p,"volume":v},... -> p,v,... any other layout leaves text behind and is rejected
+    numbers = frame[first + 7:second_end + 1]
+    numbers = numbers.replace('{"price":', '').replace(',"volume":', ',').replace('}', '')
+    numbers = numbers.replace('],"asks":[', '],[').replace('],"bids":[', '],[')
+    if not REWRITTEN_LEVELS.fullmatch(numbers):
+        return None
+    try:
+        first_levels, second_levels = loads(f'[{numbers}]')
+        first_levels = array('d', first_levels)
+        second_levels = array('d', second_levels)
+    except (ValueError, TypeError):
+        return None
+    if len(first_levels) % 2 or len(second_levels) % 2:
+        return None
+    if bids > asks:
+        first_levels, second_levels = second_levels, first_levels
+
+    timestamp = frame.find('"timestamp":', second_end)
+    if timestamp < 0:
+        timestamp = 0
+    else:
+        comma = frame.find(',', timestamp)
+        brace = frame.find('}', timestamp)
+        end = brace if comma < 0 or 0 <= brace < comma else comma
+        try:
+            timestamp = int(frame[timestamp + 12:end])
+        except ValueError:
+            return None
+    return guid, first_levels, second_levels, timestamp
@@ -1,27 +1,358 @@
 import random, string
-from dataclasses import dataclass
-from typing import List
+import time
+from array import array
+from bisect import bisect_left, insort
+from itertools import accumulate, chain, islice
+from operator import mul
 
 
-@dataclass
-class Order:
-    price: float
-    volume: float
+class OrderBook:
+    """
+    Fixed depth order book with preallocated float64 price and volume arrays per side.
 
+    Updates overwrite the arrays in place, so a book is allocated once per instrument and
+    readers get memoryviews of the filled levels, best level first. Cumulative volume and
+    notional arrays price a given size in O(log depth), they are brought up to date by
+    `cumulate` on the first pricing after an update, so books nobody prices never pay for them.
+    """
+    __slots__ = ('instrument_uid', 'depth', 'bid_prices', 'bid_volumes', 'ask_prices', 'ask_volumes',
+                 'bid_cum_volumes', 'bid_cum_notional', 'ask_cum_volumes', 'ask_cum_notional',
+                 'bid_count', 'ask_count', 'timestamp', 'seq', 'cumulated_seq', 'received_ns', 'committed_ns')
 
-@dataclass
-class OrderBook:
-    instrument_uid: str
-    bids: List[Order]
-    asks: List[Order]
-    timestamp: int
+    def __init__(self, instrument_uid: str, depth: int = 20):
+        self.instrument_uid = instrument_uid
+        self.depth = depth
+        zeros = bytes(8 * depth)
+        self.bid_prices = array('d', zeros)
+        self.bid_volumes = array('d', zeros)
+        self.ask_prices = array('d', zeros)
+        self.ask_volumes = array('d', zeros)
+        self.bid_cum_volumes = array('d', zeros)
+        self.bid_cum_notional = array('d', zeros)
+        self.ask_cum_volumes = array('d', zeros)
+        self.ask_cum_notional = array('d', zeros)
+        self.bid_count = 0
+        self.ask_count = 0
+        self.timestamp = 0
+        self.seq = 0                # incremented on every update
+        self.cumulated_seq = 0      # seq the cumulative arrays were computed for
+        self.received_ns = 0        # monotonic ns of the socket read of the last update, with latency tracking on
+        self.committed_ns = 0       # monotonic ns of the last update not consumed by Calculate yet
+
+    def update(self, bids: array, asks: array, timestamp: int) -> None:
+        """
+        Overwrite both sides from interleaved level arrays
+        :param bids: array('d', [price, volume, ...]) best level first
+        :param asks: array('d', [price, volume, ...]) best level first
+        :param timestamp:
+        """
+        self.bid_count = self._fill(self.bid_prices, self.bid_volumes, bids)
+        self.ask_count = self._fill(self.ask_prices, self.ask_volumes, asks)
+        self.timestamp = timestamp
+        self.seq += 1
+
+    def update_levels(self, bids, asks, timestamp: int) -> None:
+        """
+        Overwrite both sides from iterables of (price, volume) pairs, feeds with flat level
+        arrays use update
+        :param bids: [(price, volume), ...] best level first
+        :param asks: [(price, volume), ...] best level first
+        :param timestamp:
+        """
+        depth = self.depth
+        self.bid_count = self._fill(self.bid_prices, self.bid_volumes,
+                                    array('d', chain.from_iterable(islice(bids, depth))))
+        self.ask_count = self._fill(self.ask_prices, self.ask_volumes,
+                                    array('d', chain.from_iterable(islice(asks, depth))))
+        self.timestamp = timestamp
+        self.seq += 1
+
+    def update_sides(self, bid_prices: array, bid_volumes: array, ask_prices: array, ask_volumes: array,
+                     timestamp: int, bid_from: int = 0, ask_from: int = 0) -> None:
+        """
+        Overwrite both sides from price and volume arrays, levels before *_from are already equal
+        :param bid_prices: array('d', [price, ...]) best level first
+        :param bid_volumes: array('d', [volume, ...])
+        :param ask_prices: array('d', [price, ...]) best level first
+        :param ask_volumes: array('d', [volume, ...])
+        :param timestamp:
+        :param bid_from: first bid level to copy
+        :param ask_from: first ask level to copy
+        """
+        self.bid_count = self._copy(self.bid_prices, self.bid_volumes, bid_prices, bid_volumes, bid_from)
+        self.ask_count = self._copy(self.ask_prices, self.ask_volumes, ask_prices, ask_volumes, ask_from)
+        self.timestamp = timestamp
+        self.seq += 1
+
+    def cumulate(self) -> None:
+        """Bring the cumulative volume and notional arrays up to date with the levels"""
+        if self.cumulated_seq == self.seq:
+            return
+        self.cumulated_seq = self.seq
+        for prices, volumes, cum_volumes, cum_notional, count in (
+                (self.bid_prices, self.bid_volumes, self.bid_cum_volumes, self.bid_cum_notional, self.bid_count),
+                (self.ask_prices, self.ask_volumes, self.ask_cum_volumes, self.ask_cum_notional, self.ask_count)):
+            if count:
+                cum_volumes[:count] = array('d', accumulate(volumes[:count]))
+                cum_notional[:count] = array('d', accumulate(map(mul, prices[:count], volumes[:count])))
+
+    @staticmethod
+    def _fill(prices: array, volumes: array, levels: array) -> int:
+        count = min(len(levels) // 2, len(prices))
+        prices[:count] = levels[0:2 * count:2]
+        volumes[:count] = levels[1:2 * count:2]
+        return count
+
+    @staticmethod
+    def _copy(prices: array, volumes: array, source_prices: array, source_volumes: array, start: int) -> int:
+        count = min(len(source_prices), len(prices))
+        if start < count:
+            prices[start:count] = source_prices[start:count]
+            volumes[start:count] = source_volumes[start:count]
+        return count
+
+    def bids(self) -> tuple[memoryview, memoryview]:
+        """Read-only (prices, volumes) views of the bid levels"""
+        return (memoryview(self.bid_prices).toreadonly()[:self.bid_count],
+                memoryview(self.bid_volumes).toreadonly()[:self.bid_count])
+
+    def asks(self) -> tuple[memoryview, memoryview]:
+        """Read-only (prices, volumes) views of the ask levels"""
+        return (memoryview(self.ask_prices).toreadonly()[:self.ask_count],
+                memoryview(self.ask_volumes).toreadonly()[:self.ask_count])
+
+    def fill_price(self, side: str, size: float) -> tuple[float | None, float | None]:
+        """
+        Marginal price and VWAP of taking `size` from one side of the book.
+        If the book is not deep enough the whole side is taken.
+        :param side: 'bids' to sell into bids or 'asks' to buy from asks
+        :param size: volume in book units
+        :return: (price of the last level touched, volume weighted average price) or (None, None)
+        """
+        if side == 'bids':
+            prices, cum_volumes, cum_notional, count = \
+                self.bid_prices, self.bid_cum_volumes, self.bid_cum_notional, self.bid_count
+        else:
+            prices, cum_volumes, cum_notional, count = \
+                self.ask_prices, self.ask_cum_volumes, self.ask_cum_notional, self.ask_count
+        if not count:
+            return None, None
+        self.cumulate()
+        if size <= 0:
+            return prices[0], prices[0]
+        i = bisect_left(cum_volumes, size, 0, count)
+        if i == count:
+            i -= 1
+            size = cum_volumes[i]
+        volume_before = cum_volumes[i - 1] if i else 0.0
+        notional_before = cum_notional[i - 1] if i else 0.0
+        return prices[i], (notional_before + (size - volume_before) * prices[i]) / size
+
+    def best_bid(self) -> float | None:
+        return self.bid_prices[0] if self.bid_count else None
+
+    def best_ask(self) -> float | None:
+        return self.ask_prices[0] if self.ask_count else None
+
+    def __repr__(self):
+        return (f"OrderBook({self.instrument_uid} bid={self.best_bid()} ask={self.best_ask()} "
+                f"levels={self.bid_count}/{self.ask_count} timestamp={self.timestamp})")
+
+
+class EntryBook:
+    """
+    Order book of cTrader quotes indexed by MDEntryID (278).
+
+    Bids and asks are kept as sorted lists of (key, entry_id) where key is -price for bids
+    and price for asks, so the best level of both sides is always at index 0. Prices and
+    volumes of the levels are kept in parallel arrays in the same order, `commit` copies only
+    the levels from the first one changed since the previous commit into the fixed depth book.
+    Every side holds at most `depth` entries, the worst ones are dropped first.
+    """
+
+    def __init__(self, instrument_uid: str, depth: int = 50):
+        self.instrument_uid = instrument_uid
+        self.depth = depth
+        self.entries = {}       # entry_id -> (side, price, volume)
+        self.bids = []          # [(-price, entry_id)] best first
+        self.asks = []          # [(price, entry_id)] best first
+        self.bid_prices = array('d')
+        self.bid_volumes = array('d')
+        self.ask_prices = array('d')
+        self.ask_volumes = array('d')
+        self.bid_changed = 0    # first bid level changed since the previous commit
+        self.ask_changed = 0
+        self.timestamp = 0
+
+    def apply(self, action: bytes, side: bytes, entry_id, price: float | None, volume: float | None) -> None:
+        """
+        Apply one MDEntry
+        :param action: MDUpdateAction (279) b'0' new, b'1' change, b'2' delete
+        :param side: MDEntryType (269) b'0' bid, b'1' offer
+        :param entry_id: MDEntryID (278), the price is used if the entry has no id
+        :param price: MDEntryPx (270)
+        :param volume: MDEntrySize (271)
+        """
+        if entry_id is None:
+            entry_id = price
+        old = self.entries.pop(entry_id, None)
+        if old is not None:
+            old_side, old_price, old_volume = old
+            side = side or old_side
+            if price is None:
+                price = old_price
+            if volume is None:
+                volume = old_volume
+            if action != b'2' and side == old_side and price == old_price:
+                # A new size at the same price, the level keeps its place
+                i = self._index(side, price, entry_id)
+                self.entries[entry_id] = (side, price, volume)
+                self._mark(side, i)
+                (self.bid_volumes if side == b'0' else self.ask_volumes)[i] = volume or 0.0
+                return
+            self._remove(old_side, old_price, entry_id)
+        if action == b'2' or price is None or side not in (b'0', b'1'):
+            return
+        if side == b'0':
+            levels, prices, volumes, key = self.bids, self.bid_prices, self.bid_volumes, -price
+        else:
+            levels, prices, volumes, key = self.asks, self.ask_prices, self.ask_volumes, price
+        i = bisect_left(levels, (key, entry_id))
+        levels.insert(i, (key, entry_id))
+        prices.insert(i, price)
+        volumes.insert(i, volume or 0.0)
+        self.entries[entry_id] = (side, price, volume)
+        self._mark(side, i)
+        if len(levels) > self.depth:
+            del self.entries[levels.pop()[1]]
+            prices.pop()
+            volumes.pop()
+
+    def _index(self, side: bytes, price: float, entry_id) -> int:
+        levels = self.bids if side == b'0' else self.asks
+        return bisect_left(levels, (-price if side == b'0' else price, entry_id))
+
+    def _mark(self, side: bytes, i: int) -> None:
+        if side == b'0':
+            if i < self.bid_changed:
+                self.bid_changed = i
+        elif i < self.ask_changed:
+            self.ask_changed = i
+
+    def _remove(self, side: bytes, price: float, entry_id) -> None:
+        i = self._index(side, price, entry_id)
+        levels = self.bids if side == b'0' else self.asks
+        if i < len(levels) and levels[i] == (-price if side == b'0' else price, entry_id):
+            del levels[i]
+            if side == b'0':
+                del self.bid_prices[i], self.bid_volumes[i]
+            else:
+                del self.ask_prices[i], self.ask_volumes[i]
+            self._mark(side, i)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.bids.clear()
+        self.asks.clear()
+        del self.bid_prices[:], self.bid_volumes[:], self.ask_prices[:], self.ask_volumes[:]
+        self.bid_changed = self.ask_changed = 0
+
+    def commit(self, book: OrderBook) -> None:
+        """Copy the levels changed since the previous commit into a fixed depth book"""
+        book.update_sides(self.bid_prices, self.bid_volumes, self.ask_prices, self.ask_volumes, self.timestamp,
+                          self.bid_changed, self.ask_changed)
+        self.bid_changed = self.ask_changed = self.depth
+
+    def best_bid(self) -> float | None:
+        return -self.bids[0][0] if self.bids else None
+
+    def best_ask(self) -> float | None:
+        return self.asks[0][0] if self.asks else None
+
+    def top(self, side: bytes, n: int) -> list[tuple[float, float]]:
+        """Return up to n best (price, volume) entries of the side, b'0' bids or b'1' asks"""
+        levels = self.bids if side == b'0' else self.asks
+        entries = self.entries
+        return [entries[entry_id][1:] for _, entry_id in levels[:n]]
+
+
+class Subscription:
+    """Market data subscription of one instrument on one feed."""
+    PENDING = 'pending'     # request sent, no data yet
+    ACTIVE = 'active'       # data is coming
+    STALE = 'stale'         # no data for too long
+
+    __slots__ = ('guid', 'feed', 'instrument', 'state', 'updated')
+
+    def __init__(self, guid: str, feed: str, instrument: str):
+        self.guid = guid
+        self.feed = feed
+        self.instrument = instrument
+        self.state = Subscription.PENDING
+        self.updated = 0.0
+
+    def __repr__(self):
+        return f"Subscription({self.feed}:{self.instrument} {self.guid} {self.state})"
+
+
+class SubscriptionRegistry:
+    """
+    Bidirectional guid <-> instrument routing table shared by all feeds.
+    Instruments live in per-feed namespaces, so the same ticker can be subscribed on several feeds.
+    """
 
-class TradingData:
     def __init__(self):
-        self.guid = {}
-        self.order_book = {}
+        self.by_guid = {}           # guid -> Subscription
+        self.by_instrument = {}     # feed -> {instrument: Subscription}
+        self.clock = time.monotonic     # seconds of Subscription.updated, a simulated clock in replays
+
+    def register(self, feed: str, instrument: str) -> Subscription:
+        """Return the subscription of the instrument, a new pending one with a unique guid if needed"""
+        instruments = self.by_instrument.setdefault(feed, {})
+        subscription = instruments.get(instrument)
+        if subscription is None:
+            subscription = Subscription(self.generate_guid(), feed, instrument)
+            instruments[instrument] = subscription
+            self.by_guid[subscription.guid] = subscription
+        return subscription
+
+    def unregister(self, guid: str) -> Subscription | None:
+        subscription = self.by_guid.pop(guid, None)
+        if subscription is not None:
+            self.by_instrument[subscription.feed].pop(subscription.instrument, None)
+        return subscription
 
-    def generate_guid(self, asset) -> str:
+    def get(self, guid: str) -> Subscription | None:
+        return self.by_guid.get(guid)
+
+    def find(self, feed: str, instrument: str) -> Subscription | None:
+        return self.by_instrument.get(feed, {}).get(instrument)
+
+    def touch(self, guid: str) -> Subscription | None:
+        """Mark the subscription active on incoming data, return None for unknown guid"""
+        subscription = self.by_guid.get(guid)
+        if subscription is not None:
+            subscription.state = Subscription.ACTIVE
+            subscription.updated = self.clock()
+        return subscription
+
+    def mark_stale(self, max_age: float) -> list[Subscription]:
+        """Mark active subscriptions without data for max_age seconds as stale and return them"""
+        deadline = self.clock() - max_age
+        stale = []
+        for subscription in self.by_guid.values():
+            if subscription.state == Subscription.ACTIVE and subscription.updated < deadline:
+                subscription.state = Subscription.STALE
+                stale.append(subscription)
+        return stale
+
+    def states(self, feed: str | None = None) -> dict[str, str]:
+        """Return {instrument: state} of a feed or {feed:instrument: state} of all feeds"""
+        if feed is not None:
+            return {name: sub.state for name, sub in self.by_instrument.get(feed, {}).items()}
+        return {f"{sub.feed}:{sub.instrument}": sub.state for sub in self.by_guid.values()}
+
+    def generate_guid(self) -> str:
         while True:
             # Generate a new GUID
             guid = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8)) + '-' + \
@@ -31,8 +362,30 @@ class TradingData:
                    ''.join(random.choices(string.ascii_lowercase + string.digits, k=12))
 
             # Check if the GUID is unique
-            if guid not in self.guid:
-                self.guid[asset] = guid
+            if guid not in self.by_guid:
                 return guid
 
+
+class TradingData:
+    def __init__(self):
+        self.subscriptions = SubscriptionRegistry()
+        self.order_book = {}        # guid -> OrderBook
+        self.recorder = None        # utils.recorder.TickRecorder when recording is on
+        self.shared = None          # utils.shared_books.SharedBooks in a feed process of the multi-process mode
+
+    def get_book(self, guid: str) -> OrderBook:
+        """Return the order book of a subscription, created on first use"""
+        book = self.order_book.get(guid)
+        if book is None:
+            book = self.order_book[guid] = OrderBook(guid)
+        return book
+
+    def record(self, feed: str, instrument: str, book: OrderBook) -> None:
+        """Append a book update to the tick recording if it is on and copy it to shared memory"""
+        if self.recorder is not None:
+            self.recorder.record_book(feed, instrument, book)
+        if self.shared is not None:
+            self.shared.write(instrument, book)
+
+
 trading_data = TradingData()
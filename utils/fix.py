@@ -0,0 +1,178 @@
+import logging
+import re
+
+import simplefix
+
+
+logger = logging.getLogger('FixFramer')
+
+SOH = b'\x01'
+BEGIN_STRING = b'8='
+BODY_LENGTH = b'\x019='
+CHECKSUM = b'10='
+CHECKSUM_LEN = 7        # b'10=123\x01'
+HEADER_MAX_LEN = 32     # b'8=FIX.4.4\x019=12345\x01' with some slack
+
+
+class FixFramer:
+    """Incremental framer that splits a FIX byte stream into complete messages.
+
+    Message boundaries are found from BodyLength (9) and checked against the CheckSum (10)
+    field position, so the buffer is never copied or re-parsed to find where a message ends.
+    Complete frames are handed out as memoryview slices of the internal buffer and the buffer
+    is compacted once per read.
+    """
+
+    def __init__(self, min_read_size: int = 4096, max_read_size: int = 256 * 1024):
+        self.buffer = bytearray()
+        self.min_read_size = min_read_size
+        self.max_read_size = max_read_size
+        self.read_size = min_read_size
+
+    def feed(self, data: bytes) -> None:
+        """Append data received from the socket and adapt the next read size."""
+        self.buffer += data
+        received = len(data)
+        if received >= self.read_size:
+            self.read_size = min(self.read_size * 2, self.max_read_size)
+        elif received < self.read_size // 4:
+            self.read_size = max(self.read_size // 2, self.min_read_size)
+
+    def frames(self):
+        """Yield every complete frame in the buffer as a memoryview.
+
+        A frame is only valid until the consumer asks for the next one: the view is released
+        afterwards so that the buffer can be compacted. Copy it with bytes() to keep it.
+        """
+        buffer = self.buffer
+        end = len(buffer)
+        pos = 0
+        view = memoryview(buffer)
+        try:
+            while pos < end:
+                start = buffer.find(BEGIN_STRING, pos)
+                if start < 0:
+                    # Keep a possible partial b'8' at the tail, drop the rest
+                    pos = end - 1 if buffer.endswith(b'8') else end
+                    break
+                if start != pos:
+                    logger.warning(f"Skipped {start - pos} bytes of garbage before BeginString")
+                    pos = start
+
+                length_tag = buffer.find(BODY_LENGTH, start, start + HEADER_MAX_LEN)
+                if length_tag < 0:
+                    if end - start < HEADER_MAX_LEN:
+                        break   # header not fully received yet
+                    logger.warning("BodyLength not found, resynchronizing")
+                    pos = start + 1
+                    continue
+                length_end = buffer.find(SOH, length_tag + 3, start + HEADER_MAX_LEN)
+                if length_end < 0:
+                    if end - start < HEADER_MAX_LEN:
+                        break
+                    pos = start + 1
+                    continue
+                try:
+                    body_length = int(buffer[length_tag + 3:length_end])
+                except ValueError:
+                    logger.warning("Invalid BodyLength, resynchronizing")
+                    pos = start + 1
+                    continue
+
+                frame_end = length_end + 1 + body_length + CHECKSUM_LEN
+                if frame_end > end:
+                    break       # wait for the rest of the message
+                if not buffer.startswith(CHECKSUM, frame_end - CHECKSUM_LEN) or buffer[frame_end - 1] != 1:
+                    logger.warning("CheckSum not found at BodyLength boundary, resynchronizing")
+                    pos = start + 1
+                    continue
+
+                frame = view[start:frame_end]
+                pos = frame_end
+                try:
+                    yield frame
+                finally:
+                    frame.release()
+        finally:
+            view.release()
+            if pos:
+                del buffer[:pos]
+
+    def clear(self) -> None:
+        """Drop all buffered data, e.g. after a reconnect."""
+        self.buffer.clear()
+        self.read_size = self.min_read_size
+
+
+
+# Frames are searched with compiled patterns, they work on memoryviews of the framer buffer without a copy
+FIELD = re.compile(rb'\x01(\d+)=([^\x01]*)')
+MSG_TYPE = re.compile(rb'\x0135=([^\x01]*)\x01')
+SYMBOL = re.compile(rb'\x0155=([^\x01]*)\x01')
+MD_ENTRIES = re.compile(rb'\x01268=')
+
+
+def decode_frame(frame) -> simplefix.FixMessage:
+    """Decode one complete frame produced by FixFramer into a simplefix message."""
+    msg = simplefix.FixMessage()
+    for field in bytes(frame).split(SOH)[:-1]:
+        tag, _, value = field.partition(b'=')
+        msg.append_pair(tag, value)
+    return msg
+
+
+def frame_msg_type(frame) -> bytes:
+    """Return MsgType (35) of a frame (bytes or a memoryview) without decoding the whole message."""
+    match = MSG_TYPE.search(frame)
+    return match.group(1) if match else b''
+
+
+def decode_md_entries(frame) -> tuple[str | None, list[tuple]]:
+    """Walk the NoMDEntries (268) group of a 35=W or 35=X message once.
+
+    The frame may be bytes or a memoryview of the FixFramer buffer, it is not copied.
+    Returns the message level Symbol (55), if any, and a list of entry tuples
+    (action, side, entry_id, symbol, price, size). Entries of a snapshot have no
+    MDUpdateAction (279) and get action b'0' (new). Symbol defaults to the message
+    level one, price and size are None when the entry does not carry them.
+    """
+    group = MD_ENTRIES.search(frame)
+    if group is None:
+        return None, []
+    group = group.start()
+    symbol = None
+    symbol_match = SYMBOL.search(frame, 0, group + 1)
+    if symbol_match is not None:
+        symbol = symbol_match.group(1).decode('ascii')
+
+    entries = []
+    delimiter = None
+    action = b'0'
+    side = entry_id = price = size = None
+    entry_symbol = symbol
+    # Skip the 268 field itself
+    for tag, value in FIELD.findall(frame, group)[1:]:
+        if delimiter is None:
+            delimiter = tag
+        elif tag == delimiter:
+            entries.append((action, side, entry_id, entry_symbol, price, size))
+            action = b'0'
+            side = entry_id = price = size = None
+            entry_symbol = symbol
+        if tag == b'270':
+            price = float(value)
+        elif tag == b'271':
+            size = float(value)
+        elif tag == b'269':
+            side = value
+        elif tag == b'279':
+            action = value
+        elif tag == b'278':
+            entry_id = value
+        elif tag == b'55':
+            entry_symbol = value.decode('ascii')
+        elif tag == b'10':
+            break
+    if delimiter is not None and delimiter != b'10':
+        entries.append((action, side, entry_id, entry_symbol, price, size))
+    return symbol, entries
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+from array import array
+
+
+logger = logging.getLogger('Latency')
+
+# Stages of an update: socket read -> decoded -> committed to the book -> consumed by Calculate
+DECODE = 'decode'           # socket read to decoded entries/levels
+COMMIT = 'commit'           # decoded to book committed in td.trading_data
+CALCULATE = 'calculate'     # book committed to orders recalculated
+TOTAL = 'total'             # socket read to orders recalculated
+STAGES = (DECODE, COMMIT, CALCULATE, TOTAL)
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of ns values in the spirit of HdrHistogram.
+
+    Values below 2 ** PRECISION are counted exactly, larger ones in buckets of
+    2 ** (PRECISION - 1) steps per power of two, so every bucket is within ~1.6%
+    of its values. Recording is a bit_length, a shift and an array increment.
+    """
+    PRECISION = 7
+    SUB_BUCKETS = 1 << PRECISION
+    HALF = SUB_BUCKETS >> 1
+    MAX_SHIFT = 40          # up to ~2 ** 47 ns, about 39 hours
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * (self.SUB_BUCKETS + self.MAX_SHIFT * self.HALF)))
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        if value < 0:
+            value = 0
+        shift = value.bit_length() - self.PRECISION
+        if shift <= 0:
+            index = value
+        else:
+            shift = min(shift, self.MAX_SHIFT)
+            index = self.SUB_BUCKETS + (shift - 1) * self.HALF + (value >> shift) - self.HALF
+            index = min(index, len(self.counts) - 1)
+        self.counts[index] += 1
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def bucket_value(self, index: int) -> int:
+        '''Highest value counted in the bucket'''
+        if index < self.SUB_BUCKETS:
+            return index
+        shift = (index - self.SUB_BUCKETS) // self.HALF + 1
+        mantissa = (index - self.SUB_BUCKETS) % self.HALF + self.HALF
+        return ((mantissa + 1) << shift) - 1
+
+    def percentile(self, q: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, int(q / 100 * self.count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count:
+                seen += count
+                if seen >= rank:
+                    return min(self.bucket_value(index), self.max)
+        return self.max
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        if other.count and (not self.count or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+    def snapshot(self) -> dict:
+        '''Summary in microseconds'''
+        return {
+            'count': self.count,
+            'mean_us': round(self.total / self.count / 1000, 1) if self.count else 0.0,
+            'min_us': round(self.min / 1000, 1),
+            'p50_us': round(self.percentile(50) / 1000, 1),
+            'p99_us': round(self.percentile(99) / 1000, 1),
+            'p99_9_us': round(self.percentile(99.9) / 1000, 1),
+            'max_us': round(self.max / 1000, 1),
+        }
+
+
+class LatencyTracker:
+    """
+    Stage latencies per feed, instrument and stage.
+
+    Hot paths check `enabled` before taking any timestamp, so a disabled tracker costs one
+    attribute lookup per update.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms = {}        # (feed, instrument, stage) -> LatencyHistogram
+
+    def record(self, feed: str, instrument: str, stage: str, value: int) -> None:
+        histogram = self.histograms.get((feed, instrument, stage))
+        if histogram is None:
+            histogram = self.histograms[feed, instrument, stage] = LatencyHistogram()
+        histogram.record(value)
+
+    def record_commit(self, feed: str, instrument: str, book, received_ns: int, decoded_ns: int,
+                      committed_ns: int) -> None:
+        '''
+        Stamp a committed book and record its decode and commit stages
+        :param feed: 'alor' or 'ctrader'
+        :param instrument: 'SBER', 'EURUSD'
+        :param book: td.OrderBook, keeps the stamps for the Calculate stage
+        :param received_ns: time.monotonic_ns() of the socket read
+        :param decoded_ns: time.monotonic_ns() after decoding
+        :param committed_ns: time.monotonic_ns() after the book update
+        '''
+        book.received_ns = received_ns
+        book.committed_ns = committed_ns
+        if received_ns:
+            self.record(feed, instrument, DECODE, decoded_ns - received_ns)
+        self.record(feed, instrument, COMMIT, committed_ns - decoded_ns)
+
+    def record_calculated(self, feed: str, instrument: str, book, calculated_ns: int) -> None:
+        '''
+        Record the Calculate and total stages of a book consumed by Calculate
+        :param calculated_ns: time.monotonic_ns() after the dependent orders were recalculated
+        '''
+        if not book.committed_ns:
+            return
+        self.record(feed, instrument, CALCULATE, calculated_ns - book.committed_ns)
+        if book.received_ns:
+            self.record(feed, instrument, TOTAL, calculated_ns - book.received_ns)
+        # Every commit is counted once, even if Calculate runs again before the next update
+        book.committed_ns = 0
+
+    def snapshot(self, feed: str | None = None) -> dict:
+        '''
+        :param feed: 'alor' or 'ctrader', all feeds by default
+        :return: {'alor:SBER': {'decode': {...}, 'commit': {...}}, ...}
+        '''
+        result = {}
+        for (histogram_feed, instrument, stage), histogram in sorted(self.histograms.items()):
+            if feed is None or histogram_feed == feed:
+                result.setdefault(f'{histogram_feed}:{instrument}', {})[stage] = histogram.snapshot()
+        return result
+
+    def feed_totals(self) -> dict:
+        '''Histograms merged over the instruments of every feed: {(feed, stage): LatencyHistogram}'''
+        totals = {}
+        for (feed, _, stage), histogram in self.histograms.items():
+            total = totals.get((feed, stage))
+            if total is None:
+                total = totals[feed, stage] = LatencyHistogram()
+            total.merge(histogram)
+        return totals
+
+    def log_line(self) -> str:
+        totals = self.feed_totals()
+        parts = []
+        for feed in sorted({feed for feed, _ in totals}):
+            stages = []
+            for stage in STAGES:
+                histogram = totals.get((feed, stage))
+                if histogram is not None and histogram.count:
+                    summary = histogram.snapshot()
+                    stages.append(f"{stage} {summary['p50_us']}/{summary['p99_us']}/{summary['p99_9_us']}")
+            parts.append(f"{feed} [{', '.join(stages)}]")
+        return 'Latency us p50/p99/p99.9: ' + ('; '.join(parts) if parts else 'no data')
+
+    def reset(self) -> None:
+        self.histograms.clear()
+
+    async def report(self, interval: float = 60.0, reset: bool = True) -> None:
+        '''
+        Log the feed latencies every interval
+        :param interval: seconds
+        :param reset: start new histograms after every line
+        '''
+        while True:
+            await asyncio.sleep(interval)
+            if self.enabled:
+                logger.info(self.log_line())
+                if reset:
+                    self.reset()
+
+
+tracker = LatencyTracker()
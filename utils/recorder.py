@@ -0,0 +1,258 @@
+import glob
+import logging
+import mmap
+import os
+import struct
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger('TickRecorder')
+
+MAGIC = b'TICKREC1'
+VERSION = 1
+HEADER_SIZE = 64 * 1024
+# magic, version, depth, record size, record count, wall clock ns and monotonic ns at creation, instruments
+SEGMENT_HEADER = struct.Struct('<8sIIIQqQI')
+INSTRUMENT_SLOT = struct.Struct('<B31s')     # feed id, name
+INSTRUMENTS_OFFSET = 256
+MAX_INSTRUMENTS = (HEADER_SIZE - INSTRUMENTS_OFFSET) // INSTRUMENT_SLOT.size
+# monotonic ns, feed id, side, level count, instrument id; followed by depth prices and depth volumes
+RECORD_HEADER = struct.Struct('<QBBHI')
+FEEDS = ('alor', 'ctrader')
+BID = 0
+ASK = 1
+SUFFIX = '.tick'
+
+
+def record_size(depth: int) -> int:
+    return RECORD_HEADER.size + 16 * depth
+
+
+class TickRecorder:
+    '''
+    Append-only binary recorder of order book updates.
+
+    Records have a fixed size and are written into preallocated memory-mapped segment files,
+    so recording one update is a struct.pack_into and two memcpy without system calls.
+    The next segment is created and mapped by a background thread, rotation only swaps maps.
+    Every segment header holds the instrument table, so segments can be read one by one.
+    '''
+
+    def __init__(self, directory: str, depth: int = 20, segment_records: int = 200_000, prefix: str = 'ticks'):
+        '''
+        :param directory: where segment files are written
+        :param depth: levels stored per record, deeper levels are cut
+        :param segment_records: records per segment file
+        :param prefix: segment file name prefix
+        '''
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.depth = depth
+        self.record_size = record_size(depth)
+        self.segment_records = segment_records
+        self.segment_size = HEADER_SIZE + self.record_size * segment_records
+        self.prefix = f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}"
+        self.instruments = {}       # (feed id, instrument) -> instrument id
+        self.keys = {}              # (feed, instrument) -> (feed id, instrument id)
+        self.dropped = 0
+        self.segment_number = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='TickRecorder')
+        self.file = None
+        self.mm = None
+        self.path = None
+        self.count = 0
+        self.offset = HEADER_SIZE
+        self._open(*self._create_segment(self._next_path()))
+        self.next_segment = self.executor.submit(self._create_segment, self._next_path())
+
+    def _next_path(self) -> str:
+        self.segment_number += 1
+        return os.path.join(self.directory, f"{self.prefix}-{self.segment_number:04d}{SUFFIX}")
+
+    def _create_segment(self, path: str) -> tuple:
+        '''Allocate and map a segment, pages are dirtied here so appends do not page fault'''
+        file = open(path, 'w+b')
+        file.truncate(self.segment_size)
+        mm = mmap.mmap(file.fileno(), self.segment_size)
+        chunk = bytes(1 << 20)
+        for offset in range(0, self.segment_size, len(chunk)):
+            size = min(len(chunk), self.segment_size - offset)
+            mm[offset:offset + size] = chunk[:size]
+        return path, file, mm
+
+    def _open(self, path: str, file, mm: mmap.mmap) -> None:
+        self.path, self.file, self.mm = path, file, mm
+        self.count = 0
+        self.offset = HEADER_SIZE
+        self._write_header()
+        for (feed_id, instrument), instrument_id in self.instruments.items():
+            INSTRUMENT_SLOT.pack_into(mm, INSTRUMENTS_OFFSET + instrument_id * INSTRUMENT_SLOT.size,
+                                      feed_id, instrument.encode('utf-8'))
+
+    def _write_header(self) -> None:
+        SEGMENT_HEADER.pack_into(self.mm, 0, MAGIC, VERSION, self.depth, self.record_size, self.count,
+                                 time.time_ns(), time.monotonic_ns(), len(self.instruments))
+
+    def instrument_id(self, feed_id: int, instrument: str) -> int:
+        key = (feed_id, instrument)
+        instrument_id = self.instruments.get(key)
+        if instrument_id is None:
+            instrument_id = len(self.instruments)
+            if instrument_id >= MAX_INSTRUMENTS:
+                raise ValueError(f"Too many instruments for tick recorder: {instrument}")
+            self.instruments[key] = instrument_id
+            INSTRUMENT_SLOT.pack_into(self.mm, INSTRUMENTS_OFFSET + instrument_id * INSTRUMENT_SLOT.size,
+                                      feed_id, instrument.encode('utf-8'))
+            struct.pack_into('<I', self.mm, SEGMENT_HEADER.size - 4, len(self.instruments))
+        return instrument_id
+
+    def record(self, feed: str, instrument: str, side: int, prices: array, volumes: array, count: int) -> None:
+        '''
+        Append one side of a book
+        :param feed: 'alor' or 'ctrader'
+        :param instrument: 'SBER', 'EURUSD'
+        :param side: BID or ASK
+        :param prices: array('d') best level first
+        :param volumes: array('d') best level first
+        :param count: filled levels
+        '''
+        if self.count == self.segment_records and not self._rotate():
+            self.dropped += 1
+            return
+        key = self.keys.get((feed, instrument))
+        if key is None:
+            feed_id = FEEDS.index(feed)
+            key = self.keys[feed, instrument] = (feed_id, self.instrument_id(feed_id, instrument))
+        depth = self.depth
+        mm = self.mm
+        offset = self.offset
+        RECORD_HEADER.pack_into(mm, offset, time.monotonic_ns(), key[0], side, min(count, depth), key[1])
+        offset += RECORD_HEADER.size
+        size = 8 * depth
+        # Book arrays of the recorder depth are copied whole, levels past count are ignored by readers
+        if len(prices) == depth:
+            mm[offset:offset + size] = prices
+            mm[offset + size:offset + 2 * size] = volumes
+        else:
+            count = min(count, depth, len(prices))
+            mm[offset:offset + 8 * count] = memoryview(prices)[:count].cast('B')
+            mm[offset + size:offset + size + 8 * count] = memoryview(volumes)[:count].cast('B')
+        self.offset += self.record_size
+        self.count += 1
+
+    def record_book(self, feed: str, instrument: str, book) -> None:
+        '''
+        Append both sides of a td.OrderBook
+        :param feed: 'alor' or 'ctrader'
+        :param instrument: 'SBER', 'EURUSD'
+        :param book: utils.data.OrderBook
+        '''
+        self.record(feed, instrument, BID, book.bid_prices, book.bid_volumes, book.bid_count)
+        self.record(feed, instrument, ASK, book.ask_prices, book.ask_volumes, book.ask_count)
+
+    def _rotate(self) -> bool:
+        if not self.next_segment.done():
+            if self.dropped % 1000 == 0:
+                logger.warning("Next tick segment is not ready, dropping records")
+            return False
+        self._close_segment(self.executor)
+        self._open(*self.next_segment.result())
+        self.next_segment = self.executor.submit(self._create_segment, self._next_path())
+        return True
+
+    def _close_segment(self, executor: ThreadPoolExecutor | None = None) -> None:
+        '''Flush, cut to the used size and index the current segment, in background if executor is given'''
+        struct.pack_into('<Q', self.mm, 20, self.count)
+        mm, file, used, path = self.mm, self.file, self.offset, self.path
+
+        def close():
+            mm.flush()
+            mm.close()
+            file.truncate(used)
+            file.close()
+            try:
+                from utils.tick_index import index_segment  # tick_index imports this module
+                index_segment(path)
+            except Exception as e:
+                logger.error(f"Error indexing tick segment {path}: {e}")
+        if executor is None:
+            close()
+        else:
+            executor.submit(close)
+
+    def close(self) -> None:
+        '''Close the current segment and remove the prepared empty one'''
+        self._close_segment()
+        path, file, mm = self.next_segment.result()
+        mm.close()
+        file.close()
+        os.remove(path)
+        self.executor.shutdown()
+        logger.info(f"Tick recorder closed, last segment {self.path}, dropped {self.dropped} records")
+
+
+class TickSegment:
+    '''Read-only view of one segment file written by TickRecorder'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.depth, self.record_size, self.count, self.wall_ns, self.monotonic_ns, \
+            instruments = SEGMENT_HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a tick segment: {path}")
+        capacity = (len(self.mm) - HEADER_SIZE) // self.record_size
+        if not self.count and capacity:
+            # Segment of a crashed recorder: records are the prefix with non-zero timestamps
+            self.count = self._find_count(capacity)
+        self.count = min(self.count, capacity)
+        self.instruments = []       # instrument id -> (feed, instrument)
+        for i in range(instruments):
+            feed_id, name = INSTRUMENT_SLOT.unpack_from(self.mm, INSTRUMENTS_OFFSET + i * INSTRUMENT_SLOT.size)
+            self.instruments.append((FEEDS[feed_id], name.rstrip(b'\x00').decode('utf-8')))
+
+    def _find_count(self, capacity: int) -> int:
+        low, high = 0, capacity
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from('<Q', self.mm, HEADER_SIZE + middle * self.record_size)[0]:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def wall_time_ns(self, monotonic_ns: int) -> int:
+        '''Convert a record timestamp to wall clock ns'''
+        return self.wall_ns + monotonic_ns - self.monotonic_ns
+
+    def records(self, start: int = 0, stop: int | None = None):
+        '''
+        Yield (monotonic ns, feed, instrument, side, prices, volumes) of records [start, stop),
+        prices and volumes are memoryviews of the mapped file, release them before close()
+        '''
+        view = memoryview(self.mm)
+        depth = self.depth
+        stop = self.count if stop is None else min(stop, self.count)
+        offset = HEADER_SIZE + start * self.record_size
+        for _ in range(start, stop):
+            timestamp, feed_id, side, count, instrument_id = RECORD_HEADER.unpack_from(self.mm, offset)
+            levels = offset + RECORD_HEADER.size
+            prices = view[levels:levels + 8 * count].cast('d')
+            volumes = view[levels + 8 * depth:levels + 8 * (depth + count)].cast('d')
+            feed, instrument = self.instruments[instrument_id]
+            yield timestamp, feed, instrument, side, prices, volumes
+            offset += self.record_size
+
+    def close(self) -> None:
+        self.mm.close()
+        self.file.close()
+
+
+def segment_paths(path: str) -> list[str]:
+    '''Segment files of a recording directory or a single segment path, in recording order'''
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, f'*{SUFFIX}')))
+    return [path]
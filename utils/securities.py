@@ -0,0 +1,177 @@
+import logging
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from utils.web_requests import http_client
+
+
+logger = logging.getLogger('Securities')
+
+# One row per security and board, strings are ASCII padded with zeros
+SECURITY_DTYPE = np.dtype([
+    ('symbol', 'S32'),
+    ('board', 'S12'),
+    ('type', 'S16'),
+    ('lot_size', '<f8'),
+    ('price_step', '<f8'),
+    ('face_value', '<f8'),
+    ('expiry', '<i8'),          # time.time() seconds of the cancellation date, 0 for none
+])
+FUTURE_TYPES = (b'FUT', b'FUTURES')
+
+
+def to_record(security: dict) -> tuple:
+    '''Row of SECURITY_DTYPE from an Alor /md/v2/Securities item'''
+    cancellation = security.get('cancellation')
+    expiry = 0
+    if cancellation:
+        try:
+            expiry = int(datetime.fromisoformat(cancellation.replace('Z', '+00:00')).timestamp())
+        except ValueError:
+            pass
+    # A far-future cancellation means "never", bonds and stocks get 2100-01-01 or so
+    if expiry > 4_000_000_000:
+        expiry = 0
+    return (
+        str(security.get('symbol', '')).encode('ascii', 'replace')[:32],
+        str(security.get('board') or security.get('primary_board') or '').encode('ascii', 'replace')[:12],
+        str(security.get('type') or '').encode('ascii', 'replace')[:16],
+        float(security.get('lotsize') or 0),
+        float(security.get('minstep') or 0),
+        float(security.get('facevalue') or 0),
+        expiry,
+    )
+
+
+class SecuritiesCache:
+    '''
+    Full MOEX securities list in a local .npy file with O(1) lookups.
+
+    The list is downloaded page by page once per validity window and saved as a numpy record
+    array, later starts map the file instead of downloading. Indexes by ticker, board and
+    instrument type are built on load.
+    '''
+    PAGE = 1000
+
+    def __init__(self, path: str = 'securities.npy', ttl: float = 24 * 60 * 60):
+        '''
+        :param path: cache file
+        :param ttl: seconds the downloaded list stays valid
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.records = np.empty(0, dtype=SECURITY_DTYPE)
+        self.by_symbol = {}         # 'SBER' -> row of the first board, 'SBER@TQBR' -> row
+        self.by_board = {}          # 'TQBR' -> array of rows
+        self.by_type = {}           # 'CS' -> array of rows
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def valid(self) -> bool:
+        return os.path.exists(self.path) and os.path.getmtime(self.path) + self.ttl > time.time()
+
+    async def ensure(self, url: str, exchange: str = 'MOEX') -> None:
+        '''
+        Load the cache file while it is valid, download the list otherwise
+        :param url: Alor /md/v2/Securities url
+        :param exchange: 'MOEX'
+        '''
+        if self.valid:
+            self.load()
+            return
+        try:
+            await self.download(url, exchange)
+        except Exception as e:
+            if not os.path.exists(self.path):
+                raise
+            logger.warning(f"Securities download failed, using the stale cache {self.path}: {e}")
+            self.load()
+
+    async def download(self, url: str, exchange: str = 'MOEX') -> None:
+        '''Fetch every page of the securities list, save and load it'''
+        rows = []
+        offset = 0
+        while True:
+            page = await http_client.get(url, params={'exchange': exchange, 'limit': self.PAGE, 'offset': offset})
+            rows.extend(to_record(security) for security in page or ())
+            if not page or len(page) < self.PAGE:
+                break
+            offset += len(page)
+        records = np.array(rows, dtype=SECURITY_DTYPE)
+        # A crash while saving leaves the old cache in place
+        temporary = self.path + '.tmp.npy'
+        np.save(temporary, records)
+        os.replace(temporary, self.path)
+        logger.info(f"Downloaded {len(records)} securities to {self.path}")
+        self.load()
+
+    def load(self) -> None:
+        self.records = np.load(self.path, mmap_mode='r')
+        self._index()
+
+    def _index(self) -> None:
+        symbols = [symbol.decode('ascii') for symbol in self.records['symbol'].tolist()]
+        boards = [board.decode('ascii') for board in self.records['board'].tolist()]
+        self.by_symbol = {}
+        for row, (symbol, board) in enumerate(zip(symbols, boards)):
+            self.by_symbol.setdefault(symbol, row)
+            self.by_symbol[f'{symbol}@{board}'] = row
+        self.by_board = self._groups(self.records['board'])
+        self.by_type = self._groups(self.records['type'])
+
+    @staticmethod
+    def _groups(column: np.ndarray) -> dict:
+        '''{value: array of rows} of a string column'''
+        if not len(column):
+            return {}
+        values, inverse = np.unique(column, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(values) + 1))
+        return {value.decode('ascii'): order[bounds[i]:bounds[i + 1]] for i, value in enumerate(values.tolist())}
+
+    def row(self, symbol: str, board: str | None = None) -> int | None:
+        return self.by_symbol.get(symbol if board is None else f'{symbol}@{board}')
+
+    def get(self, symbol: str, board: str | None = None) -> dict | None:
+        '''
+        :param symbol: 'SBER', 'SILV-3.25'
+        :param board: 'TQBR', the first listed board by default
+        :return: {'symbol': 'SBER', 'board': 'TQBR', 'type': 'CS', 'lot_size': 10.0, ...}
+        '''
+        row = self.row(symbol, board)
+        if row is None:
+            return None
+        record = self.records[row]
+        return {name: value.decode('ascii') if isinstance(value, bytes) else value
+                for name, value in zip(SECURITY_DTYPE.names, record.tolist())}
+
+    def lot_size(self, symbol: str, board: str | None = None) -> float | None:
+        row = self.row(symbol, board)
+        return None if row is None else float(self.records['lot_size'][row])
+
+    def multiplier(self, symbol: str, board: str | None = None) -> float | None:
+        '''
+        Units of the underlying per traded lot: the contract size of futures, the lot size otherwise
+        :param symbol: 'SILV-3.25', 'SBER'
+        '''
+        row = self.row(symbol, board)
+        if row is None:
+            return None
+        record = self.records[row]
+        if record['type'] in FUTURE_TYPES and record['face_value']:
+            return float(record['face_value'])
+        return float(record['lot_size'])
+
+    def symbols(self, board: str | None = None, type: str | None = None) -> list:
+        '''Tickers listed on a board and/or of an instrument type'''
+        rows = np.arange(len(self.records))
+        if board is not None:
+            rows = np.intersect1d(rows, self.by_board.get(board, ()))
+        if type is not None:
+            rows = np.intersect1d(rows, self.by_type.get(type, ()))
+        return [symbol.decode('ascii') for symbol in self.records['symbol'][rows].tolist()]
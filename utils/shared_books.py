@@ -0,0 +1,193 @@
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from utils.data import OrderBook
+
+
+MAGIC = b'SHBOOKS1'
+VERSION = 1
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('depth', '<u4'),
+    ('slots', '<u4'),
+    ('used', '<u4'),            # slots with an instrument name, only grows
+])
+HEADER_SIZE = 64
+
+
+def slot_dtype(depth: int) -> np.dtype:
+    '''Layout of one book slot, `seq` is odd while the writer is inside the slot'''
+    return np.dtype([
+        ('seq', '<u8'),
+        ('instrument', 'S32'),
+        ('timestamp', '<i8'),
+        ('received_ns', '<u8'),
+        ('committed_ns', '<u8'),
+        ('bid_count', '<u4'),
+        ('ask_count', '<u4'),
+        ('bid_prices', '<f8', (depth,)),
+        ('bid_volumes', '<f8', (depth,)),
+        ('ask_prices', '<f8', (depth,)),
+        ('ask_volumes', '<f8', (depth,)),
+    ], align=True)
+
+
+class SharedBooks:
+    '''
+    Fixed-layout order books of one feed in a multiprocessing.shared_memory segment.
+
+    One writer process, any number of readers. Every slot is a seqlock: the writer makes
+    `seq` odd, copies the book and makes it even again, a reader copies the slot and retries
+    if `seq` was odd or moved meanwhile. Readers find changed slots with one vectorised
+    compare of the seq column and never block the writer. Stores are not reordered by x86
+    CPUs, on weaker memory models the pairs of seq stores would need fences.
+    '''
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        if self.header['magic'] != MAGIC or self.header['version'] != VERSION:
+            raise ValueError(f'{shm.name} is not a shared books segment')
+        self.depth = int(self.header['depth'])
+        self.capacity = int(self.header['slots'])
+        slots = np.ndarray((self.capacity,), dtype=slot_dtype(self.depth), buffer=shm.buf, offset=HEADER_SIZE)
+        self.slots = slots
+        self.seq = slots['seq']
+        self.bid_prices = slots['bid_prices']
+        self.bid_volumes = slots['bid_volumes']
+        self.ask_prices = slots['ask_prices']
+        self.ask_volumes = slots['ask_volumes']
+        self.index = {}             # instrument -> slot
+        self.names = []             # slot -> instrument
+        self.seen = np.zeros(self.capacity, dtype='<u8')    # reader: seq of the last read per slot
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @classmethod
+    def create(cls, name: str | None = None, depth: int = 20, slots: int = 256) -> 'SharedBooks':
+        '''
+        :param name: segment name, a random one by default
+        :param depth: levels per side
+        :param slots: most instruments the segment can hold
+        '''
+        size = HEADER_SIZE + slots * slot_dtype(depth).itemsize
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[:size] = bytes(size)
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['depth'] = depth
+        header['slots'] = slots
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str, track: bool = False) -> 'SharedBooks':
+        '''
+        :param name: segment name of the creator
+        :param track: register the segment with the resource tracker of this process, which unlinks
+                      it at exit. Readers and writers of a segment created elsewhere leave it to the creator
+        '''
+        shm = shared_memory.SharedMemory(name=name)
+        if not track:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    # Writer
+
+    def allocate(self, instrument: str) -> int:
+        slot = int(self.header['used'])
+        if slot >= self.capacity:
+            raise OverflowError(f'All {self.capacity} slots of {self.name} are used')
+        self.slots['instrument'][slot] = instrument.encode('utf-8')[:32]
+        # The name is in place before readers see the slot
+        self.header['used'] = slot + 1
+        self.index[instrument] = slot
+        self.names.append(instrument)
+        return slot
+
+    def write(self, instrument: str, book: OrderBook) -> None:
+        '''Copy a committed book into its slot, allocated on first use'''
+        slot = self.index.get(instrument)
+        if slot is None:
+            slot = self.allocate(instrument)
+        depth = min(self.depth, book.depth)
+        seq = int(self.seq[slot])
+        self.seq[slot] = seq + 1
+        record = self.slots[slot]
+        record['timestamp'] = book.timestamp
+        record['received_ns'] = book.received_ns
+        record['committed_ns'] = book.committed_ns
+        record['bid_count'] = min(book.bid_count, depth)
+        record['ask_count'] = min(book.ask_count, depth)
+        self.bid_prices[slot, :depth] = book.bid_prices[:depth]
+        self.bid_volumes[slot, :depth] = book.bid_volumes[:depth]
+        self.ask_prices[slot, :depth] = book.ask_prices[:depth]
+        self.ask_volumes[slot, :depth] = book.ask_volumes[:depth]
+        self.seq[slot] = seq + 2
+
+    # Reader
+
+    def refresh_names(self) -> None:
+        '''Pick up slots allocated by the writer since the last call'''
+        used = int(self.header['used'])
+        for slot in range(len(self.names), used):
+            instrument = self.slots['instrument'][slot].decode('utf-8')
+            self.names.append(instrument)
+            self.index[instrument] = slot
+
+    def changed(self) -> np.ndarray:
+        '''Slots written since their last read'''
+        if int(self.header['used']) != len(self.names):
+            self.refresh_names()
+        used = len(self.names)
+        return np.flatnonzero(self.seq[:used] != self.seen[:used])
+
+    def read(self, slot: int, book: OrderBook) -> None:
+        '''Copy a consistent state of the slot into a local book, spins while the writer is inside'''
+        record = self.slots[slot]
+        bid_prices = memoryview(book.bid_prices)
+        bid_volumes = memoryview(book.bid_volumes)
+        ask_prices = memoryview(book.ask_prices)
+        ask_volumes = memoryview(book.ask_volumes)
+        depth = min(self.depth, book.depth)
+        while True:
+            seq = int(self.seq[slot])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            bid_prices[:depth] = self.bid_prices[slot, :depth]
+            bid_volumes[:depth] = self.bid_volumes[slot, :depth]
+            ask_prices[:depth] = self.ask_prices[slot, :depth]
+            ask_volumes[:depth] = self.ask_volumes[slot, :depth]
+            bid_count = int(record['bid_count'])
+            ask_count = int(record['ask_count'])
+            timestamp = int(record['timestamp'])
+            received_ns = int(record['received_ns'])
+            committed_ns = int(record['committed_ns'])
+            if int(self.seq[slot]) == seq:
+                break
+        self.seen[slot] = seq
+        book.bid_count = min(bid_count, depth)
+        book.ask_count = min(ask_count, depth)
+        book.timestamp = timestamp
+        book.received_ns = received_ns
+        book.committed_ns = committed_ns
+        book.seq += 1
+
+    def close(self) -> None:
+        # Views of the buffer go first, SharedMemory.close fails while they exist
+        del self.header, self.slots, self.seq, self.bid_prices, self.bid_volumes, self.ask_prices, self.ask_volumes
+        self.shm.close()
+        if self.owner:
+            # Spawned children share the resource tracker of the creator, one attached without tracking
+            # dropped the registration of the segment there. Registering again is a no-op otherwise
+            # and keeps the unregister of unlink from failing in the tracker
+            resource_tracker.register(self.shm._name, 'shared_memory')
+            self.shm.unlink()
@@ -0,0 +1,90 @@
+import time
+from types import MappingProxyType
+
+
+EMPTY = MappingProxyType({})
+
+
+class Snapshot:
+    '''
+    Immutable state of the screen at one moment.
+
+    Orders are a tuple of read-only row mappings, books map (feed, instrument) to
+    (best bid, best ask). Nothing in a published snapshot is changed afterwards.
+    '''
+    __slots__ = ('seq', 'created_ns', 'settings', 'orders', 'books', 'usdrub', 'connected')
+
+    def __init__(self, seq: int, settings, orders: tuple, books, usdrub: str, connected: bool):
+        self.seq = seq
+        self.created_ns = time.monotonic_ns()
+        self.settings = settings
+        self.orders = orders
+        self.books = books
+        self.usdrub = usdrub
+        self.connected = connected
+
+    def __repr__(self):
+        return f"Snapshot(seq={self.seq}, {len(self.orders)} orders, {len(self.books)} books)"
+
+
+class SnapshotPublisher:
+    '''
+    Handoff of the screen state from the asyncio thread to the Qt thread without locks.
+
+    The writer builds a new Snapshot next to the current one and publishes it with a single
+    reference store, which is atomic in CPython. Readers take `latest` at any time and keep
+    a consistent state for as long as they hold it. Unchanged rows and books are shared with
+    the previous snapshot, so publishing copies only what changed.
+    '''
+
+    def __init__(self):
+        self.latest = Snapshot(0, EMPTY, (), EMPTY, '', False)
+
+    def publish(self, data: dict | None = None, rows=None, books: dict | None = None, usdrub: str | None = None,
+                connected: bool | None = None) -> Snapshot:
+        '''
+        Publish the next snapshot, only from the asyncio thread
+        :param data: Calculate.data, its orders are copied when given
+        :param rows: indexes of the changed orders, all orders by default
+        :param books: {(feed, instrument): td.OrderBook} of the changed books
+        :param usdrub: USDRUB rate
+        :param connected: feed connection state
+        :return: the published snapshot
+        '''
+        previous = self.latest
+        settings, orders = previous.settings, previous.orders
+        if data is not None:
+            settings = MappingProxyType({key: value for key, value in data.items() if key != 'orders'})
+            table = data.get('orders') or ()
+            if rows is None or len(table) != len(orders):
+                orders = tuple(MappingProxyType(dict(order)) for order in table)
+            elif rows:
+                orders = list(orders)
+                for i in rows:
+                    orders[i] = MappingProxyType(dict(table[i]))
+                orders = tuple(orders)
+        snapshot_books = previous.books
+        if books:
+            snapshot_books = dict(previous.books)
+            for key, book in books.items():
+                snapshot_books[key] = (book.best_bid(), book.best_ask())
+            snapshot_books = MappingProxyType(snapshot_books)
+        snapshot = Snapshot(
+            previous.seq + 1,
+            settings,
+            orders,
+            snapshot_books,
+            previous.usdrub if usdrub is None else usdrub,
+            previous.connected if connected is None else connected,
+        )
+        self.latest = snapshot
+        return snapshot
+
+    def read(self, seq: int = -1) -> Snapshot | None:
+        '''
+        Never blocks, for the Qt thread
+        :param seq: seq of the snapshot the reader already has
+        :return: the latest snapshot, None if it is still the one with seq
+        '''
+        snapshot = self.latest
+        return None if snapshot.seq == seq else snapshot
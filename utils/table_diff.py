@@ -0,0 +1,52 @@
+import math
+
+
+def cell(value):
+    '''Plain Python value of a cell, numpy scalars and NaN included'''
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class TableDiff:
+    '''
+    Changed cells of the order table since the last emitted state.
+
+    The first call and every new table give all cells, later calls only the cells whose
+    value differs from the one already sent, so the GUI repaints just those.
+    '''
+
+    def __init__(self):
+        self.table = None       # the orders list of the last state
+        self.sent = []          # [{field: value}, ...] as emitted
+
+    def reset(self) -> None:
+        self.table = None
+        self.sent = []
+
+    def diff(self, orders: list, rows=None) -> dict:
+        '''
+        :param orders: Calculate.data['orders']
+        :param rows: indexes of the rows that may have changed, all rows by default
+        :return: {row: {field: value}} of the changed cells, {} if nothing changed
+        '''
+        if orders is not self.table or len(orders) != len(self.sent):
+            self.table = orders
+            self.sent = [{} for _ in orders]
+            rows = None
+        changes = {}
+        for i in range(len(orders)) if rows is None else rows:
+            if i >= len(orders):
+                continue
+            sent = self.sent[i]
+            changed = {}
+            for field, value in orders[i].items():
+                value = cell(value)
+                if field not in sent or sent[field] != value:
+                    sent[field] = value
+                    changed[field] = value
+            if changed:
+                changes[i] = changed
+        return changes
@@ -0,0 +1,229 @@
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+
+from utils.recorder import HEADER_SIZE, TickSegment, segment_paths
+
+
+logger = logging.getLogger('TickIndex')
+
+INDEX_SUFFIX = '.idx.npz'
+BUCKET_NS = 1_000_000_000
+
+
+def record_dtype(depth: int) -> np.dtype:
+    '''NumPy layout of one TickRecorder record'''
+    return np.dtype([
+        ('timestamp', '<u8'),
+        ('feed', 'u1'),
+        ('side', 'u1'),
+        ('count', '<u2'),
+        ('instrument', '<u4'),
+        ('prices', '<f8', (depth,)),
+        ('volumes', '<f8', (depth,)),
+    ])
+
+
+def to_ns(value) -> int | None:
+    '''Wall clock ns of a datetime, a time.time() float or ns int'''
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1e9)
+    return int(value * 1e9)
+
+
+class SegmentIndex:
+    '''
+    Sparse index of one segment: for every instrument and time bucket the first and the last
+    record number holding that instrument. Rows are sorted by instrument then bucket.
+    '''
+
+    def __init__(self, bucket_ns: int, instrument: np.ndarray, bucket: np.ndarray, first: np.ndarray, last: np.ndarray):
+        self.bucket_ns = bucket_ns
+        self.instrument = instrument
+        self.bucket = bucket            # bucket number, monotonic ns // bucket_ns
+        self.first = first
+        self.last = last                # inclusive
+
+    @classmethod
+    def build(cls, segment: TickSegment, bucket_ns: int = BUCKET_NS) -> 'SegmentIndex':
+        '''Build the index with one pass of NumPy over the mapped records'''
+        records = np.frombuffer(segment.mm, record_dtype(segment.depth), segment.count, HEADER_SIZE)
+        keys = records['instrument'].astype(np.int64) << 40 | (records['timestamp'] // bucket_ns).astype(np.int64)
+        del records
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+        ends = np.r_[starts[1:], len(keys)] - 1 if len(keys) else starts
+        unique = keys[starts]
+        # order is stable, so the first and the last record of every key are at its bounds
+        return cls(bucket_ns, (unique >> 40).astype(np.uint32), unique & ((1 << 40) - 1),
+                   order[starts].astype(np.uint64), order[ends].astype(np.uint64))
+
+    @classmethod
+    def load(cls, path: str) -> 'SegmentIndex':
+        with np.load(path) as data:
+            return cls(int(data['bucket_ns']), data['instrument'], data['bucket'], data['first'], data['last'])
+
+    def save(self, path: str) -> None:
+        # np.savez appends .npz to names without it, write through a file object to keep the name
+        with open(path, 'wb') as f:
+            np.savez(f, bucket_ns=self.bucket_ns, instrument=self.instrument, bucket=self.bucket,
+                     first=self.first, last=self.last)
+
+    def spans(self, instrument_ids, start_ns: int | None = None, end_ns: int | None = None) -> list[tuple[int, int]]:
+        '''
+        Record ranges that can hold the instruments in [start_ns, end_ns)
+        :param instrument_ids: segment instrument ids
+        :param start_ns: monotonic ns of the segment clock
+        :param end_ns: monotonic ns of the segment clock
+        :return: sorted, merged [(first, stop)] of record numbers
+        '''
+        selected = np.isin(self.instrument, list(instrument_ids))
+        if start_ns is not None:
+            selected &= self.bucket >= start_ns // self.bucket_ns
+        if end_ns is not None:
+            selected &= self.bucket <= end_ns // self.bucket_ns
+        ranges = sorted(zip(self.first[selected].tolist(), (self.last[selected] + 1).tolist()))
+        merged = []
+        for first, stop in ranges:
+            if merged and first <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([first, stop])
+        return [(first, stop) for first, stop in merged]
+
+
+def segment_index(segment: TickSegment, bucket_ns: int = BUCKET_NS) -> SegmentIndex:
+    '''Index of a segment from its .idx.npz file, built and saved on first use'''
+    path = segment.path + INDEX_SUFFIX
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(segment.path):
+        index = SegmentIndex.load(path)
+        if index.bucket_ns == bucket_ns:
+            return index
+    index = SegmentIndex.build(segment, bucket_ns)
+    try:
+        index.save(path)
+    except OSError as e:
+        logger.warning(f"Can't save tick index {path}: {e}")
+    return index
+
+
+def index_segment(path: str, bucket_ns: int = BUCKET_NS) -> None:
+    '''Build and save the index of a finished segment, used by TickRecorder on rotation'''
+    segment = TickSegment(path)
+    try:
+        segment_index(segment, bucket_ns)
+    finally:
+        segment.close()
+
+
+class TickSlice:
+    '''
+    Records of one segment span matching a query.
+
+    `records` is a zero-copy structured view of the mapped span, other instruments recorded in
+    between are skipped by `rows`. Column properties gather the matching rows.
+    '''
+
+    def __init__(self, segment: TickSegment, records: np.ndarray, rows: np.ndarray):
+        self.segment = segment
+        self.records = records
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        '''Wall clock ns'''
+        return self.records['timestamp'][self.rows].astype(np.int64) + (self.segment.wall_ns - self.segment.monotonic_ns)
+
+    @property
+    def instruments(self) -> list[tuple[str, str]]:
+        return [self.segment.instruments[i] for i in self.records['instrument'][self.rows].tolist()]
+
+    @property
+    def sides(self) -> np.ndarray:
+        return self.records['side'][self.rows]
+
+    @property
+    def counts(self) -> np.ndarray:
+        return self.records['count'][self.rows]
+
+    @property
+    def prices(self) -> np.ndarray:
+        return self.records['prices'][self.rows]
+
+    @property
+    def volumes(self) -> np.ndarray:
+        return self.records['volumes'][self.rows]
+
+
+class TickStore:
+    '''
+    Indexed queries over a recording directory.
+
+        store = TickStore('ticks')
+        for part in store.query(['SBER', 'SBERP'], datetime(2025, 3, 3, 10), datetime(2025, 3, 3, 10, 5)):
+            part.prices, part.sides
+    '''
+
+    def __init__(self, path: str, bucket_ns: int = BUCKET_NS):
+        '''
+        :param path: recording directory or one segment file
+        :param bucket_ns: time bucket of the index
+        '''
+        self.bucket_ns = bucket_ns
+        self.segments = [TickSegment(segment_path) for segment_path in segment_paths(path)]
+
+    def spans(self, segment: TickSegment, instruments, start=None, end=None, feed: str | None = None) -> tuple:
+        '''
+        Record ranges of one segment for a query
+        :return: (instrument ids, monotonic start ns, monotonic end ns, [(first, stop)])
+        '''
+        if isinstance(instruments, str):
+            instruments = [instruments]
+        ids = [i for i, (instrument_feed, name) in enumerate(segment.instruments)
+               if name in instruments and (feed is None or instrument_feed == feed)]
+        offset = segment.wall_ns - segment.monotonic_ns
+        start_ns = to_ns(start)
+        end_ns = to_ns(end)
+        start_ns = None if start_ns is None else start_ns - offset
+        end_ns = None if end_ns is None else end_ns - offset
+        if not ids or not segment.count:
+            return ids, start_ns, end_ns, []
+        return ids, start_ns, end_ns, segment_index(segment, self.bucket_ns).spans(ids, start_ns, end_ns)
+
+    def query(self, instruments, start=None, end=None, feed: str | None = None) -> list[TickSlice]:
+        '''
+        Records of the instruments in [start, end)
+        :param instruments: 'SBER' or ['SBER', 'SBERP']
+        :param start: datetime, time.time() float or wall clock ns, None for the beginning
+        :param end: datetime, time.time() float or wall clock ns, None for the end
+        :param feed: 'alor' or 'ctrader', None for both
+        :return: list of TickSlice in recording order
+        '''
+        result = []
+        for segment in self.segments:
+            ids, start_ns, end_ns, spans = self.spans(segment, instruments, start, end, feed)
+            dtype = record_dtype(segment.depth)
+            for first, stop in spans:
+                records = np.frombuffer(segment.mm, dtype, stop - first, HEADER_SIZE + first * segment.record_size)
+                selected = np.isin(records['instrument'], ids)
+                if start_ns is not None:
+                    selected &= records['timestamp'] >= start_ns
+                if end_ns is not None:
+                    selected &= records['timestamp'] < end_ns
+                rows = np.flatnonzero(selected)
+                if len(rows):
+                    result.append(TickSlice(segment, records, rows))
+        return result
+
+    def close(self) -> None:
+        '''Query results must be released first, they are views of the mapped files'''
+        for segment in self.segments:
+            segment.close()
@@ -1,7 +1,15 @@
-from curl_cffi.requests import AsyncSession
+import asyncio
+import json
+import random
+import time
+
+from curl_cffi.requests import AsyncSession, RequestsError
 from utils import exceptions
 
 
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
 def aiohttp_params(params: dict[str, ...] | None) -> dict[str, str | int | float] | None:
     """
     Convert requests params to aiohttp params.
@@ -30,6 +38,184 @@ def aiohttp_params(params: dict[str, ...] | None) -> dict[str, str | int | float
     return new_params
 
 
+class HttpClient:
+    """
+    Long-lived HTTP client shared by the REST calls.
+
+    One curl_cffi session per event loop keeps connections alive between calls. A semaphore
+    bounds the requests in flight. 429/5xx answers and connection errors are retried with
+    full-jitter exponential backoff. GETs with a cache TTL are served from memory until they
+    expire, and concurrent identical GETs share one request.
+    """
+
+    def __init__(self, timeout: float = 30.0, max_concurrency: int = 10, retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 8.0, cache_ttl: float = 0.0) -> None:
+        """
+        Initialize the client.
+
+        Args:
+            timeout (float): seconds per request attempt. (30.0)
+            max_concurrency (int): requests in flight at once. (10)
+            retries (int): extra attempts after a 429/5xx answer or a connection error. (3)
+            backoff (float): base delay of the first retry, seconds. (0.5)
+            max_backoff (float): cap of the retry delay, seconds. (8.0)
+            cache_ttl (float): default lifetime of cached GET responses, 0 to not cache. (0.0)
+
+        """
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache_ttl = cache_ttl
+        self.cache = {}             # (url, params) -> (expiry time.monotonic(), response)
+        self.pending = {}           # (url, params) -> future of the GET in flight
+        self.session = None
+        self.semaphore = None
+        self.loop = None
+
+    async def _session(self) -> AsyncSession:
+        # Sessions and semaphores belong to one event loop, the worker thread runs its own
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            old_session, old_loop = self.session, self.loop
+            # Swapped before the await below, concurrent callers already use the new session
+            self.loop = loop
+            self.session = AsyncSession(max_clients=self.max_concurrency, timeout=self.timeout)
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.pending.clear()
+            if old_session is not None:
+                # Connections of the previous loop are released, on that loop while it still runs
+                if old_loop.is_running():
+                    await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(old_session.close(), old_loop))
+                else:
+                    await old_session.close()
+        return self.session
+
+    def delay(self, attempt: int, retry_after: str | None = None) -> float:
+        """
+        Seconds to wait before the next attempt.
+
+        Args:
+            attempt (int): number of the failed attempt, from 0.
+            retry_after (Optional[str]): Retry-After header of the answer. (None)
+
+        Returns:
+            float: the Retry-After seconds if given, else a random delay up to the capped exponential backoff.
+
+        """
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def request(self, method: str, url: str, headers: dict | None = None, **kwargs) -> dict | None:
+        """
+        Make a request with retries and check if it was successful.
+
+        Args:
+            method (str): 'GET' or 'POST'.
+            url (str): a URL.
+            headers (Optional[dict]): the headers. (None)
+            **kwargs: arguments for the request, e.g. 'params', 'data' or 'json'.
+
+        Returns:
+            Optional[dict]: received dictionary in response.
+
+        """
+        session = await self._session()
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    response = await session.request(method, url, headers=headers, **kwargs)
+            except RequestsError:
+                if attempt >= self.retries:
+                    raise
+                await asyncio.sleep(self.delay(attempt))
+                attempt += 1
+                continue
+            status_code = response.status_code
+            if status_code in RETRY_STATUSES and attempt < self.retries:
+                await asyncio.sleep(self.delay(attempt, response.headers.get('Retry-After')))
+                attempt += 1
+                continue
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+            if status_code <= 201:
+                return data
+            raise exceptions.HTTPException(response=data, status_code=status_code)
+
+    async def get(self, url: str, headers: dict | None = None, cache_ttl: float | None = None,
+                  **kwargs) -> dict | None:
+        """
+        Make a GET request, served from the cache while a cached response is fresh.
+
+        Args:
+            url (str): a URL.
+            headers (Optional[dict]): the headers. (None)
+            cache_ttl (Optional[float]): seconds to keep the response, the client default if None. (None)
+            **kwargs: arguments for a GET request, e.g. 'params'.
+
+        Returns:
+            Optional[dict]: received dictionary in response.
+
+        """
+        ttl = self.cache_ttl if cache_ttl is None else cache_ttl
+        if not ttl:
+            return await self.request('GET', url, headers=headers, **kwargs)
+        key = (url, json.dumps(kwargs.get('params'), sort_keys=True, default=str))
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        await self._session()
+        future = self.pending.get(key)
+        if future is None:
+            future = self.pending[key] = asyncio.ensure_future(
+                self.request('GET', url, headers=headers, **kwargs))
+            future.add_done_callback(lambda _: self.pending.pop(key, None))
+        response = await asyncio.shield(future)
+        self.cache[key] = (time.monotonic() + ttl, response)
+        return response
+
+    async def post(self, url: str, headers: dict | None = None, **kwargs) -> dict | None:
+        """
+        Make a POST request, never cached.
+
+        Args:
+            url (str): a URL.
+            headers (Optional[dict]): headers. (None)
+            **kwargs: arguments for a POST request, e.g. 'params', 'data' or 'json'.
+
+        Returns:
+            Optional[dict]: a JSON response to request.
+
+        """
+        return await self.request('POST', url, headers=headers, **kwargs)
+
+    def invalidate(self, url: str | None = None) -> None:
+        """Drop cached responses of a URL, or all of them."""
+        if url is None:
+            self.cache.clear()
+        else:
+            for key in [key for key in self.cache if key[0] == url]:
+                del self.cache[key]
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+            self.loop = None
+
+
+# The client of every REST call of the screener
+http_client = HttpClient()
+
+
 async def async_get(url: str, headers: dict | None = None, **kwargs) -> dict | None:
     """
     Make a GET request and check if it was successful.
@@ -43,19 +229,7 @@ async def async_get(url: str, headers: dict | None = None, **kwargs) -> dict | N
         Optional[dict]: received dictionary in response.
 
     """
-    async with AsyncSession() as session:
-        response = await session.get(
-            url=url,
-            headers=headers,
-            **kwargs,
-            # params=params,
-            # proxy=proxy_url
-        )
-        status_code = response.status_code
-        response = response.json(encoding='utf-8')
-        if status_code <= 201:
-            return response
-        raise exceptions.HTTPException(response=response, status_code=status_code)
+    return await http_client.get(url, headers=headers, **kwargs)
 
 
 async def async_post(
@@ -74,15 +248,4 @@ async def async_post(
         Optional[dict]: a JSON response to request.
 
     """
-    async with AsyncSession() as session:
-        response = await session.post(
-            url=url,
-            headers=headers,
-            **kwargs,
-        )
-        # print(f'Debug async_post: {url=} {response=}')
-        status_code = response.status_code
-        response = response.json()
-        if status_code <= 201:
-            return response
-        raise exceptions.HTTPException(response=response, status_code=status_code)
+    return await http_client.post(url, headers=headers, **kwargs)